@@ -0,0 +1,157 @@
+"""
+長輩圖逐字繪製基準測試 - 比較每字一張大畫布與 glyph_atlas 小圖塊的文字圖層繪製時間
+
+800x800 背景、12 個字、描邊 12px，依 create_meme_image 的 wave / gentle / straight 樣式繪製
+cold（主要結果）：每張圖使用新的快取。實際上每張圖的字體大小、±2px 抖動與 AI 選的顏色都不同，大多數長輩圖走這條路
+new color：旋轉字的遮罩已在快取中、但顏色不同
+warm：同樣的字與顏色已在快取中（例如常見的「早安」「平安」）
+未旋轉的字（gentle / straight）一律直接繪製、不經過快取，三欄相同；速度受 FreeType 描邊限制
+
+用法：python benchmarks/bench_glyph_render.py [--font static/fonts/NotoSansTC-Bold.ttf] [--rounds 20]
+"""
+import os
+import sys
+import time
+import math
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat  # noqa: E402
+
+from font_registry import font_registry  # noqa: E402
+from glyph_atlas import GlyphAtlas  # noqa: E402
+
+TEXT = "早安平安喜樂天天開心身體"  # 12 個字
+SIZE = (800, 800)
+FONT_SIZE = 60
+STROKE = 12
+BOLD = max(1, int(FONT_SIZE / 28))
+
+
+def layout(draw, font):
+    """每個字的原點 (與 create_meme_image 相同：置中、每字 +5px 間距)"""
+    widths = []
+    for c in TEXT:
+        bb = draw.textbbox((0, 0), c, font=font)
+        widths.append(bb[2] - bb[0] + 5)
+    lines, line, w = [], [], 0
+    for c, cw in zip(TEXT, widths):
+        if w + cw > SIZE[0] - 80 and line:
+            lines.append(line)
+            line, w = [], 0
+        line.append((c, cw))
+        w += cw
+    lines.append(line)
+    return lines
+
+
+def char_style(style, rng, current_x):
+    if style == 'wave':
+        return math.sin(current_x * 0.05) * 5, rng.uniform(-5, 5)
+    if style == 'gentle':
+        return math.sin(current_x * 0.05) * 2, 0
+    return 0, 0
+
+
+def render_legacy(fonts, style, seed):
+    """原本的做法：每個字建立 (字寬×3+100) 的畫布、繪製、整張旋轉後貼上"""
+    rng = random.Random(seed)
+    txt_layer = Image.new('RGBA', SIZE, (255, 255, 255, 0))
+    txt_draw = ImageDraw.Draw(txt_layer)
+    current_y = 40
+    for line in layout(txt_draw, fonts[0]):
+        current_x = (SIZE[0] - sum(cw for _, cw in line)) / 2
+        for char, cw in line:
+            char_font = fonts[rng.randint(-2, 2) + 2]
+            wave_offset, char_angle = char_style(style, rng, current_x)
+            char_real_y = current_y + wave_offset
+            char_bbox = txt_draw.textbbox((0, 0), char, font=char_font)
+            raw_w = char_bbox[2] - char_bbox[0]
+            raw_h = char_bbox[3] - char_bbox[1]
+            canvas_w = int(raw_w * 3 + 100)
+            canvas_h = int(raw_h * 3 + 100)
+            char_layer = Image.new('RGBA', (canvas_w, canvas_h), (255, 255, 255, 0))
+            cd = ImageDraw.Draw(char_layer)
+            text_x = canvas_w // 2 - (raw_w / 2)
+            text_y = canvas_h // 2 - (raw_h / 2)
+            cd.text((text_x, text_y), char, font=char_font, fill='#FFD700',
+                    stroke_width=STROKE + BOLD, stroke_fill='#000000')
+            cd.text((text_x, text_y), char, font=char_font, fill='#FFD700',
+                    stroke_width=BOLD, stroke_fill='#FFD700')
+            if abs(char_angle) > 0.5:
+                char_layer = char_layer.rotate(char_angle, expand=False, resample=Image.Resampling.BICUBIC)
+            paste_x = int(current_x + raw_w / 2 - canvas_w / 2)
+            paste_y = int(char_real_y + raw_h / 2 - canvas_h / 2)
+            txt_layer.paste(char_layer, (paste_x, paste_y), char_layer)
+            current_x += cw
+        current_y += int(FONT_SIZE * 1.2)
+    return txt_layer
+
+
+def render_atlas(atlas, fonts, style, seed, color='#FFD700'):
+    """glyph_atlas：小圖塊繪製一次、只旋轉圖塊，直接貼到同一個文字圖層"""
+    rng = random.Random(seed)
+    txt_layer = Image.new('RGBA', SIZE, (255, 255, 255, 0))
+    txt_draw = ImageDraw.Draw(txt_layer)
+    passes = ((0, 0, color, STROKE + BOLD, '#000000'), (0, 0, color, BOLD, color))
+    current_y = 40
+    for line in layout(txt_draw, fonts[0]):
+        current_x = (SIZE[0] - sum(cw for _, cw in line)) / 2
+        for char, cw in line:
+            char_font = fonts[rng.randint(-2, 2) + 2]
+            wave_offset, char_angle = char_style(style, rng, current_x)
+            char_real_y = current_y + wave_offset
+            pivot = None
+            if abs(char_angle) > 0.5:
+                bb = txt_draw.textbbox((0, 0), char, font=char_font)
+                pivot = (current_x + (bb[2] - bb[0]) / 2, char_real_y + (bb[3] - bb[1]) / 2)
+            atlas.draw(txt_layer, (current_x, char_real_y), char, char_font, passes, angle=char_angle, pivot=pivot)
+            current_x += cw
+        current_y += int(FONT_SIZE * 1.2)
+    return txt_layer
+
+
+def timed(fn, rounds):
+    started = time.perf_counter()
+    for n in range(rounds):
+        fn(n)
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--font", help="字型檔路徑（預設使用 font_registry 的 kaiti 字體）")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    font_path = args.font or font_registry.path("kaiti")
+    if not font_path:
+        sys.exit("No font available: pass --font /path/to/font.ttf")
+    fonts = [font_registry.font(font_path, FONT_SIZE + delta) for delta in range(-2, 3)]
+    print(f"font {font_path}, {SIZE[0]}x{SIZE[1]}, {len(TEXT)} chars, stroke {STROKE}px, {args.rounds} memes\n")
+    print(f"{'style':<8} {'legacy':>10} {'cold':>16} {'new color':>16} {'warm':>16} {'mean diff':>10}")
+    headline = []
+
+    for style in ('wave', 'gentle', 'straight'):
+        legacy = timed(lambda n: render_legacy(fonts, style, n), args.rounds)
+        cold = timed(lambda n: render_atlas(GlyphAtlas(), fonts, style, n), args.rounds)
+        atlas = GlyphAtlas()
+        render_atlas(atlas, fonts, style, 0, color='#FF4444')
+        colors = ['#%02X%02X%02X' % (n * 37 % 256, 200, 255 - n * 37 % 256) for n in range(args.rounds)]
+        new_color = timed(lambda n: render_atlas(atlas, fonts, style, n, color=colors[n]), args.rounds)
+        warm = timed(lambda n: render_atlas(atlas, fonts, style, n), args.rounds)
+
+        # 輸出差異（0-255 的平均像素差）：原點四捨五入造成的 ≤1px 位移與旋轉中心的細微差異
+        diff = ImageChops.difference(render_legacy(fonts, style, 1), render_atlas(GlyphAtlas(), fonts, style, 1))
+        mean_diff = max(ImageStat.Stat(diff).mean)
+        cells = "".join(f"{t:7.1f} ms ({legacy / t:4.1f}x)" for t in (cold, new_color, warm))
+        print(f"{style:<8} {legacy:7.1f} ms {cells} {mean_diff:10.2f}")
+        headline.append(f"{style} {legacy / cold:.1f}x")
+
+    print(f"\ncold speedup (typical meme): {', '.join(headline)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+長輩圖圖片流程基準測試 - 比較經過 /tmp/uploads 來回讀寫的流程與 ImageHandle 記憶體流程
+
+模擬一次完整的長輩圖製作（不含 Gemini / 上傳的網路時間）：
+1. message_image 收到 LINE 圖片  2. handle_meme_agent 保存背景圖
+3. 位置分析（Vision 與 find_best_text_region 使用解碼後的背景）  4. 繪製長輩圖  5. 取得要上傳的 PNG bytes
+繪製步驟兩邊相同（縮圖 + 文字圖層 + 合成），差異只在讀寫、解碼與編碼
+
+用法：python benchmarks/bench_image_pipeline.py [--width 1600] [--height 1200] [--rounds 20]
+"""
+import os
+import io
+import sys
+import time
+import hashlib
+import statistics
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from image_handle import ImageHandle, ImageStore, _io_stats  # noqa: E402
+from text_region import EdgeDensityMap  # noqa: E402
+
+
+class IOCounter:
+    def __init__(self):
+        self.written = self.read = self.decodes = self.encodes = 0
+
+    def write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.written += len(data)
+
+    def read_file(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.read += len(data)
+        return data
+
+    def open_image(self, path):
+        image = Image.open(path)
+        image.load()
+        self.read += os.path.getsize(path)
+        self.decodes += 1
+        return image
+
+
+def render(img):
+    """create_meme_image 的共同部分（縮圖、文字圖層、合成）"""
+    img.thumbnail((800, 800), Image.Resampling.LANCZOS)
+    img = img.convert('RGBA')
+    layer = Image.new('RGBA', img.size, (255, 255, 255, 0))
+    ImageDraw.Draw(layer).rectangle((40, 40, img.width - 40, 160), fill=(255, 215, 0, 255))
+    return Image.alpha_composite(img, layer).convert('RGB')
+
+
+def upload(data):
+    """上傳的替身：只計算內容雜湊（GCS 去重複也會做）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def legacy_pipeline(blob, upload_dir, tmp_dir, n):
+    io_ = IOCounter()
+    image_path = os.path.join(upload_dir, f"u_image_{n}.jpg")
+    io_.write(image_path, blob)                                  # message_image 存檔
+    image_data = io_.read_file(image_path)                       # 再讀回來交給 handle_meme_agent
+    bg_path = os.path.join(tmp_dir, f"u_bg_{n}.jpg")
+    io_.write(bg_path, image_data)                               # handle_meme_agent 再存一份
+    bg_image = io_.open_image(bg_path)                           # Vision + 位置分析
+    EdgeDensityMap(bg_image)
+    img = Image.open(bg_path)                                    # create_meme_image 重新開檔（thumbnail 時解碼）
+    io_.read += os.path.getsize(bg_path)
+    io_.decodes += 1
+    meme = render(img)
+    meme_path = os.path.join(upload_dir, "u_meme.png")
+    meme.save(meme_path)                                         # 存成 PNG
+    io_.encodes += 1
+    io_.written += os.path.getsize(meme_path)
+    upload(io_.read_file(meme_path))                             # 上傳時再讀回來
+    return io_
+
+
+def handle_pipeline(blob, upload_dir, tmp_dir, n, store):
+    before = dict(_io_stats)
+    handle = ImageHandle.from_bytes(blob)
+    bg_path = handle.save(os.path.join(upload_dir, f"u_image_{n}.jpg"))  # 只寫入一次（跨訊息保存）
+    store.put(handle)
+    bg_path = handle.spill(tmp_dir, f"u_bg_{n}.jpg")                      # 已有檔案，沿用
+    bg_image = store.get(bg_path, decode=True).image()                     # 解碼一次
+    EdgeDensityMap(bg_image)
+    meme = ImageHandle.from_image(render(store.get(bg_path).image().copy()), format='PNG')
+    upload(meme.data)                                                      # 編碼一次，直接上傳
+    io_ = IOCounter()
+    io_.written = _io_stats['bytes_written'] - before['bytes_written']
+    io_.read = _io_stats['bytes_read'] - before['bytes_read']
+    io_.decodes = _io_stats['decodes'] - before['decodes']
+    io_.encodes = _io_stats['encodes'] - before['encodes']
+    return io_
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    photo = Image.radial_gradient('L').resize((args.width, args.height)).convert('RGB')
+    photo.paste(Image.effect_noise((args.width, args.height // 3), 40).convert('RGB'), (0, args.height * 2 // 3))
+    buffer = io.BytesIO()
+    photo.save(buffer, format='JPEG', quality=90)
+    blob = buffer.getvalue()
+    print(f"LINE photo {args.width}x{args.height} JPEG {len(blob) / 1024:.0f} KB, {args.rounds} memes\n")
+    print(f"{'pipeline':<14} {'median':>10} {'written':>10} {'read':>10} {'decodes':>8} {'encodes':>8}")
+
+    with tempfile.TemporaryDirectory() as upload_dir, tempfile.TemporaryDirectory() as tmp_dir:
+        results = {}
+        for name in ('legacy', 'image_handle'):
+            store = ImageStore()
+            times = []
+            for n in range(args.rounds):
+                started = time.perf_counter()
+                if name == 'legacy':
+                    io_ = legacy_pipeline(blob, upload_dir, tmp_dir, n)
+                else:
+                    io_ = handle_pipeline(blob, upload_dir, tmp_dir, n, store)
+                times.append(time.perf_counter() - started)
+            latency = statistics.median(times) * 1000
+            results[name] = latency
+            print(f"{name:<14} {latency:7.1f} ms {io_.written / 1024:7.0f} KB {io_.read / 1024:7.0f} KB "
+                  f"{io_.decodes:>8} {io_.encodes:>8}")
+        print(f"\nspeedup {results['legacy'] / results['image_handle']:.2f}x (per meme, excluding Gemini and network)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+意圖判斷基準測試 - 以標註語料評估本地判斷的涵蓋率、準確率與省下的 LLM 呼叫
+
+用法：python benchmarks/bench_intent.py [語料檔]
+語料為 TSV：task（intent / clear / not）、label、text
+not 是不可在本地判成 label 的訊息（例如提到地名的聊天），只能交給 LLM 或判成其他意圖
+另外檢查單一字特徵在語料中是否命中，並與 jieba 斷詞後成為獨立詞的次數比較（有安裝 jieba 時）
+"""
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_engine import CONTEXT_FEATURES, INTENT_FEATURES, IntentEngine, normalize_text, single_char_hit  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_corpus.tsv")
+
+
+def load_corpus(path):
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            task, label, text = line.split("\t", 2)
+            rows.append((task, label, text))
+    return rows
+
+
+def bench_intent(engine, rows):
+    decided = correct = 0
+    latencies = []
+    errors = []
+    by_label = defaultdict(Counter)
+    for label, text in rows:
+        started = time.perf_counter()
+        result = engine.classify(text)
+        latencies.append(time.perf_counter() - started)
+        if result.intent is None:
+            by_label[label]['undecided'] += 1
+            continue
+        decided += 1
+        if result.intent == label:
+            correct += 1
+            by_label[label]['correct'] += 1
+        else:
+            by_label[label]['wrong'] += 1
+            errors.append((text, label, result.intent, result.source))
+    return decided, correct, latencies, errors, by_label
+
+
+def bench_clear(engine, rows):
+    decided = correct = 0
+    latencies = []
+    errors = []
+    for label, text in rows:
+        started = time.perf_counter()
+        decision = engine.clear_memory_intent(text)
+        latencies.append(time.perf_counter() - started)
+        if decision is None:
+            continue
+        decided += 1
+        if decision == (label == "yes"):
+            correct += 1
+        else:
+            errors.append((text, label, decision, 'local'))
+    return decided, correct, latencies, errors
+
+
+def bench_negative(engine, rows):
+    """本地判斷不可落在 label 上的訊息，回傳誤判清單"""
+    misses = []
+    for label, text in rows:
+        result = engine.classify(text)
+        print(f"  {text!r}: {result.intent or 'LLM'} ({result.source})")
+        if result.intent == label:
+            misses.append((text, label))
+    return misses
+
+
+def report(title, total, decided, correct, latencies, errors):
+    avg_us = sum(latencies) / len(latencies) * 1e6 if latencies else 0.0
+    print(f"\n== {title} ==")
+    print(f"samples            : {total}")
+    print(f"decided locally    : {decided} ({decided / total:.1%})  -> LLM calls avoided")
+    print(f"sent to LLM        : {total - decided}")
+    print(f"accuracy (decided) : {correct / decided:.1%}" if decided else "accuracy (decided) : n/a")
+    print(f"avg latency        : {avg_us:.1f} us")
+    for text, label, got, source in errors:
+        print(f"  MISS  {text!r}: expected {label}, got {got} ({source})")
+
+
+def check_single_char_features(rows):
+    """單一字特徵：語料中的命中數（子字串，排除複合詞）與 jieba 斷成獨立詞的次數"""
+    try:
+        import jieba
+        jieba.setLogLevel(60)
+    except ImportError:
+        jieba = None
+    print("\n== single-char features ==")
+    print(f"{'intent':<20} {'char':<4} {'present':>7} {'fires':>6} {'jieba token':>12}")
+    silent = []
+    for intent, feats in [*INTENT_FEATURES.items(), *CONTEXT_FEATURES.items()]:
+        for feat in feats:
+            if len(feat) != 1:
+                continue
+            texts = [normalize_text(text) for _, text in rows]
+            present = sum(feat in norm for norm in texts)
+            fires = sum(single_char_hit(feat, norm) for norm in texts)
+            as_token = sum(feat in jieba.lcut(norm) for norm in texts) if jieba else None
+            print(f"{intent:<20} {feat:<4} {present:>7} {fires:>6} {as_token if jieba else 'n/a':>12}")
+            if present and not fires:
+                silent.append(feat)
+    assert not silent, f"single-char features never fire: {silent}"
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CORPUS
+    rows = load_corpus(path)
+    engine = IntentEngine()
+
+    intent_rows = [(label, text) for task, label, text in rows if task == "intent"]
+    decided, correct, latencies, errors, by_label = bench_intent(engine, intent_rows)
+    report("classify_user_intent", len(intent_rows), decided, correct, latencies, errors)
+    for label in sorted(by_label):
+        c = by_label[label]
+        print(f"  {label:<20} correct={c['correct']:<3} wrong={c['wrong']:<3} undecided={c['undecided']}")
+
+    clear_rows = [(label, text) for task, label, text in rows if task == "clear"]
+    decided, correct, latencies, errors = bench_clear(engine, clear_rows)
+    report("clear memory", len(clear_rows), decided, correct, latencies, errors)
+
+    negative_rows = [(label, text) for task, label, text in rows if task == "not"]
+    print(f"\n== negatives ({len(negative_rows)}) ==")
+    misses = bench_negative(engine, negative_rows)
+    assert not misses, f"negatives classified locally as their excluded intent: {misses}"
+
+    check_single_char_features(intent_rows)
+
+
+if __name__ == "__main__":
+    main()
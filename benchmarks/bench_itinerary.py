@@ -0,0 +1,134 @@
+"""
+行程建議基準測試 - 比較 suggest_itinerary 逐一查詢與平行查詢的延遲
+
+在本機啟動模擬 Google Maps API 的 HTTP 伺服器（每個請求固定延遲），
+不需要 API Key，也不會產生費用
+
+用法：python benchmarks/bench_itinerary.py [--latency 0.08] [--rounds 5]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maps_integration import MapsCache, MapsIntegration  # noqa: E402
+
+INTERESTS = ["tourist_attraction", "restaurant", "park", "museum", "cafe", "temple"]
+
+
+class StubMapsHandler(BaseHTTPRequestHandler):
+    """模擬 geocode 與 nearbysearch；不同類型之間有部分重複的地點"""
+    latency = 0.08
+    requests_served = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StubMapsHandler.lock:
+            StubMapsHandler.requests_served += 1
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith("/geocode/json"):
+            body = {"status": "OK", "results": [{
+                "geometry": {"location": {"lat": 22.99, "lng": 120.2}},
+                "formatted_address": query.get("address", [""])[0],
+                "place_id": "origin",
+            }]}
+        elif url.path.endswith("/place/nearbysearch/json"):
+            place_type = query.get("type", [""])[0]
+            index = INTERESTS.index(place_type) if place_type in INTERESTS else 0
+            body = {"status": "OK", "results": [{
+                "name": f"place-{n}",
+                "vicinity": "台南",
+                "rating": 3.5 + (n % 15) / 10,
+                "user_ratings_total": 100 * n,
+                "place_id": f"p{n}",
+                "types": [place_type],
+            } for n in range(index * 6, index * 6 + 10)]}  # 相鄰類型重複 4 個地點
+        else:
+            body = {"status": "NOT_FOUND"}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class NoCache(MapsCache):
+    """不快取（模擬沒有快取時的行為）"""
+
+    def get(self, key, fields=None):
+        return False, None
+
+    def set(self, key, value, ttl):
+        pass
+
+
+def serial_suggest_itinerary(maps, location, interests, duration_hours=8):
+    """原本的做法：逐一搜尋，每個類型都重新 Geocoding，不去除重複"""
+    all_places = []
+    for interest in interests:
+        all_places.extend(maps.search_nearby_places(location, interest))
+    sorted_places = sorted(
+        all_places,
+        key=lambda x: ((x.get("rating") or 0) * 0.7 +
+                       min((x.get("user_ratings_total") or 0) / 1000, 5) * 0.3),
+        reverse=True,
+    )
+    return sorted_places[:min(duration_hours // 2, len(sorted_places))]
+
+
+def measure(label, fn, rounds):
+    timings = []
+    result = None
+    for _ in range(rounds):
+        before = StubMapsHandler.requests_served
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+        calls = StubMapsHandler.requests_served - before
+    avg_ms = sum(timings) / len(timings) * 1000
+    ids = [p["place_id"] for p in result]
+    print(f"{label:<28} avg {avg_ms:7.1f} ms   API calls/run {calls:>2}   "
+          f"duplicates {len(ids) - len(set(ids))}")
+    return avg_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.08, help="模擬每個 API 請求的延遲（秒）")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    StubMapsHandler.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMapsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/maps/api"
+    print(f"stub latency {args.latency * 1000:.0f} ms, {len(INTERESTS)} interests, {args.rounds} rounds\n")
+
+    maps = MapsIntegration(api_key="bench", cache=NoCache())
+    maps.base_url = base_url
+    serial = measure("serial (legacy)", lambda: serial_suggest_itinerary(maps, "台南", INTERESTS), args.rounds)
+    concurrent = measure("concurrent (no cache)", lambda: maps.suggest_itinerary("台南", INTERESTS), args.rounds)
+
+    cached = MapsIntegration(api_key="bench", cache=MapsCache(None))
+    cached.base_url = base_url
+    cached.suggest_itinerary("台南", INTERESTS)  # 先暖快取
+    measure("concurrent (warm cache)", lambda: cached.suggest_itinerary("台南", INTERESTS), args.rounds)
+
+    print(f"\nspeedup without cache: {serial / concurrent:.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
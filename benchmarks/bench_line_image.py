@@ -0,0 +1,103 @@
+"""
+LINE 圖片編碼基準測試 - 比較直接傳送原檔（原圖與預覽同一個網址）與 line_image 的 JPEG 原圖 + 預覽小圖
+
+合成類似照片的圖片（平滑漸層 + 模糊雜訊 + 色塊），依 Imagen 輸出、長輩圖、LINE 照片、手機原圖的格式與大小測試
+"meme in memory" 是 render_meme_image 交出的 ImageHandle.from_image（尚未編碼），原本的流程要先編碼成 PNG 才能上傳
+下載時間以長輩常見的行動網路（預設 2 Mbps）估算；上傳以模擬延遲（固定 + 依大小）比較依序與平行上傳
+
+用法：python benchmarks/bench_line_image.py [--mbps 2] [--upload-base 0.08] [--upload-mbps 20]
+"""
+import os
+import io
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from image_handle import ImageHandle  # noqa: E402
+from line_image import LineImageEncoder  # noqa: E402
+
+SOURCES = [  # (名稱, 寬, 高, 格式)
+    ("imagen png", 1024, 1024, "PNG"),
+    ("meme png", 800, 800, "PNG"),
+    ("meme in memory", 800, 800, None),
+    ("line photo jpeg", 1600, 1200, "JPEG"),
+    ("phone png", 4032, 3024, "PNG"),
+]
+
+
+def make_photo(width, height, fmt="PNG"):
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    img = Image.merge('RGB', (img.getchannel(0), img.getchannel(0).rotate(90).resize((width, height)),
+                              Image.new('L', (width, height), 140)))
+    texture = Image.effect_noise((width, height), 60).convert('RGB').filter(ImageFilter.GaussianBlur(1.5))
+    img = Image.blend(img, texture, 0.35)
+    draw = ImageDraw.Draw(img)
+    for i in range(6):
+        x, y = width * (i + 1) // 8, height * ((i * 37) % 7 + 1) // 9
+        draw.ellipse((x - width // 12, y - height // 12, x + width // 12, y + height // 12),
+                     fill=(40 * i % 255, 180, 255 - 30 * i))
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+def fake_upload(data, base, mbps):
+    time.sleep(base + len(data) * 8 / (mbps * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mbps", type=float, default=2.0, help="用戶手機的下載速度")
+    parser.add_argument("--upload-base", type=float, default=0.08, help="每次上傳的固定延遲（秒）")
+    parser.add_argument("--upload-mbps", type=float, default=20.0, help="伺服器上傳速度")
+    args = parser.parse_args()
+
+    encoder = LineImageEncoder()
+    pool = ThreadPoolExecutor(max_workers=2)
+    print(f"download {args.mbps} Mbps, upload {args.upload_base * 1000:.0f} ms + {args.upload_mbps} Mbps\n")
+    print(f"{'source':<16} {'size':>9} {'original':>9} {'preview':>8} {'encode':>8} "
+          f"{'preview dl before/after':>24} {'upload seq/parallel':>20}")
+
+    for name, width, height, fmt in SOURCES:
+        data = make_photo(width, height, fmt or "PNG")
+        if fmt:
+            handle = ImageHandle.from_bytes(data)
+        else:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            handle = ImageHandle.from_image(image, format='PNG')
+        started = time.perf_counter()
+        original, preview = encoder.encode(handle)
+        encode_ms = (time.perf_counter() - started) * 1000
+
+        # 原本：預覽與原圖同一個網址，聊天室顯示預覽就要下載整個原檔
+        before_dl = len(data) * 8 / (args.mbps * 1e6)
+        after_dl = len(preview.data) * 8 / (args.mbps * 1e6)
+
+        started = time.perf_counter()
+        fake_upload(original.data, args.upload_base, args.upload_mbps)
+        fake_upload(preview.data, args.upload_base, args.upload_mbps)
+        sequential = time.perf_counter() - started
+        started = time.perf_counter()
+        futures = [pool.submit(fake_upload, h.data, args.upload_base, args.upload_mbps) for h in (original, preview)]
+        for future in futures:
+            future.result()
+        parallel = time.perf_counter() - started
+
+        assert len(original.data) <= 10 * 1024 * 1024 and len(preview.data) <= 1024 * 1024
+        print(f"{name:<16} {len(data) / 1024:6.0f} KB {len(original.data) / 1024:6.0f} KB "
+              f"{len(preview.data) / 1024:5.0f} KB {encode_ms:5.0f} ms "
+              f"{before_dl:10.2f} s / {after_dl:5.2f} s {sequential * 1000:10.0f} / {parallel * 1000:4.0f} ms")
+
+    stats = encoder.stats()
+    print(f"\noriginal {stats['original_ratio']:.0%} of source bytes, preview {stats['preview_ratio']:.1%} "
+          f"(reused {stats['reused_original']} JPEG originals as-is, {stats['in_memory']} in-memory without PNG encode)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+長輩圖繪製基準測試 - 比較每次 ImageFont.truetype() 與 font_registry 快取字體的繪製時間
+
+依 create_meme_image 的字體使用方式繪製：自動縮小字體的排版迴圈、逐字隨機大小與裝飾符號
+CJK 字型檔（數 MB 的 Noto TC Variable Font）的解析成本遠高於一般西文字型，請盡量使用實際部署的字型
+
+用法：python benchmarks/bench_meme_render.py [--font static/fonts/NotoSansTC-Bold.ttf] [--rounds 20]
+"""
+import os
+import sys
+import time
+import math
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from font_registry import FontRegistry, font_registry  # noqa: E402
+
+TEXTS = [
+    "早安！平安喜樂\n天天開心",
+    "祝您身體健康 萬事如意 闔家平安",
+    "今天也要記得多喝水喔",
+]
+DECORATIONS = ["🌸", "☀", "❤"]
+
+
+class CountingLoader:
+    """原本的做法：每次都呼叫 ImageFont.truetype()"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path, size, variation=None):
+        self.calls += 1
+        font = ImageFont.truetype(path, int(size))
+        if variation:
+            try:
+                font.set_variation_by_name(variation)
+            except Exception:
+                pass
+        return font
+
+
+def render_meme(load_font, font_path, text, font_size=60, seed=0):
+    """精簡版 create_meme_image：只保留與字體相關的步驟"""
+    rng = random.Random(seed)
+    img = Image.new("RGBA", (800, 800), (90, 140, 200, 255))
+    txt_layer = Image.new("RGBA", img.size, (255, 255, 255, 0))
+    txt_draw = ImageDraw.Draw(txt_layer)
+    load_font(font_path, font_size, "Bold")  # base_font
+    padding = 40
+
+    # 自動縮小字體直到排版符合寬高
+    paragraphs = text.split("\n")
+    while font_size >= 20:
+        calc_font = load_font(font_path, font_size + 8)
+        lines = []
+        for para in paragraphs:
+            line, width = [], 0
+            for char in para:
+                bbox = txt_draw.textbbox((0, 0), char, font=calc_font)
+                w = bbox[2] - bbox[0] + 5
+                if width + w > img.width - padding * 2 and line:
+                    lines.append(line)
+                    line, width = [], 0
+                line.append(char)
+                width += w
+            lines.append(line)
+        if len(lines) * int(font_size * 1.2) <= img.height - padding * 1.5 and len(lines) <= 3:
+            break
+        font_size -= 5
+
+    load_font(font_path, font_size)  # 最終的 base_font
+    current_y = padding
+    for line in lines:
+        current_x = padding
+        for char in line:
+            char_font = load_font(font_path, font_size + rng.randint(-2, 2))
+            offset = math.sin(current_x * 0.05) * 2
+            txt_draw.text((current_x, current_y + offset), char, font=char_font, fill="#FFD700",
+                          stroke_width=6, stroke_fill="#000000")
+            bbox = txt_draw.textbbox((0, 0), char, font=calc_font)
+            current_x += bbox[2] - bbox[0] + 5
+        current_y += int(font_size * 1.2)
+
+    for i, deco in enumerate(DECORATIONS):
+        deco_size = rng.randint(40, 60)
+        emoji_font = load_font(font_path, deco_size)
+        txt_draw.text((padding + i * 200, img.height - deco_size - padding), deco, font=emoji_font, fill="#FF69B4")
+
+    return Image.alpha_composite(img, txt_layer).convert("RGB")
+
+
+def measure(label, load_font, font_path, rounds):
+    started = time.perf_counter()
+    for n in range(rounds):
+        render_meme(load_font, font_path, TEXTS[n % len(TEXTS)], seed=n)
+    per_meme = (time.perf_counter() - started) / rounds * 1000
+    print(f"{label:<24} {per_meme:8.1f} ms / meme")
+    return per_meme
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--font", help="字型檔路徑（預設使用 font_registry 的 kaiti 字體）")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    font_path = args.font or font_registry.path("kaiti")
+    if not font_path:
+        sys.exit("No font available: pass --font /path/to/font.ttf")
+    print(f"font {font_path} ({os.path.getsize(font_path) / 1024 / 1024:.1f} MB), {args.rounds} memes\n")
+
+    legacy = CountingLoader()
+    before = measure("truetype every time", legacy, font_path, args.rounds)
+
+    registry = FontRegistry()
+    registry.font(font_path, 60, "Bold")  # 模擬啟動時的預先載入
+    render_meme(registry.font, font_path, TEXTS[0])  # 暖快取
+    misses = registry.stats()['misses']
+    after = measure("font_registry (warm)", registry.font, font_path, args.rounds)
+
+    stats = registry.stats()
+    print(f"\ntruetype calls per meme: {legacy.calls / args.rounds:.1f} -> "
+          f"{(stats['misses'] - misses) / args.rounds:.1f} "
+          f"({stats['cached_fonts']} cached fonts, avg load {stats['avg_load_ms']} ms)")
+    print(f"render time saved: {before - after:.1f} ms / meme ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+狀態存儲後端一致性檢查 - 以同一組情境測試 memory / db / redis 三種 STATE_BACKEND，確認行為相同
+
+db 使用暫存的 SQLite 檔案（與正式環境相同的 database.Database）；
+redis 預設使用本檔內模擬 redis-py 介面的 FakeRedis（回傳 bytes、支援 ex 過期與 SCAN glob），
+不需要 Redis 伺服器；加上 --redis-url 並安裝 redis 套件時，會再對真的 Redis 跑一次
+（只會讀寫 --prefix 開頭的 key）
+
+檢查項目：讀寫往返（含 datetime、巢狀 dict，set 比較 JSON 後的內容）、就地修改後 flush 寫回、in / del / len / 列出 key、
+namespace 與 key prefix 互不干擾、key 含 glob 特殊字元、TTL 到期、TTL 有傳給後端
+
+用法：python benchmarks/bench_state_store.py [--ttl 1] [--ops 2000] [--redis-url redis://localhost:6379/15]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database 在 import 時就會連線，必須先指到暫存檔
+_tmpdir = tempfile.mkdtemp(prefix="bench_state_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'state.db')}"
+
+from state_store import StateStore, MemoryBackend, DatabaseBackend, RedisBackend, encode  # noqa: E402
+
+
+class FakeRedis:
+    """模擬 redis-py（decode_responses=False）用到的 get / set / delete / scan_iter"""
+
+    def __init__(self):
+        self.data = {}  # {key: (bytes, 到期時間 or None)}
+        self.last_ex = {}  # {key: 最近一次 set 的 ex}
+
+    def _alive(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            entry = None
+        return entry
+
+    def get(self, key):
+        entry = self._alive(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value, ex=None):
+        if ex is not None and ex <= 0:
+            raise ValueError("invalid expire time in 'set' command")
+        self.data[key] = (value.encode('utf-8'), time.monotonic() + ex if ex else None)
+        self.last_ex[key] = ex
+        return True
+
+    def delete(self, *keys):
+        count = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                count += 1
+        return count
+
+    @staticmethod
+    def _glob(pattern):
+        # Redis glob：* ? [...] 與反斜線跳脫
+        out, i = [], 0
+        while i < len(pattern):
+            c = pattern[i]
+            if c == '\\' and i + 1 < len(pattern):
+                out.append(re.escape(pattern[i + 1]))
+                i += 2
+                continue
+            if c == '*':
+                out.append('.*')
+            elif c == '?':
+                out.append('.')
+            elif c == '[':
+                end = pattern.find(']', i + 1)
+                if end < 0:
+                    out.append(re.escape(c))
+                else:
+                    out.append('[' + pattern[i + 1:end].replace('\\', '\\\\') + ']')
+                    i = end
+            else:
+                out.append(re.escape(c))
+            i += 1
+        return re.compile(''.join(out) + r'\Z', re.S)
+
+    def scan_iter(self, match='*'):
+        regex = self._glob(match)
+        for key in list(self.data):
+            if self._alive(key) and regex.match(key):
+                yield key.encode('utf-8')
+
+
+def check(results, name, ok):
+    results.append((name, bool(ok)))
+
+
+def run_scenario(make_store, ttl):
+    """對一種後端跑完整情境，回傳 [(檢查項目, 是否通過)]"""
+    results = []
+    store = make_store(None)
+    meme = store.namespace("meme")
+    trip = store.namespace("trip")
+
+    created = datetime(2026, 5, 1, 8, 30, 15)
+    meme_value = {'stage': 'waiting_text', 'created': created, 'tags': {'花'}, 'nested': {'n': [1, 2]}}
+    meme["U1"] = meme_value
+    store.flush()
+    value = meme["U1"]
+    check(results, "round trip", value['stage'] == 'waiting_text' and value['nested'] == {'n': [1, 2]})
+    check(results, "datetime preserved", value['created'] == created)
+    # memory 後端直接存 Python 物件，共用後端經過 JSON：比較 JSON 後的內容
+    check(results, "json-equivalent value", encode(value) == encode(meme_value))
+
+    meme["U1"]['stage'] = 'done'
+    store.flush()
+    check(results, "in-place edit flushed", meme["U1"]['stage'] == 'done')
+
+    check(results, "missing key", "U2" not in meme and meme.get("U2") is None)
+    try:
+        meme["U2"]
+        check(results, "missing raises KeyError", False)
+    except KeyError:
+        check(results, "missing raises KeyError", True)
+
+    meme["U2"] = {'stage': 'x'}
+    trip["U1"] = {'days': 3}
+    store.flush()
+    check(results, "keys listed", sorted(meme) == ["U1", "U2"] and len(meme) == 2)
+    check(results, "namespaces isolated", list(trip) == ["U1"] and trip["U1"] != meme["U1"])
+
+    other = make_store("staging")
+    if other is not None:
+        other.namespace("meme")["U9"] = {'stage': 'other'}
+        other.flush()
+        check(results, "prefixes isolated", sorted(meme) == ["U1", "U2"] and list(other.namespace("meme")) == ["U9"])
+    else:
+        check(results, "prefixes isolated", True)
+
+    glob_a = store.namespace("a*")
+    glob_b = store.namespace("ab")
+    glob_b["U1"] = {'v': 1}
+    glob_a["U[1]"] = {'v': 2}
+    store.flush()
+    check(results, "glob chars in names", list(glob_a) == ["U[1]"] and list(glob_b) == ["U1"])
+
+    del meme["U2"]
+    store.flush()
+    check(results, "delete", "U2" not in meme and sorted(meme) == ["U1"])
+    try:
+        del meme["U2"]
+        check(results, "delete missing raises KeyError", False)
+    except KeyError:
+        check(results, "delete missing raises KeyError", True)
+
+    short = make_store(None, ttl=ttl).namespace("short")
+    short["U1"] = {'stage': 'tmp'}
+    short.flush()
+    check(results, "alive before ttl", "U1" in short)
+    short.flush()  # 正式環境每個事件結束都會 flush，清掉執行緒快取
+    time.sleep(ttl + 0.5)
+    check(results, "expired after ttl", "U1" not in short and list(short) == [])
+    return results
+
+
+def timing(store, ops):
+    ns = store.namespace("bench")
+    started = time.perf_counter()
+    for i in range(ops):
+        ns[f"U{i % 50}"] = {'stage': 'waiting_text', 'count': i}
+        ns[f"U{i % 50}"]['count'] += 1
+        store.flush()
+    return (time.perf_counter() - started) / ops * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ttl", type=int, default=1, help="TTL 檢查用的秒數（Redis 的 ex 最小為 1 秒）")
+    parser.add_argument("--ops", type=int, default=2000, help="計時用的寫入 + flush 次數")
+    parser.add_argument("--redis-url", default=None, help="另外對真的 Redis 檢查（需安裝 redis 套件）")
+    parser.add_argument("--prefix", default="bench_state", help="真的 Redis 上使用的 key prefix")
+    args = parser.parse_args()
+
+    from database import db
+    fake = FakeRedis()
+
+    def memory(prefix, ttl=None):
+        if prefix is not None:
+            return None  # memory 後端每個程序獨立，沒有 prefix 的概念
+        return StateStore(MemoryBackend(), ttl=ttl)
+
+    def database(prefix, ttl=None):
+        return StateStore(DatabaseBackend(db, prefix=prefix or "state"), ttl=ttl)
+
+    def fake_redis(prefix, ttl=None):
+        return StateStore(RedisBackend(fake, prefix=prefix or "state"), ttl=ttl)
+
+    backends = [("memory", memory), ("db (sqlite)", database), ("redis (fake)", fake_redis)]
+    if args.redis_url:
+        import redis
+        client = redis.Redis.from_url(args.redis_url)
+        for key in client.scan_iter(match=f"{args.prefix}*"):
+            client.delete(key)
+        backends.append(("redis", lambda prefix, ttl=None: StateStore(
+            RedisBackend(client, prefix=f"{args.prefix}:{prefix or 'state'}"), ttl=ttl)))
+
+    table = {}
+    for name, make_store in backends:
+        table[name] = dict(run_scenario(make_store, args.ttl))
+
+    checks = list(table[backends[0][0]])
+    print(f"{'check':<32}" + "".join(f"{name:>14}" for name, _ in backends))
+    for item in checks:
+        print(f"{item:<32}" + "".join(f"{'ok' if table[name][item] else 'FAIL':>14}" for name, _ in backends))
+
+    # 共用後端每次寫入都要帶 TTL，否則狀態永遠不會過期
+    ex_values = {ex for key, ex in fake.last_ex.items() if key.startswith("state:short:")}
+    ttl_passed = ex_values == {args.ttl}
+    fake_redis(None, ttl=None).namespace("no_ttl")["U1"] = {'v': 1}
+    no_ttl_passed = fake.last_ex.get("state:no_ttl:U1") is None
+    print(f"\nredis set ex={sorted(ex_values)} for ttl={args.ttl}: {'ok' if ttl_passed else 'FAIL'}; "
+          f"ttl=None sets no expiry: {'ok' if no_ttl_passed else 'FAIL'}")
+
+    print(f"\n{'backend':<16} {'write + edit + flush':>22}")
+    for name, make_store in backends:
+        print(f"{name:<16} {timing(make_store(None), args.ops):17.1f} us/op")
+
+    failed = [(name, item) for name in table for item, ok in table[name].items() if not ok]
+    if failed or not ttl_passed or not no_ttl_passed:
+        print(f"\nFAILED: {failed}")
+        sys.exit(1)
+    print("\nall backends behave the same")
+
+
+if __name__ == "__main__":
+    main()
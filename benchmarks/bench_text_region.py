@@ -0,0 +1,99 @@
+"""
+文字區域分析基準測試 - 比較逐像素加總與積分影像（NumPy）的邊緣密度計算
+
+合成的 1024x1024 背景（Imagen 輸出大小）：上方平滑天空、下方雜訊（花草）、右下角一個主體
+legacy：九個固定區域各自 crop + list(getdata()) + sum()
+text_region：每張圖建立一次積分影像，九個區域 + 每個區域內整個網格的候選文字框
+兩者都包含相同的灰階轉換與 FIND_EDGES 濾鏡（1024x1024 約 15 ms）
+
+用法：python benchmarks/bench_text_region.py [--size 1024] [--rounds 10]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from text_region import TEXT_BOX_FRACTION, EdgeDensityMap  # noqa: E402
+
+POSITIONS = ['top', 'bottom', 'left', 'right', 'top-left', 'top-right', 'bottom-left', 'bottom-right', 'center']
+
+
+def make_image(size):
+    img = Image.linear_gradient('L').resize((size, size)).convert('RGB')  # 天空
+    noise = Image.effect_noise((size, size // 2), 80).convert('RGB')  # 花草
+    img.paste(noise, (0, size // 2))
+    ImageDraw.Draw(img).ellipse((size * 0.6, size * 0.55, size * 0.95, size * 0.95), fill=(200, 80, 60))
+    return img
+
+
+def region_map(w, h):
+    return {
+        'top': (0, 0, w, int(h * 0.40)),
+        'bottom': (0, int(h * 0.60), w, h),
+        'left': (0, 0, int(w * 0.40), h),
+        'right': (int(w * 0.60), 0, w, h),
+        'top-left': (0, 0, int(w * 0.45), int(h * 0.45)),
+        'top-right': (int(w * 0.55), 0, w, int(h * 0.45)),
+        'bottom-left': (0, int(h * 0.55), int(w * 0.45), h),
+        'bottom-right': (int(w * 0.55), int(h * 0.55), w, h),
+        'center': (int(w * 0.25), int(h * 0.25), int(w * 0.75), int(h * 0.75)),
+    }
+
+
+def score_legacy(img):
+    """原本的做法"""
+    edge_img = img.convert('L').filter(ImageFilter.FIND_EDGES)
+    scores = {}
+    for pos, box in region_map(*img.size).items():
+        pixels = list(edge_img.crop(box).getdata())
+        scores[pos] = sum(pixels) / len(pixels)
+    return scores
+
+
+def score_sat(img):
+    """積分影像：區域平均 + 每個區域內的網格候選文字框"""
+    edge_map = EdgeDensityMap(img)
+    scores, boxes = {}, 0
+    for pos, (x1, y1, x2, y2) in region_map(*img.size).items():
+        xs, ys, densities = edge_map.grid(int((x2 - x1) * TEXT_BOX_FRACTION), int((y2 - y1) * TEXT_BOX_FRACTION),
+                                          bounds=(x1, y1, x2, y2))
+        avg = edge_map.density((x1, y1, x2, y2))
+        scores[pos] = (avg, float(densities.min()), (avg + float(densities.min())) / 2)
+        boxes += densities.size
+    return scores, boxes
+
+
+def timed(fn, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    return (time.perf_counter() - started) / rounds * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    img = make_image(args.size)
+    legacy_ms, legacy = timed(lambda: score_legacy(img), args.rounds)
+    sat_ms, (sat, boxes) = timed(lambda: score_sat(img), args.rounds)
+
+    print(f"{args.size}x{args.size} image, {args.rounds} rounds\n")
+    print(f"{'position':<14} {'legacy':>8} {'sat':>8} {'best box':>9} {'score':>8}")
+    for pos in POSITIONS:
+        # 兩種做法的區域平均必須完全相同
+        assert abs(legacy[pos] - sat[pos][0]) < 1e-9, (pos, legacy[pos], sat[pos][0])
+        print(f"{pos:<14} {legacy[pos]:8.2f} {sat[pos][0]:8.2f} {sat[pos][1]:9.2f} {sat[pos][2]:8.2f}")
+
+    print(f"\nlegacy (9 regions)                  {legacy_ms:8.1f} ms")
+    print(f"text_region (9 regions + {boxes:>5} boxes) {sat_ms:8.1f} ms ({legacy_ms / sat_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+長文字語音合成基準測試 - 比較單一請求與切段平行合成的端到端延遲
+
+以模擬的 TTS（延遲與字數成正比，回傳合法的 MP3 音框）測試，不需要 Google 憑證，也不會產生費用；
+超過 API 單次上限（5000 bytes）的輸入，單一請求會失敗
+
+用法：python benchmarks/bench_tts_chunking.py [--base 0.15] [--per-char 0.0008] [--workers 6]
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_chunking import TTS_CHUNK_BYTES, mp3_frames, split_text, synthesize_to_file  # noqa: E402
+
+SENTENCES = [
+    "行政院今日宣布，明年起長者健保補助將再提高百分之五。",
+    "中央氣象署表示，受東北季風影響，北部地區週末氣溫將降到十五度左右，請民眾注意保暖！",
+    "台積電第三季營收創下新高，法人預估全年成長幅度可望超過兩成。",
+    "衛福部提醒，六十五歲以上長者可免費接種流感疫苗，各地衛生所即日起開放預約。",
+    "台南市政府推出銀髮族免費公車路線，串連醫院、市場與公園，方便長輩外出。",
+    "立法院三讀通過長照法修正案；未來居家照顧服務的時數與項目都將增加。",
+    "交通部提醒連假期間國道車流量大，建議民眾避開尖峰時段出門？",
+]
+
+# MPEG-2 Layer III、24 kHz、32 kbps、單聲道：每個音框 96 bytes、24 毫秒
+FRAME_HEADER = bytes([0xFF, 0xF3, 0x44, 0xC4])
+FRAME_BYTES = 96
+FRAMES_PER_CHAR = 8  # 約每秒唸 5 個字
+
+
+class FakeTTS:
+    """延遲 = base + per_char × 字數；輸出以 Xing 標頭開始的 CBR MP3"""
+
+    def __init__(self, base, per_char):
+        self.base = base
+        self.per_char = per_char
+        self.calls = 0
+        self.frames = 0
+
+    def __call__(self, text, voice, audio_config):
+        if len(text.encode("utf-8")) > 5000:
+            raise ValueError("400 Either `input.text` or `input.ssml` is longer than the limit of 5000 bytes.")
+        self.calls += 1
+        time.sleep(self.base + self.per_char * len(text))
+        frames = len(text) * FRAMES_PER_CHAR
+        self.frames += frames
+        xing = FRAME_HEADER + bytes(9) + b"Xing" + bytes(FRAME_BYTES - 17)
+        audio = FRAME_HEADER + bytes(FRAME_BYTES - 4)
+        return xing + audio * frames
+
+
+class TimedWriter(io.RawIOBase):
+    """記錄第一次寫入的時間（可以開始上傳 / 播放的時間點）"""
+
+    def __init__(self):
+        self.first_write = None
+        self.size = 0
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        if self.first_write is None:
+            self.first_write = time.perf_counter()
+        self.size += len(data)
+        return self.buffer.write(data)
+
+
+def make_text(chars):
+    text = ""
+    for sentence in itertools.cycle(SENTENCES):
+        if len(text) >= chars:
+            return text[:chars]
+        text += sentence
+
+
+def run(text, tts, **kwargs):
+    out = TimedWriter()
+    started = time.perf_counter()
+    synthesize_to_file(text, {"name": "bench"}, {"audio_encoding": "MP3"}, tts, out, **kwargs)
+    elapsed = time.perf_counter() - started
+    return elapsed, out.first_write - started, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base", type=float, default=0.15, help="每個請求的固定延遲（秒）")
+    parser.add_argument("--per-char", type=float, default=0.0008, help="每個字增加的延遲（秒）")
+    parser.add_argument("--workers", type=int, default=6)
+    parser.add_argument("--chunk-bytes", type=int, default=TTS_CHUNK_BYTES)
+    args = parser.parse_args()
+
+    print(f"fake TTS: {args.base * 1000:.0f} ms + {args.per_char * 1000:.1f} ms/char, "
+          f"chunk {args.chunk_bytes} bytes, {args.workers} workers\n")
+    print(f"{'chars':>6} {'chunks':>6}  {'single request':>16}  {'chunked total':>14}  {'first write':>12}  {'speedup':>7}")
+
+    for chars in (500, 1000, 2000, 3000, 5000):
+        text = make_text(chars)
+
+        single = FakeTTS(args.base, args.per_char)
+        try:
+            single_time, _, _ = run(text, single, chunk_bytes=10 ** 9)
+            single_label = f"{single_time * 1000:10.0f} ms"
+        except ValueError:
+            single_time, single_label = None, "over API limit"
+
+        chunked = FakeTTS(args.base, args.per_char)
+        total, first_write, out = run(text, chunked, chunk_bytes=args.chunk_bytes, workers=args.workers)
+
+        # 驗證輸出：所有音訊音框都在，且沒有殘留的 Xing 標頭
+        frames = list(mp3_frames(out.buffer.getvalue()))
+        assert len(frames) == chunked.frames, (len(frames), chunked.frames)
+        assert all(frame[:4] == FRAME_HEADER and b"Xing" not in frame for frame in frames)
+
+        speedup = f"{single_time / total:6.1f}x" if single_time else "     -"
+        print(f"{chars:>6} {len(split_text(text, args.chunk_bytes)):>6}  {single_label:>16}  "
+              f"{total * 1000:11.0f} ms  {first_write * 1000:9.0f} ms  {speedup}")
+
+
+if __name__ == "__main__":
+    main()
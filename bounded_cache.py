@@ -0,0 +1,251 @@
+"""
+有上限的快取模組 - LRU + TTL 的 dict 替代品
+用於存放用戶狀態等會隨用戶數成長的資料，避免記憶體無限增加
+"""
+import sys
+import time
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator, Optional
+
+# 背景清理間隔（秒）
+SWEEP_INTERVAL = 60
+
+
+def approx_sizeof(value, _depth: int = 0) -> int:
+    """粗估物件佔用的記憶體位元組數（遞迴計算 dict / list / str）"""
+    size = sys.getsizeof(value)
+    if _depth > 10:
+        return size
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += approx_sizeof(k, _depth + 1) + approx_sizeof(v, _depth + 1)
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            size += approx_sizeof(item, _depth + 1)
+    return size
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'touched')
+
+    def __init__(self, value, size: int, touched: float):
+        self.value = value
+        self.size = size
+        self.touched = touched
+
+
+class BoundedCache(MutableMapping):
+    """
+    執行緒安全、有容量與存活時間上限的 dict
+
+    - max_items：超過時淘汰最久沒用到的項目 (LRU)
+    - max_bytes：以 sizeof 計算的總大小上限，超過時同樣依 LRU 淘汰
+    - ttl：超過 ttl 秒沒被存取的項目視為過期，由背景執行緒定期清除
+    - on_evict(key, value, reason)：被淘汰時呼叫（reason 為 'capacity' / 'bytes' / 'expired'），
+      可用來把資料寫回資料庫；手動 del 不會觸發
+    """
+
+    def __init__(self, max_items: Optional[int] = None, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Optional[Callable] = None,
+                 on_evict: Optional[Callable] = None, name: str = "cache"):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or approx_sizeof
+        self.on_evict = on_evict
+        self.name = name
+
+        self._data: "OrderedDict[object, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'misses': 0, 'evicted_capacity': 0, 'evicted_bytes': 0, 'evicted_expired': 0}
+        _sweeper.register(self)
+
+    # ---- dict 介面 ----
+
+    def __getitem__(self, key):
+        expired = None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._is_expired(entry, time.monotonic()):
+                expired = self._remove(key)
+                self._stats['evicted_expired'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+            else:
+                self._stats['hits'] += 1
+                entry.touched = time.monotonic()
+                self._data.move_to_end(key)
+        if expired is not None:
+            self._notify([(key, expired, 'expired')])
+        if entry is None:
+            raise KeyError(key)
+        return entry.value
+
+    def __setitem__(self, key, value):
+        size = self._safe_sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = _Entry(value, size, time.monotonic())
+            self._bytes += size
+            evicted = self._enforce_limits(protect=key)
+        self._notify(evicted)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._data:
+                raise KeyError(key)
+            self._remove(key)
+
+    def __contains__(self, key) -> bool:
+        # 不更新存取時間；過期項目視為不存在（留給 sweep 觸發 on_evict）
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and not self._is_expired(entry, time.monotonic())
+
+    def __iter__(self) -> Iterator:
+        # 與 __contains__ 一致：過期但尚未被 sweep 的項目不列出
+        with self._lock:
+            now = time.monotonic()
+            return iter([k for k, e in self._data.items() if not self._is_expired(e, now)])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"<BoundedCache {self.name} items={len(self)} bytes={self._bytes}>"
+
+    # ---- 維護 ----
+
+    def resize(self, key):
+        """重新計算某個項目的大小（值被就地修改、變大之後呼叫）"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return
+            new_size = self._safe_sizeof(entry.value)
+            self._bytes += new_size - entry.size
+            entry.size = new_size
+            evicted = self._enforce_limits(protect=key)
+        self._notify(evicted)
+
+    def sweep(self) -> int:
+        """清除過期項目並重新計算大小，回傳淘汰數量"""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            if self.ttl is not None:
+                for key in [k for k, e in self._data.items() if self._is_expired(e, now)]:
+                    evicted.append((key, self._remove(key), 'expired'))
+                    self._stats['evicted_expired'] += 1
+            if self.max_bytes is not None:
+                # 值可能被就地修改過，重新計算後再檢查總量
+                for entry in self._data.values():
+                    new_size = self._safe_sizeof(entry.value)
+                    self._bytes += new_size - entry.size
+                    entry.size = new_size
+                evicted.extend(self._enforce_limits())
+        self._notify(evicted)
+        return len(evicted)
+
+    def evict_all(self) -> int:
+        """淘汰所有項目（會觸發 on_evict，例如程式結束前把資料寫回資料庫）"""
+        with self._lock:
+            evicted = [(key, self._remove(key), 'capacity') for key in list(self._data.keys())]
+        self._notify(evicted)
+        return len(evicted)
+
+    def stats(self) -> Dict:
+        """容量與命中率統計（監控用）"""
+        with self._lock:
+            return {
+                'items': len(self._data),
+                'bytes': self._bytes,
+                'max_items': self.max_items,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                **self._stats,
+            }
+
+    # ---- 內部 ----
+
+    def _is_expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl is not None and now - entry.touched > self.ttl
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        return entry.value
+
+    def _enforce_limits(self, protect=None):
+        evicted = []
+        while self.max_items is not None and len(self._data) > self.max_items:
+            key = next(iter(self._data))
+            if key == protect and len(self._data) == 1:
+                break
+            evicted.append((key, self._remove(key), 'capacity'))
+            self._stats['evicted_capacity'] += 1
+        while self.max_bytes is not None and self._bytes > self.max_bytes and self._data:
+            key = next(iter(self._data))
+            if key == protect:
+                break  # 只剩剛寫入的項目超過上限時保留，避免立刻被淘汰
+            evicted.append((key, self._remove(key), 'bytes'))
+            self._stats['evicted_bytes'] += 1
+        return evicted
+
+    def _safe_sizeof(self, value) -> int:
+        try:
+            return int(self.sizeof(value))
+        except Exception:
+            return sys.getsizeof(value)
+
+    def _notify(self, evicted):
+        if not evicted or not self.on_evict:
+            return
+        for key, value, reason in evicted:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                print(f"[CACHE] {self.name} on_evict error for {key}: {e}")
+
+
+class _Sweeper:
+    """所有 BoundedCache 共用的背景清理執行緒"""
+
+    def __init__(self, interval: float = SWEEP_INTERVAL):
+        self.interval = interval
+        self._caches = []  # [weakref.ref]（MutableMapping 不可 hash，無法用 WeakSet）
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, cache: BoundedCache):
+        with self._lock:
+            self._caches.append(weakref.ref(cache))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="bounded-cache-sweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                self._caches = [ref for ref in self._caches if ref() is not None]
+                caches = [ref() for ref in self._caches]
+            for cache in caches:
+                if cache is None:
+                    continue
+                if cache.ttl is None and cache.max_bytes is None:
+                    continue
+                try:
+                    cache.sweep()
+                except Exception as e:
+                    print(f"[CACHE] Sweep error in {cache.name}: {e}")
+
+
+_sweeper = _Sweeper()
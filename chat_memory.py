@@ -0,0 +1,305 @@
+"""
+對話記憶模組 - 管理每個用戶的 Gemini ChatSession
+每一輪對話以批次方式追加寫入 chat_history 表格；記憶體中只保留有上限的活躍對話，
+用戶回來時（或重新啟動、換到其他 Worker）以最近的對話重建 ChatSession
+
+注意：多個 Worker 時，各 Worker 記憶體中的對話不會即時同步；
+用戶的下一則訊息落在其他 Worker 時，會以資料庫中已寫入的紀錄重建。
+"""
+import os
+import threading
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from bounded_cache import BoundedCache
+
+CHAT_SESSION_MAX = int(os.environ.get("CHAT_SESSION_MAX", "2000"))  # 記憶體中最多保留的對話數
+CHAT_SESSION_MAX_BYTES = int(os.environ.get("CHAT_SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+CHAT_SESSION_IDLE_TTL = int(os.environ.get("CHAT_SESSION_IDLE_TTL", "3600"))  # 閒置多久移出記憶體（秒）
+CHAT_REHYDRATE_TURNS = int(os.environ.get("CHAT_REHYDRATE_TURNS", "10"))  # 還原時最多載入的對話輪數（一問一答為一輪）
+CHAT_TOKEN_BUDGET = int(os.environ.get("CHAT_TOKEN_BUDGET", "4000"))  # 還原 / 保留的對話最多佔用的 token 數（估計值）
+CHAT_MAX_LIVE_MESSAGES = int(os.environ.get("CHAT_MAX_LIVE_MESSAGES", "40"))  # 記憶體中每個對話最多保留的訊息數
+CHAT_WRITE_BATCH_SIZE = int(os.environ.get("CHAT_WRITE_BATCH_SIZE", "50"))
+CHAT_WRITE_INTERVAL = float(os.environ.get("CHAT_WRITE_INTERVAL", "2.0"))  # 緩衝區最久多少秒寫入一次
+
+
+def _entry_role(entry) -> str:
+    if isinstance(entry, dict):
+        return entry.get('role', 'user')
+    return getattr(entry, 'role', None) or 'model'
+
+
+def history_entry_text(entry) -> Optional[Tuple[str, str]]:
+    """從 ChatSession.history 的一筆資料取出 (role, 文字)；沒有文字內容時回傳 None"""
+    role = _entry_role(entry)
+    if isinstance(entry, dict):
+        parts = entry.get('parts', [])
+    else:
+        parts = getattr(entry, 'parts', [])
+
+    texts = []
+    for part in parts:
+        if isinstance(part, str):
+            texts.append(part)
+        elif isinstance(part, dict) and isinstance(part.get('text'), str):
+            texts.append(part['text'])
+        else:
+            text = getattr(part, 'text', None)
+            if isinstance(text, str) and text:
+                texts.append(text)
+    text = "\n".join(t for t in texts if t)
+    return (role, text) if text else None
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓文字約 1 字 1 token，其餘約 4 字元 1 token"""
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uf900' <= ch <= '\ufaff')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def trim_to_budget(messages: List[Tuple[str, str]], max_turns: int, token_budget: int) -> List[Tuple[str, str]]:
+    """
+    由新到舊保留訊息，直到超過輪數或 token 預算（至少保留最後一則）
+    結果一定以 user 開頭，符合 Gemini 對話格式
+    """
+    kept = []
+    used = 0
+    for role, text in reversed(messages[-max_turns * 2:]):
+        cost = estimate_tokens(text)
+        if kept and used + cost > token_budget:
+            break
+        kept.append((role, text))
+        used += cost
+    kept.reverse()
+    while kept and kept[0][0] != 'user':
+        kept.pop(0)
+    return kept
+
+
+def chat_session_size(session) -> int:
+    """粗估一個 ChatSession 佔用的記憶體（以對話文字長度計算）"""
+    size = 1024
+    for entry in getattr(session, 'history', []):
+        item = history_entry_text(entry)
+        size += 200 + (len(item[1].encode('utf-8')) if item else 1024)
+    return size
+
+
+class ChatHistoryWriter:
+    """
+    chat_history 的批次寫入器（只追加）
+
+    訊息先放進緩衝區，累積到 batch_size 筆或每 flush_interval 秒由背景執行緒一次寫入；
+    寫入失敗時保留在緩衝區下次重試（緩衝區有上限，超過時丟棄最舊的）
+    """
+
+    def __init__(self, database, batch_size: int = CHAT_WRITE_BATCH_SIZE,
+                 flush_interval: float = CHAT_WRITE_INTERVAL, max_buffer: int = 5000):
+        self.db = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[Tuple[str, str, str]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 確保批次依序寫入
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {'buffered': 0, 'written': 0, 'batches': 0, 'failures': 0, 'dropped': 0}
+
+    def append(self, user_id: str, role: str, text: str):
+        self._ensure_started()
+        with self._lock:
+            self._buffer.append((user_id, role, text))
+            self._stats['buffered'] += 1
+            if len(self._buffer) > self.max_buffer:
+                overflow = len(self._buffer) - self.max_buffer
+                del self._buffer[:overflow]
+                self._stats['dropped'] += overflow
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def has_pending(self, user_id: str) -> bool:
+        with self._lock:
+            return any(row[0] == user_id for row in self._buffer)
+
+    def discard(self, user_id: str):
+        """丟棄某用戶尚未寫入的訊息（清除記憶時使用）"""
+        with self._lock:
+            self._buffer = [row for row in self._buffer if row[0] != user_id]
+
+    def flush(self) -> int:
+        """立即寫入緩衝區的所有訊息，回傳寫入筆數"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            try:
+                self.db.add_chat_messages(rows)
+            except Exception as e:
+                print(f"[CHAT MEMORY] Failed to write {len(rows)} message(s): {e}")
+                with self._lock:
+                    self._buffer[:0] = rows
+                    self._stats['failures'] += 1
+                return 0
+            with self._lock:
+                self._stats['written'] += len(rows)
+                self._stats['batches'] += 1
+            return len(rows)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, 'pending': len(self._buffer)}
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+class ChatMemory:
+    """
+    有上限的對話記憶
+
+    - 活躍對話存在 BoundedCache（LRU + 閒置 TTL + 總大小上限），每個對話只保留最近的訊息
+    - 每次事件結束後 commit_touched() 把新的對話輪次交給 ChatHistoryWriter 批次寫入
+    - 記憶體中沒有對話時，以最近幾輪（受 token 預算限制）的紀錄重建 ChatSession
+    - 沒有資料庫時，淘汰即遺忘，因此閒置 TTL 會改用 session_timeout
+    """
+
+    def __init__(self, model, database=None, session_timeout: timedelta = timedelta(days=7),
+                 max_sessions: int = CHAT_SESSION_MAX, max_bytes: int = CHAT_SESSION_MAX_BYTES,
+                 idle_ttl: int = CHAT_SESSION_IDLE_TTL, rehydrate_turns: int = CHAT_REHYDRATE_TURNS,
+                 token_budget: int = CHAT_TOKEN_BUDGET, max_live_messages: int = CHAT_MAX_LIVE_MESSAGES):
+        self.model = model
+        self.db = database
+        self.writer = ChatHistoryWriter(database) if database else None
+        self.session_timeout = session_timeout
+        self.rehydrate_turns = rehydrate_turns
+        self.token_budget = token_budget
+        self.max_live_messages = max_live_messages
+        self.sessions = BoundedCache(
+            max_items=max_sessions,
+            max_bytes=max_bytes,
+            ttl=idle_ttl if database else session_timeout.total_seconds(),
+            sizeof=chat_session_size,
+            on_evict=self._on_evict,
+            name="chat_sessions",
+        )
+        self._touched = threading.local()
+        self._stats = {'created': 0, 'rehydrated': 0}
+
+    def get_session(self, user_id: str):
+        """取得用戶的 ChatSession（記憶體中沒有時從資料庫還原）"""
+        self._mark_touched(user_id)
+        try:
+            return self.sessions[user_id]
+        except KeyError:
+            pass
+
+        history = self._load_history(user_id)
+        session = self.model.start_chat(history=history)
+        session._persisted_count = len(history)  # 已寫入資料庫的訊息數
+        self.sessions[user_id] = session
+        self._stats['rehydrated' if history else 'created'] += 1
+        return session
+
+    def commit(self, user_id: str, session=None) -> int:
+        """把對話中尚未寫入的訊息交給寫入器，並修剪記憶體中過長的歷史，回傳新增訊息數"""
+        if session is None:
+            session = self.sessions.get(user_id)
+            if session is None:
+                return 0
+        try:
+            history = session.history
+        except Exception as e:
+            print(f"[CHAT MEMORY] Cannot read history for {user_id}: {e}")
+            return 0
+
+        persisted = getattr(session, '_persisted_count', 0)
+        new_messages = [item for item in (history_entry_text(e) for e in history[persisted:]) if item]
+        if self.writer:
+            for role, text in new_messages:
+                self.writer.append(user_id, role, text)
+
+        # 只保留最近的訊息（較舊的已存入資料庫），刪除時保持以 user 開頭
+        overflow = len(history) - self.max_live_messages
+        if overflow > 0:
+            while overflow < len(history) and _entry_role(history[overflow]) != 'user':
+                overflow += 1
+            del history[:overflow]
+        session._persisted_count = len(history)
+        if user_id in self.sessions:
+            self.sessions.resize(user_id)
+        return len(new_messages)
+
+    def commit_touched(self):
+        """提交本執行緒這次事件中用過的對話（事件處理結束後呼叫）"""
+        touched = getattr(self._touched, 'users', None)
+        self._touched.users = set()
+        for user_id in touched or ():
+            self.commit(user_id)
+
+    def forget(self, user_id: str):
+        """清除用戶的對話記憶（記憶體、緩衝區與資料庫）"""
+        self.sessions.pop(user_id, None)
+        if self.writer:
+            self.writer.discard(user_id)
+        if self.db:
+            try:
+                self.db.clear_chat_history(user_id)
+            except Exception as e:
+                print(f"[CHAT MEMORY] Failed to clear history for {user_id}: {e}")
+
+    def shutdown(self):
+        """結束前寫入所有對話"""
+        self.sessions.evict_all()
+        if self.writer:
+            self.writer.flush()
+
+    def stats(self) -> dict:
+        """統計資訊（監控用）"""
+        result = {**self.sessions.stats(), **self._stats}
+        if self.writer:
+            result['writer'] = self.writer.stats()
+        return result
+
+    def _mark_touched(self, user_id: str):
+        users = getattr(self._touched, 'users', None)
+        if users is None:
+            users = self._touched.users = set()
+        users.add(user_id)
+
+    def _load_history(self, user_id: str) -> List[dict]:
+        if not self.db:
+            return []
+        try:
+            if self.writer and self.writer.has_pending(user_id):
+                self.writer.flush()
+            # 時間範圍交給資料庫以自己的時鐘計算（created_at 的時區依資料庫設定，不一定是 UTC）
+            rows = self.db.get_recent_chat_history(user_id, limit=self.rehydrate_turns * 2,
+                                                   max_age=int(self.session_timeout.total_seconds()))
+        except Exception as e:
+            print(f"[CHAT MEMORY] Failed to load history for {user_id}: {e}")
+            return []
+        messages = trim_to_budget([(row['role'], row['message']) for row in rows],
+                                  self.rehydrate_turns, self.token_budget)
+        return [{'role': role, 'parts': [text]} for role, text in messages]
+
+    def _on_evict(self, user_id: str, session, reason: str):
+        """被淘汰時寫入尚未保存的訊息，確保用戶回來時能還原"""
+        if not self.writer:
+            return
+        if self.commit(user_id, session):
+            print(f"[CHAT MEMORY] Saved unsaved turns for {user_id} on eviction ({reason})")
+        self.writer.flush()
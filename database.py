@@ -3,6 +3,9 @@
 支援 SQLite（本地開發）和 PostgreSQL（生產環境）
 """
 import os
+import threading
+import time
+import weakref
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict
 import json
@@ -13,7 +16,7 @@ DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///bot_data.db")
 if DATABASE_URL.startswith("postgres"):
     # PostgreSQL (生產環境)
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values
     import urllib.parse as urlparse
     
     url = urlparse.urlparse(DATABASE_URL)
@@ -31,19 +34,263 @@ else:
     DB_TYPE = "sqlite"
     SQLITE_DB_PATH = DATABASE_URL.replace("sqlite:///", "")
 
+# 連線池設定
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))  # 等待可用連線的秒數
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "300"))  # 閒置超過即回收
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+
+
+class PoolTimeoutError(Exception):
+    """等待連線池可用連線逾時"""
+
+
+class ConnectionPool:
+    """
+    執行緒安全、有上限的資料庫連線池
+
+    - 最多同時存在 max_size 條連線，用完時等待 timeout 秒
+    - 取出閒置超過 health_check_interval 的連線時，先以 SELECT 1 檢查是否仍可用
+    - 背景執行緒定期回收閒置超過 max_idle 的連線（保留 min_size 條）
+    """
+
+    def __init__(self, connect, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 10.0, max_idle: float = 300.0,
+                 health_check_interval: float = 30.0):
+        self._connect = connect
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+
+        self._idle = []  # [(conn, last_used)]，後進先出讓熱連線優先被重用
+        self._size = 0   # 已建立的連線數（含借出中）
+        self._cond = threading.Condition()
+        self._closed = False
+        self._reaper = None
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'reaped': 0,
+            'health_check_failures': 0,
+            'waits': 0,
+            'timeouts': 0,
+        }
+
+    def acquire(self):
+        """取出一條可用連線（必要時建立新連線）"""
+        self._ensure_reaper()
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            conn, last_used = None, None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Connection pool is closed")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available within {self.timeout}s "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                # 建立新連線（在鎖外進行，避免阻塞其他執行緒）
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats['created'] += 1
+                return conn
+
+            # 閒置太久的連線先做健康檢查
+            if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(conn):
+                with self._cond:
+                    self._stats['reused'] += 1
+                return conn
+
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            self._discard(conn)
+
+    def release(self, conn):
+        """歸還連線；未提交的交易會被 rollback，失效的連線直接丟棄"""
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            if self._closed:
+                close_now = True
+            else:
+                close_now = False
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+        if close_now:
+            self._discard(conn)
+
+    def reap_idle(self) -> int:
+        """回收閒置過久的連線，回傳回收數量"""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = []
+            # _idle 由舊到新排列，最舊的先回收
+            for conn, last_used in self._idle:
+                if now - last_used > self.max_idle and self._size - len(expired) > self.min_size:
+                    expired.append(conn)
+                else:
+                    keep.append((conn, last_used))
+            self._idle = keep
+            self._size -= len(expired)
+            self._stats['reaped'] += len(expired)
+            if expired:
+                self._cond.notify(len(expired))
+
+        for conn in expired:
+            self._close_quietly(conn)
+        return len(expired)
+
+    def close(self):
+        """關閉連線池與所有閒置連線"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict:
+        """連線池狀態（供監控使用）"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self.max_size,
+                'min_size': self.min_size,
+            })
+        return stats
+
+    def _is_healthy(self, conn) -> bool:
+        try:
+            if getattr(conn, 'closed', 0):
+                return False
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            conn.rollback()
+            return True
+        except Exception as e:
+            print(f"[DB POOL] Health check failed: {e}")
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _ensure_reaper(self):
+        if self._reaper is not None or self.max_idle <= 0:
+            return
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="db-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(1.0, self.max_idle / 2)
+        while not self._closed:
+            time.sleep(interval)
+            try:
+                reaped = self.reap_idle()
+                if reaped:
+                    print(f"[DB POOL] Reaped {reaped} idle connection(s)")
+            except Exception as e:
+                print(f"[DB POOL] Reaper error: {e}")
+
+
+class PooledConnection:
+    """
+    從連線池借出的連線，介面與原本的連線相同
+    close() 歸還連線池；因例外沒有執行到 close() 時，物件被回收時也會歸還
+    """
+
+    def __init__(self, pool: ConnectionPool, conn):
+        self._conn = conn
+        self._release = weakref.finalize(self, pool.release, conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        self._release()
+
+
 class Database:
     """資料庫操作類別"""
     
     def __init__(self):
         self.db_type = DB_TYPE
+        self.pool = ConnectionPool(
+            self._connect,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+        )
         self._init_database()
     
-    def _get_connection(self):
-        """取得資料庫連接"""
+    def _connect(self):
+        """建立新的資料庫連接（由連線池呼叫）"""
         if self.db_type == "postgres":
             return psycopg2.connect(**DB_CONFIG)
         else:
-            return sqlite3.connect(SQLITE_DB_PATH)
+            # 連線會在不同執行緒間重用，需關閉 check_same_thread
+            return sqlite3.connect(SQLITE_DB_PATH, check_same_thread=False, timeout=DB_POOL_TIMEOUT)
+
+    def _get_connection(self):
+        """從連線池借出連線；用完呼叫 close() 會歸還連線池，而不是真的關閉"""
+        return PooledConnection(self.pool, self.pool.acquire())
+
+    def get_pool_stats(self) -> Dict:
+        """取得連線池統計（監控用）"""
+        stats = self.pool.stats()
+        stats['db_type'] = self.db_type
+        return stats
     
     def _init_database(self):
         """初始化資料庫表格"""
@@ -105,9 +352,18 @@ class Database:
                 CREATE TABLE IF NOT EXISTS kv_store (
                     key VARCHAR(255) PRIMARY KEY,
                     value TEXT NOT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    expires_at TIMESTAMP
                 )
             """)
+            # 舊版資料表補上 expires_at 欄位
+            cursor.execute("""
+                ALTER TABLE kv_store ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP
+            """)
+            # is_sent 為 BOOLEAN，無法存 2：發送失敗改以 is_failed 欄位標記（is_sent 同時設為 TRUE，不再重試）
+            cursor.execute("""
+                ALTER TABLE reminders ADD COLUMN IF NOT EXISTS is_failed BOOLEAN DEFAULT FALSE
+            """)
 
             # 建立索引
             cursor.execute("""
@@ -118,6 +374,10 @@ class Database:
                 CREATE INDEX IF NOT EXISTS idx_reminders_pending 
                 ON reminders(is_sent, reminder_time)
             """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_history_user
+                ON chat_history(user_id, id)
+            """)
         else:
             # SQLite 語法
             cursor.execute("""
@@ -173,9 +433,14 @@ class Database:
                 CREATE TABLE IF NOT EXISTS kv_store (
                     key TEXT PRIMARY KEY,
                     value TEXT NOT NULL,
-                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    expires_at TEXT
                 )
             """)
+            # 舊版資料表補上 expires_at 欄位
+            cursor.execute("PRAGMA table_info(kv_store)")
+            if 'expires_at' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE kv_store ADD COLUMN expires_at TEXT")
 
             # 建立索引
             cursor.execute("""
@@ -186,6 +451,10 @@ class Database:
                 CREATE INDEX IF NOT EXISTS idx_reminders_pending 
                 ON reminders(is_sent, reminder_time)
             """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_history_user
+                ON chat_history(user_id, id)
+            """)
         
         conn.commit()
         conn.close()
@@ -225,7 +494,6 @@ class Database:
             current_time = datetime.now()
         
         conn = self._get_connection()
-        
         if self.db_type == "postgres":
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             cursor.execute("""
@@ -272,10 +540,10 @@ class Database:
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        # 使用 2 代表發送失敗
+        # 使用 2 代表發送失敗（PostgreSQL 的 is_sent 為 BOOLEAN，改用 is_failed 欄位）
         if self.db_type == "postgres":
             cursor.execute("""
-                UPDATE reminders SET is_sent = 2 WHERE id = %s
+                UPDATE reminders SET is_sent = TRUE, is_failed = TRUE WHERE id = %s
             """, (reminder_id,))
         else:
             cursor.execute("""
@@ -285,14 +553,61 @@ class Database:
         conn.commit()
         conn.close()
 
+    def mark_reminders_sent(self, reminder_ids: List[int]) -> int:
+        """批次標記提醒已發送（獨立交易），回傳更新筆數"""
+        reminder_ids = list(reminder_ids or [])
+        if not reminder_ids:
+            return 0
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            cursor.execute("""
+                UPDATE reminders SET is_sent = TRUE WHERE id = ANY(%s)
+            """, (reminder_ids,))
+        else:
+            placeholders = ", ".join("?" * len(reminder_ids))
+            cursor.execute(f"""
+                UPDATE reminders SET is_sent = 1 WHERE id IN ({placeholders})
+            """, reminder_ids)
+
+        updated = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return updated
+
+    def mark_reminders_failed(self, reminder_ids: List[int]) -> int:
+        """批次標記提醒因額度不足發送失敗（獨立交易），回傳更新筆數"""
+        reminder_ids = list(reminder_ids or [])
+        if not reminder_ids:
+            return 0
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            cursor.execute("""
+                UPDATE reminders SET is_sent = TRUE, is_failed = TRUE WHERE id = ANY(%s)
+            """, (reminder_ids,))
+        else:
+            placeholders = ", ".join("?" * len(reminder_ids))
+            cursor.execute(f"""
+                UPDATE reminders SET is_sent = 2 WHERE id IN ({placeholders})
+            """, reminder_ids)
+
+        updated = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return updated
+
     def get_failed_reminders(self, user_id: str) -> List[Dict]:
         """取得發送失敗的提醒"""
         conn = self._get_connection()
-        
         if self.db_type == "postgres":
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             cursor.execute("""
-                SELECT * FROM reminders WHERE user_id = %s AND is_sent = 2
+                SELECT * FROM reminders WHERE user_id = %s AND is_failed = TRUE
                 ORDER BY reminder_time
             """, (user_id,))
         else:
@@ -313,17 +628,17 @@ class Database:
     
     def is_system_quota_full(self) -> bool:
         """檢查系統當月額度是否已滿 (只要本月有任一發送失敗紀錄即視為已滿)"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         # 取得本月第一天
         today = datetime.now()
         first_day = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
         if self.db_type == "postgres":
             cursor.execute("""
                 SELECT 1 FROM reminders 
-                WHERE is_sent = 2 AND reminder_time >= %s
+                WHERE is_failed = TRUE AND reminder_time >= %s
                 LIMIT 1
             """, (first_day,))
         else:
@@ -340,7 +655,6 @@ class Database:
     def get_user_reminders(self, user_id: str, include_sent: bool = False) -> List[Dict]:
         """取得用戶的所有提醒"""
         conn = self._get_connection()
-        
         if self.db_type == "postgres":
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             if include_sent:
@@ -400,7 +714,7 @@ class Database:
         
         if self.db_type == "postgres":
             cursor.execute("""
-                DELETE FROM reminders WHERE user_id = %s AND is_sent = 0
+                DELETE FROM reminders WHERE user_id = %s AND is_sent = FALSE
             """, (user_id,))
         else:
             cursor.execute("""
@@ -445,7 +759,6 @@ class Database:
     def get_user_trip_plans(self, user_id: str, limit: int = 10) -> List[Dict]:
         """取得用戶的行程規劃"""
         conn = self._get_connection()
-        
         if self.db_type == "postgres":
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             cursor.execute("""
@@ -471,7 +784,6 @@ class Database:
     def get_trip_plan_by_id(self, plan_id: int, user_id: str) -> Optional[Dict]:
         """取得特定行程規劃"""
         conn = self._get_connection()
-        
         if self.db_type == "postgres":
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             cursor.execute("""
@@ -496,45 +808,281 @@ class Database:
         conn.close()
         return plan
 
+    # ==================
+    # 聊天記錄
+    # ==================
+
+    def add_chat_messages(self, rows: List[tuple]) -> int:
+        """批次新增聊天記錄（單一交易），rows 為 [(user_id, role, message), ...]，回傳新增筆數"""
+        if not rows:
+            return 0
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            execute_values(cursor, """
+                INSERT INTO chat_history (user_id, role, message) VALUES %s
+            """, rows)
+        else:
+            cursor.executemany("""
+                INSERT INTO chat_history (user_id, role, message) VALUES (?, ?, ?)
+            """, rows)
+
+        conn.commit()
+        conn.close()
+        return len(rows)
+
+    def get_recent_chat_history(self, user_id: str, limit: int = 20,
+                                max_age: Optional[int] = None) -> List[Dict]:
+        """
+        取得用戶最近的聊天記錄（依時間由舊到新排列）
+        max_age：只取最近幾秒內的記錄；以資料庫自己的時鐘計算，與 created_at 的預設值使用相同時區
+        """
+        conn = self._get_connection()
+        if self.db_type == "postgres":
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            # created_at 是 TIMESTAMP（無時區），預設值為連線時區的 CURRENT_TIMESTAMP，因此與 LOCALTIMESTAMP 比較
+            cursor.execute("""
+                SELECT role, message, created_at FROM chat_history
+                WHERE user_id = %s
+                  AND (%s IS NULL OR created_at >= LOCALTIMESTAMP - %s * INTERVAL '1 second')
+                ORDER BY id DESC LIMIT %s
+            """, (user_id, max_age, max_age, limit))
+            rows = cursor.fetchall()
+        else:
+            cursor = conn.cursor()
+            # SQLite 的 CURRENT_TIMESTAMP 與 datetime('now') 都是 UTC 的 'YYYY-MM-DD HH:MM:SS'
+            cursor.execute("""
+                SELECT role, message, created_at FROM chat_history
+                WHERE user_id = ? AND (? IS NULL OR created_at >= datetime('now', ?))
+                ORDER BY id DESC LIMIT ?
+            """, (user_id, max_age, f"-{int(max_age)} seconds" if max_age is not None else None, limit))
+            columns = [description[0] for description in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        conn.close()
+        return list(reversed(rows))
+
+    def clear_chat_history(self, user_id: str) -> int:
+        """刪除用戶的所有聊天記錄"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            cursor.execute("DELETE FROM chat_history WHERE user_id = %s", (user_id,))
+        else:
+            cursor.execute("DELETE FROM chat_history WHERE user_id = ?", (user_id,))
+
+        deleted_count = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted_count
+
     # ==================
     # Key-Value 存儲 (Quota 等用途)
     # ==================
     
     def get(self, key: str) -> Optional[str]:
-        """取得 kv_store 的值"""
+        """取得 kv_store 的值（已過期視為不存在）"""
+        now = datetime.now()
+
         conn = self._get_connection()
         cursor = conn.cursor()
         
         if self.db_type == "postgres":
-            cursor.execute("SELECT value FROM kv_store WHERE key = %s", (key,))
+            cursor.execute("""
+                SELECT value FROM kv_store
+                WHERE key = %s AND (expires_at IS NULL OR expires_at > %s)
+            """, (key, now))
         else:
-            cursor.execute("SELECT value FROM kv_store WHERE key = ?", (key,))
+            cursor.execute("""
+                SELECT value FROM kv_store
+                WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)
+            """, (key, now.isoformat()))
             
         result = cursor.fetchone()
         conn.close()
         return result[0] if result else None
         
-    def set(self, key: str, value: str):
-        """設定 kv_store 的值"""
+    def set(self, key: str, value: str, ttl: Optional[int] = None):
+        """設定 kv_store 的值（ttl 秒後過期，None 表示永久）"""
+        value = str(value)
+        expires_at = datetime.now() + timedelta(seconds=ttl) if ttl else None
+
         conn = self._get_connection()
         cursor = conn.cursor()
-        value = str(value)
         
         if self.db_type == "postgres":
             cursor.execute("""
-                INSERT INTO kv_store (key, value)
-                VALUES (%s, %s)
-                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP
-            """, (key, value))
+                INSERT INTO kv_store (key, value, expires_at)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at, updated_at = CURRENT_TIMESTAMP
+            """, (key, value, expires_at))
         else:
             cursor.execute("""
-                INSERT OR REPLACE INTO kv_store (key, value, updated_at)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-            """, (key, value))
+                INSERT OR REPLACE INTO kv_store (key, value, updated_at, expires_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+            """, (key, value, expires_at.isoformat() if expires_at else None))
             
         conn.commit()
         conn.close()
 
+    def incr(self, key: str, delta: int = 1, ttl: Optional[int] = None,
+             minimum: Optional[int] = None) -> int:
+        """
+        原子性加減計數器並回傳新值（單一 UPSERT 語句，多執行緒同時呼叫也不會遺失更新）
+
+        - key 不存在或已過期時從 0 起算，並以 ttl 設定新的到期時間
+        - 既有 key 的到期時間維持不變（例如每日配額不會因為再次使用而延後重置）
+        - minimum 不為 None 時，結果不會低於 minimum（例如退回配額時不會變負數）
+        """
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ttl) if ttl else None
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            current = """CASE WHEN kv_store.expires_at IS NOT NULL AND kv_store.expires_at <= %(now)s
+                              THEN 0 ELSE CAST(kv_store.value AS BIGINT) END + %(delta)s"""
+            initial = "%(delta)s"
+            if minimum is not None:
+                current = f"GREATEST({current}, %(minimum)s)"
+                initial = f"GREATEST({initial}, %(minimum)s)"
+            cursor.execute(f"""
+                INSERT INTO kv_store (key, value, expires_at)
+                VALUES (%(key)s, CAST({initial} AS TEXT), %(expires_at)s)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = CAST({current} AS TEXT),
+                    expires_at = CASE WHEN kv_store.expires_at IS NOT NULL AND kv_store.expires_at <= %(now)s
+                                      THEN EXCLUDED.expires_at
+                                      ELSE COALESCE(kv_store.expires_at, EXCLUDED.expires_at) END,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING value
+            """, {'key': key, 'delta': delta, 'minimum': minimum, 'now': now, 'expires_at': expires_at})
+            value = cursor.fetchone()[0]
+        else:
+            current = """CASE WHEN kv_store.expires_at IS NOT NULL AND kv_store.expires_at <= :now
+                              THEN 0 ELSE CAST(kv_store.value AS INTEGER) END + :delta"""
+            initial = ":delta"
+            if minimum is not None:
+                current = f"MAX({current}, :minimum)"
+                initial = f"MAX({initial}, :minimum)"
+            sql = f"""
+                INSERT INTO kv_store (key, value, updated_at, expires_at)
+                VALUES (:key, {initial}, CURRENT_TIMESTAMP, :expires_at)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = {current},
+                    expires_at = CASE WHEN kv_store.expires_at IS NOT NULL AND kv_store.expires_at <= :now
+                                      THEN excluded.expires_at
+                                      ELSE COALESCE(kv_store.expires_at, excluded.expires_at) END,
+                    updated_at = CURRENT_TIMESTAMP
+            """
+            params = {'key': key, 'delta': delta, 'minimum': minimum, 'now': now.isoformat(),
+                      'expires_at': expires_at.isoformat() if expires_at else None}
+            if sqlite3.sqlite_version_info >= (3, 35, 0):
+                cursor.execute(sql + " RETURNING value", params)
+                value = cursor.fetchone()[0]
+            else:
+                # 舊版 SQLite 不支援 RETURNING；UPSERT 已取得寫入鎖，同一交易內讀回仍是原子的
+                cursor.execute(sql, params)
+                cursor.execute("SELECT value FROM kv_store WHERE key = ?", (key,))
+                value = cursor.fetchone()[0]
+
+        conn.commit()
+        conn.close()
+        return int(value)
+
+    def delete(self, key: str) -> bool:
+        """刪除 kv_store 的值"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            cursor.execute("DELETE FROM kv_store WHERE key = %s", (key,))
+        else:
+            cursor.execute("DELETE FROM kv_store WHERE key = ?", (key,))
+
+        deleted = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return deleted
+
+    def keys_with_prefix(self, prefix: str) -> List[str]:
+        """列出指定前綴且未過期的 key"""
+        now = datetime.now()
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            cursor.execute("""
+                SELECT key FROM kv_store
+                WHERE key LIKE %s ESCAPE '\\' AND (expires_at IS NULL OR expires_at > %s)
+            """, (pattern, now))
+        else:
+            cursor.execute("""
+                SELECT key FROM kv_store
+                WHERE key LIKE ? ESCAPE '\\' AND (expires_at IS NULL OR expires_at > ?)
+            """, (pattern, now.isoformat()))
+
+        keys = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return keys
+
+    def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        """
+        取得或續約具名租約（多個 Worker 中只有持有者會執行，例如排程器）
+        租約不存在、已過期或本來就屬於 owner 時成功
+        """
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ttl)
+        key = f"lease:{name}"
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            cursor.execute("""
+                INSERT INTO kv_store (key, value, expires_at)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = EXCLUDED.value, expires_at = EXCLUDED.expires_at, updated_at = CURRENT_TIMESTAMP
+                WHERE kv_store.value = EXCLUDED.value OR kv_store.expires_at <= %s
+            """, (key, owner, expires_at, now))
+        else:
+            cursor.execute("""
+                INSERT INTO kv_store (key, value, updated_at, expires_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = excluded.value, expires_at = excluded.expires_at, updated_at = CURRENT_TIMESTAMP
+                WHERE kv_store.value = excluded.value OR kv_store.expires_at <= ?
+            """, (key, owner, expires_at.isoformat(), now.isoformat()))
+
+        acquired = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return acquired
+
+    def purge_expired_keys(self) -> int:
+        """清除已過期的 kv_store 資料，回傳刪除筆數"""
+        now = datetime.now()
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            cursor.execute("DELETE FROM kv_store WHERE expires_at IS NOT NULL AND expires_at <= %s", (now,))
+        else:
+            cursor.execute("DELETE FROM kv_store WHERE expires_at IS NOT NULL AND expires_at <= ?", (now.isoformat(),))
+
+        deleted_count = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted_count
+
     def add_pending_notification(self, user_id: str, message_text: str):
         """新增待讀取通知"""
         conn = self._get_connection()
@@ -554,10 +1102,30 @@ class Database:
         conn.commit()
         conn.close()
 
+    def add_pending_notifications(self, rows: List[tuple]) -> int:
+        """批次新增待讀取通知（單一交易），rows 為 [(user_id, message_text), ...]"""
+        if not rows:
+            return 0
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        if self.db_type == "postgres":
+            execute_values(cursor, """
+                INSERT INTO pending_notifications (user_id, message_text) VALUES %s
+            """, rows)
+        else:
+            cursor.executemany("""
+                INSERT INTO pending_notifications (user_id, message_text) VALUES (?, ?)
+            """, rows)
+
+        conn.commit()
+        conn.close()
+        return len(rows)
+
     def get_and_clear_pending_notifications(self, user_id: str) -> List[str]:
         """取得並清除用戶的所有待讀取通知"""
         conn = self._get_connection()
-        
         # Get notifications
         if self.db_type == "postgres":
             cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -580,8 +1148,8 @@ class Database:
             else:
                 cursor.execute("DELETE FROM pending_notifications WHERE user_id = ?", (user_id,))
             conn.commit()
-            
         conn.close()
+            
         return messages
 
 
@@ -0,0 +1,238 @@
+"""
+事件執行器模組 - 背景處理 LINE Webhook 事件
+同一個 key（用戶）的事件依序執行，不同用戶之間平行處理；佇列有上限，滿了即拒絕
+另支援 debounce：收集同一用戶一段時間內的多個事件，合併成一次處理
+"""
+import os
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from latency_stats import LatencyStats
+
+EVENT_WORKERS = int(os.environ.get("EVENT_WORKERS", "8"))
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "200"))
+
+
+class QueueFullError(Exception):
+    """事件佇列已滿"""
+
+
+class KeyedExecutor:
+    """
+    依 key 分流的執行緒池
+
+    - 每個 key 有自己的佇列，同一時間只會有一個 worker 處理該 key（確保同一用戶事件的順序）
+    - 不同 key 由多個 worker 平行處理，執行完一個任務就輪到下一個 key，避免單一用戶霸佔 worker
+    - 所有 key 的待處理任務總數不超過 max_queue，超過時 submit 會拋出 QueueFullError
+    - after_task 會在每個任務結束後（同一執行緒內）呼叫，例如寫回用戶狀態
+    - debounce() 收集同一 key 的項目，靜止 delay 秒後以 fn(key, items) 排入該 key 的佇列
+    """
+
+    def __init__(self, workers: int = EVENT_WORKERS, max_queue: int = EVENT_QUEUE_SIZE,
+                 after_task: Optional[Callable] = None, name: str = "event"):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.after_task = after_task
+        self.name = name
+
+        self._lanes: Dict[str, deque] = {}  # {key: deque([(fn, args, kwargs, enqueued_at)])}
+        self._ready = deque()               # 有待處理任務且沒有 worker 在處理的 key
+        self._active = set()                # 正在被處理的 key
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._shutdown = False
+
+        # debounce：{(key, name): {'fn', 'items', 'first', 'deadline'}}，由單一計時執行緒觸發
+        self._debounced: Dict[Tuple[str, str], Dict] = {}
+        self._timers = []  # heap of (deadline, seq, (key, name))
+        self._timer_seq = itertools.count()
+        self._timer_cond = threading.Condition()
+        self._timer_thread: Optional[threading.Thread] = None
+
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+                       'debounced_items': 0, 'debounced_batches': 0}
+        self._wait = LatencyStats()
+        self._run = LatencyStats()
+
+    def submit(self, key: str, fn: Callable, *args, **kwargs):
+        """送出單一任務"""
+        self.submit_many([(key, fn, args, kwargs)])
+
+    def submit_many(self, tasks: List[Tuple[str, Callable, tuple, dict]], force: bool = False):
+        """
+        一次送出多個任務：全部排入或全部拒絕（避免 Webhook 重送時重複處理）
+        force=True 時不受佇列上限限制（用於已被接受的事件所產生的後續任務）
+        """
+        self._ensure_started()
+        now = time.monotonic()
+        with self._cond:
+            if self._shutdown and not force:
+                raise QueueFullError(f"{self.name} executor is shutting down")
+            if not force and self._pending + len(tasks) > self.max_queue:
+                self._stats['rejected'] += len(tasks)
+                raise QueueFullError(
+                    f"{self.name} queue is full ({self._pending}/{self.max_queue})"
+                )
+            for key, fn, args, kwargs in tasks:
+                lane = self._lanes.get(key)
+                if lane is None:
+                    lane = self._lanes[key] = deque()
+                    if key not in self._active:
+                        self._ready.append(key)
+                lane.append((fn, args, kwargs, now))
+                self._pending += 1
+                self._stats['submitted'] += 1
+            self._cond.notify(len(tasks))
+
+    def debounce(self, key: str, name: str, delay: float, fn: Callable, item,
+                 max_wait: Optional[float] = None):
+        """
+        收集 item，同一 (key, name) 在 delay 秒內沒有新項目時，將 fn(key, items) 排入 key 的佇列
+        max_wait 限制從第一個項目起最多等待的秒數（避免持續有新項目時永遠不觸發）
+        """
+        self._ensure_started()
+        now = time.monotonic()
+        slot = (key, name)
+        with self._timer_cond:
+            entry = self._debounced.get(slot)
+            if entry is None:
+                entry = self._debounced[slot] = {'fn': fn, 'items': [], 'first': now}
+            entry['fn'] = fn
+            entry['items'].append(item)
+            deadline = now + delay
+            if max_wait is not None:
+                deadline = min(deadline, entry['first'] + max_wait)
+            entry['deadline'] = deadline
+            heapq.heappush(self._timers, (deadline, next(self._timer_seq), slot))
+            self._timer_cond.notify()
+        with self._cond:
+            self._stats['debounced_items'] += 1
+
+    def cancel_debounce(self, key: str, name: str) -> list:
+        """取消尚未觸發的 debounce，回傳已收集的項目"""
+        with self._timer_cond:
+            entry = self._debounced.pop((key, name), None)
+        return entry['items'] if entry else []
+
+    def stats(self) -> Dict:
+        """佇列深度與延遲統計（監控用）"""
+        with self._timer_cond:
+            debounce_pending = len(self._debounced)
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queue_depth': self._pending,
+                'active_keys': len(self._active),
+                'waiting_keys': len(self._lanes),
+                'debounce_pending': debounce_pending,
+                **self._stats,
+                'wait_latency': self._wait.snapshot(),
+                'run_latency': self._run.snapshot(),
+            }
+
+    def shutdown(self, timeout: float = 25.0):
+        """停止接收新任務，立即觸發尚未到期的 debounce，並等待已排入的任務完成"""
+        with self._timer_cond:
+            pending = list(self._debounced.items())
+            self._debounced.clear()
+            self._timers.clear()
+        for (key, _name), entry in pending:
+            self._fire(key, entry)
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        with self._timer_cond:
+            self._timer_cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    def _ensure_started(self):
+        # 延遲到第一次使用才啟動執行緒（Gunicorn fork 之後才建立）
+        if self._threads:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._timer_thread = threading.Thread(target=self._timer_loop, name=f"{self.name}-timer", daemon=True)
+            self._timer_thread.start()
+
+    def _timer_loop(self):
+        while True:
+            with self._timer_cond:
+                while True:
+                    if self._shutdown:
+                        return
+                    if self._timers:
+                        wait = self._timers[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._timer_cond.wait(wait)
+                    else:
+                        self._timer_cond.wait()
+                deadline, _, slot = heapq.heappop(self._timers)
+                entry = self._debounced.get(slot)
+                # deadline 不符代表之後又有新項目（heap 中是舊的計時），略過
+                if entry is None or entry['deadline'] != deadline:
+                    continue
+                del self._debounced[slot]
+            self._fire(slot[0], entry)
+
+    def _fire(self, key: str, entry: Dict):
+        with self._cond:
+            self._stats['debounced_batches'] += 1
+        self.submit_many([(key, entry['fn'], (key, entry['items']), {})], force=True)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ready and not (self._shutdown and self._pending == 0):
+                    self._cond.wait()
+                if not self._ready:
+                    return  # 已關閉且沒有剩餘任務
+                key = self._ready.popleft()
+                lane = self._lanes[key]
+                fn, args, kwargs, enqueued_at = lane.popleft()
+                if not lane:
+                    del self._lanes[key]
+                self._active.add(key)
+                self._pending -= 1
+
+            started = time.monotonic()
+            failed = False
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                failed = True
+                print(f"[{self.name.upper()} EXECUTOR] Task for {key} failed: {type(e).__name__}: {e}")
+                import traceback
+                traceback.print_exc()
+            finally:
+                if self.after_task:
+                    try:
+                        self.after_task()
+                    except Exception as e:
+                        print(f"[{self.name.upper()} EXECUTOR] after_task error: {e}")
+            finished = time.monotonic()
+
+            with self._cond:
+                self._wait.add(started - enqueued_at)
+                self._run.add(finished - started)
+                self._stats['failed' if failed else 'completed'] += 1
+                self._active.discard(key)
+                if key in self._lanes:
+                    # 同一用戶還有任務：排到隊尾，讓其他用戶先跑
+                    self._ready.append(key)
+                    self._cond.notify()
+                elif self._shutdown and self._pending == 0:
+                    self._cond.notify_all()
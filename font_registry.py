@@ -0,0 +1,198 @@
+"""
+字體管理模組 - 長輩圖等圖片文字使用的字體
+- 字體路徑只解析一次；雲端環境缺少字體時於啟動時在背景下載並驗證，不在用戶請求中下載
+- ImageFont.truetype() 的結果依 (路徑, 大小, 字重) 快取，不必每次重新解析數 MB 的 CJK 字型檔
+- 快取的字體物件由所有請求共用，取得後不可再呼叫 set_variation_by_name 等會修改字體的方法
+"""
+import os
+import time
+import threading
+from typing import Dict, Optional
+
+from PIL import ImageFont
+
+from bounded_cache import BoundedCache
+from http_client import http_client
+
+FONT_DIR = os.environ.get("FONT_DIR", os.path.join(os.getcwd(), "static", "fonts"))
+FONT_CACHE_MAX_ITEMS = int(os.environ.get("FONT_CACHE_MAX_ITEMS", "256"))
+FONT_PRELOAD = os.environ.get("FONT_PRELOAD", "true").lower() == "true"
+FONT_RETRY_INTERVAL = 600  # 下載失敗後，隔多久才再試（秒）
+
+# 優先檢查 Windows 本地字體 (開發環境)
+# 使用微軟正黑體粗體 (msjhbd.ttc) 作為主要字體，解決字體過細問題
+WINDOWS_FONTS = {
+    'msjh': "C:\\Windows\\Fonts\\msjhbd.ttc",   # 改用粗體
+    'heiti': "C:\\Windows\\Fonts\\msjhbd.ttc",  # 改用粗體
+    'kaiti': "C:\\Windows\\Fonts\\msjhbd.ttc",  # 改用正黑體粗體 (因為標楷體 kaiu.ttf 太細)
+    'ming': "C:\\Windows\\Fonts\\mingliu.ttc"
+}
+
+# Linux/Cloud 環境：使用 Free Google Fonts (TTF)
+# 使用 NotoSerifTC (楷體/明體替代品) 和 NotoSansTC (黑體替代品)
+CLOUD_FONTS = {
+    'kaiti': 'NotoSansTC-Bold.ttf',  # 改用 NotoSansTC-Bold (因為 NotoSerifTC-Regular 太細)
+    'heiti': 'NotoSansTC-Bold.ttf',
+    'ming': 'NotoSerifTC-Regular.ttf',
+    'default': 'NotoSansTC-Regular.ttf'
+}
+
+# 錯誤 "unknown file format" 通常是因為下載下來的不是字體檔 (例如 404 HTML)，下載後會先驗證
+FONT_URLS = {
+    # Noto Sans TC 為 Variable Font，粗體以 set_variation_by_name('Bold') 設定
+    'NotoSansTC-Bold.ttf': "https://github.com/google/fonts/raw/main/ofl/notosanstc/NotoSansTC%5Bwght%5D.ttf",
+    'NotoSansTC-Regular.ttf': "https://github.com/google/fonts/raw/main/ofl/notosanstc/NotoSansTC%5Bwght%5D.ttf",
+    'NotoSerifTC-Regular.ttf': "https://github.com/google/fonts/raw/main/ofl/notoseriftc/NotoSerifTC%5Bwght%5D.ttf"
+}
+
+
+class FontRegistry:
+    """字體路徑與字體物件的共用快取（執行緒安全）"""
+
+    def __init__(self, font_dir: str = FONT_DIR, max_items: int = FONT_CACHE_MAX_ITEMS):
+        self.font_dir = font_dir
+        self._paths: Dict[str, Optional[str]] = {}  # {字體類型: 路徑}
+        self._failed_at: Dict[str, float] = {}  # {檔名: 上次下載失敗時間}
+        self._fonts = BoundedCache(max_items=max_items, name="fonts")  # {(路徑, 大小, 字重): FreeTypeFont}
+        self._lock = threading.Lock()
+        self._download_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'load_seconds': 0.0, 'downloads': 0, 'download_failures': 0}
+
+    # ---- 路徑 ----
+
+    def path(self, font_type: str) -> Optional[str]:
+        """取得字體路徑（結果會被記住；缺少的雲端字體會下載）"""
+        if font_type in self._paths:
+            return self._paths[font_type]
+        path = self._resolve(font_type)
+        if path:
+            with self._lock:
+                self._paths[font_type] = path
+        return path
+
+    def _resolve(self, font_type: str) -> Optional[str]:
+        # 如果是 Windows 且檔案存在，直接回傳
+        if os.name == 'nt':
+            win_path = WINDOWS_FONTS.get(font_type)
+            # 如果粗體不存在，退回一般體
+            if win_path and not os.path.exists(win_path):
+                win_path = win_path.replace("bd.ttc", ".ttc")
+            if win_path and os.path.exists(win_path):
+                return win_path
+
+        filename = CLOUD_FONTS.get(font_type, CLOUD_FONTS['default'])
+        local_path = os.path.join(self.font_dir, filename)
+        # 也接受舊版放置的 .otf 檔名
+        for candidate in (local_path, os.path.splitext(local_path)[0] + ".otf"):
+            if os.path.exists(candidate):
+                return candidate
+        return self._download(filename, local_path)
+
+    def _download(self, filename: str, local_path: str) -> Optional[str]:
+        url = FONT_URLS.get(filename)
+        if not url:
+            return None
+        with self._download_lock:
+            if os.path.exists(local_path):
+                return local_path  # 其他執行緒剛下載完成
+            if time.time() - self._failed_at.get(filename, 0) < FONT_RETRY_INTERVAL:
+                return None
+            print(f"[FONT] Downloading {filename} from {url}...")
+            try:
+                os.makedirs(self.font_dir, exist_ok=True)
+                # 模擬瀏覽器 User-Agent 避免被阻擋
+                r = http_client.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=30)
+                if r.status_code == 200 and len(r.content) > 1000:  # 確保不是空的或錯誤頁面
+                    tmp_path = local_path + ".tmp"
+                    with open(tmp_path, 'wb') as f:
+                        f.write(r.content)
+                    ImageFont.truetype(tmp_path, 12)  # 驗證是合法的字體檔
+                    os.replace(tmp_path, local_path)
+                    self._stats['downloads'] += 1
+                    print(f"[FONT] Successfully downloaded {local_path}, size: {len(r.content)} bytes")
+                    return local_path
+                print(f"[FONT] Download failed. Code: {r.status_code}, Content-Type: {r.headers.get('Content-Type')}")
+            except Exception as e:
+                print(f"[FONT] Download exception: {e}")
+                try:
+                    os.remove(local_path + ".tmp")
+                except OSError:
+                    pass
+            self._failed_at[filename] = time.time()
+            self._stats['download_failures'] += 1
+            return None
+
+    # ---- 字體物件 ----
+
+    def font(self, path: Optional[str], size: int, variation: Optional[str] = None):
+        """
+        取得字體物件（依 路徑、大小、字重 快取）
+        variation 為 Variable Font 的樣式名稱（例如 'Bold'），字體不支援時忽略
+        無法載入時拋出例外（與 ImageFont.truetype 相同）
+        """
+        size = int(size)
+        key = (path, size, variation)
+        font = self._fonts.get(key)
+        if font is not None:
+            self._count('hits')
+            return font
+
+        started = time.monotonic()
+        font = ImageFont.truetype(path, size)
+        if variation:
+            try:
+                font.set_variation_by_name(variation)
+            except Exception:
+                pass
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats['misses'] += 1
+            self._stats['load_seconds'] += elapsed
+        self._fonts[key] = font
+        return font
+
+    # ---- 啟動 ----
+
+    def preload(self):
+        """在背景解析（必要時下載）所有字體並預先載入常用大小"""
+        if not FONT_PRELOAD:
+            return
+
+        def run():
+            started = time.monotonic()
+            for font_type in ('kaiti', 'heiti', 'ming', 'default'):
+                path = self.path(font_type)
+                if not path:
+                    print(f"[FONT] Preload: no font available for {font_type}")
+                    continue
+                try:
+                    self.font(path, 60, 'Bold')  # create_meme_image 的預設大小
+                except Exception as e:
+                    print(f"[FONT] Preload: invalid font {path}: {e}")
+                    with self._lock:
+                        self._paths.pop(font_type, None)
+            print(f"[FONT] Preload done in {(time.monotonic() - started) * 1000:.0f} ms")
+
+        threading.Thread(target=run, name="font-preload", daemon=True).start()
+
+    def stats(self) -> Dict:
+        """命中率與省下的載入時間（監控用）"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['paths'] = dict(self._paths)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 3) if total else 0.0
+        avg_load = stats['load_seconds'] / stats['misses'] if stats['misses'] else 0.0
+        stats['avg_load_ms'] = round(avg_load * 1000, 2)
+        stats['estimated_saved_ms'] = round(avg_load * stats['hits'] * 1000, 1)
+        stats['load_seconds'] = round(stats['load_seconds'], 3)
+        stats['cached_fonts'] = len(self._fonts)
+        return stats
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+
+# 全域字體管理
+font_registry = FontRegistry()
@@ -1,31 +1,99 @@
 """
 Google Cloud Storage 工具模組
 負責檔案上傳與公開連結取得
+
+上傳的物件以內容的 SHA-256 命名（cas/<sha256>.<ext>）：
+相同內容（例如同一張選單圖、重送的圖片）只傳一次，之後直接回傳既有的公開網址
+
+- 可上傳本地檔案、記憶體中的 bytes 或 file-like 串流（產生的圖片不必先寫入磁碟）
+- 大檔案（音訊、影片）使用分段的 resumable upload，單一段落失敗只需重送該段
+- upload_async() 在背景上傳並回傳 Future，呼叫端可同時處理其他工作
+- 設定 STORAGE_EMULATOR_HOST 時連線到本機的模擬 GCS 伺服器（例如 fake-gcs-server）測試
 """
+import io
 import os
 import uuid
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Optional, Union
 from google.cloud import storage
 from datetime import datetime
 
+from bounded_cache import BoundedCache
+
+try:
+    from database import db
+except ImportError:
+    db = None
+
+GCS_DEDUP = os.environ.get("GCS_DEDUP", "true").lower() == "true"  # false 時沿用舊的 year/month/uuid 命名
+GCS_DEDUP_INDEX_TTL = int(os.environ.get("GCS_DEDUP_INDEX_TTL", str(7 * 24 * 60 * 60)))  # 已上傳物件索引的保留秒數
+GCS_RESUMABLE_THRESHOLD = int(os.environ.get("GCS_RESUMABLE_THRESHOLD", str(5 * 1024 * 1024)))  # 超過此大小使用分段上傳
+GCS_CHUNK_SIZE = int(os.environ.get("GCS_CHUNK_SIZE", str(8 * 1024 * 1024)))  # 分段大小（需為 256 KB 的倍數）
+GCS_UPLOAD_WORKERS = int(os.environ.get("GCS_UPLOAD_WORKERS", "4"))  # 背景上傳的執行緒數
+GCS_SPOOL_MAX_BYTES = 16 * 1024 * 1024  # 無法倒帶的串流先暫存，超過此大小才寫入暫存檔
+KEY_PREFIX = "gcs:cas:"
+
+_CHUNK_ALIGNMENT = 256 * 1024
+
 # 全域 GCS 客戶端
 _storage_client = None
 
+# 已上傳物件的索引 {物件名稱: 公開網址}；kv_store 讓其他 Worker 與重新啟動後也能使用
+_uploaded = BoundedCache(max_items=10000, ttl=GCS_DEDUP_INDEX_TTL, name="gcs_uploaded")
+_stats = {'uploads': 0, 'index_hits': 0, 'remote_hits': 0, 'bytes_uploaded': 0, 'bytes_saved': 0}
+_stats_lock = threading.Lock()
+_upload_pool = None
+_pool_lock = threading.Lock()
+
 def get_storage_client():
     """取得 GCS 客戶端（單例模式）"""
     global _storage_client
     if _storage_client is None:
         try:
-            # 嘗試使用環境變數中的憑證
-            _storage_client = storage.Client()
+            if os.environ.get("STORAGE_EMULATOR_HOST"):
+                # 本機模擬伺服器不需要憑證
+                from google.auth.credentials import AnonymousCredentials
+                _storage_client = storage.Client(project=os.environ.get("GCS_PROJECT", "test"),
+                                                 credentials=AnonymousCredentials())
+            else:
+                # 嘗試使用環境變數中的憑證
+                _storage_client = storage.Client()
         except Exception as e:
             print(f"Failed to initialize GCS client: {e}")
             return None
     return _storage_client
 
+def file_sha256(path: str) -> str:
+    """計算檔案內容的 SHA-256（分段讀取，不會把大檔案整個載入記憶體）"""
+    with open(path, "rb") as f:
+        return _hash_stream(f)[0]
+
+def _hash_stream(stream: BinaryIO, copy_to: Optional[BinaryIO] = None):
+    """分段讀取串流並計算 SHA-256，回傳 (hex, 大小)；copy_to 不為 None 時同時寫入副本"""
+    digest = hashlib.sha256()
+    size = 0
+    for block in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(block)
+        size += len(block)
+        if copy_to is not None:
+            copy_to.write(block)
+    return digest.hexdigest(), size
+
+def _normalize_ext(ext: Optional[str]) -> str:
+    if not ext:
+        return ""
+    return (ext if ext.startswith(".") else f".{ext}").lower()
+
 def upload_file_to_gcs(source_file_path: str, content_type: str = None) -> str:
     """
     上傳檔案到 Google Cloud Storage
     
+    相同內容的檔案只上傳一次：依序查詢本機索引、kv_store、GCS 上是否已有同名物件，
+    都沒有才真正上傳
+    
     Args:
         source_file_path: 本地檔案路徑
         content_type: 檔案類型（例如 image/png, video/mp4）
@@ -33,6 +101,57 @@ def upload_file_to_gcs(source_file_path: str, content_type: str = None) -> str:
     Returns:
         str: 檔案的公開網址 (Public URL)，如果失敗則回傳 None
     """
+    try:
+        with open(source_file_path, "rb") as f:
+            return upload_stream(f, os.path.splitext(source_file_path)[1], content_type)
+    except OSError as e:
+        print(f"GCS upload error: {e}")
+        return None
+
+def upload_bytes(data: bytes, ext: str, content_type: str = None) -> str:
+    """上傳記憶體中的資料（例如產生的圖片），不必先寫入磁碟；回傳公開網址或 None"""
+    return upload_stream(io.BytesIO(data), ext, content_type)
+
+def upload_stream(stream: BinaryIO, ext: str, content_type: str = None) -> str:
+    """
+    上傳 file-like 串流；回傳公開網址或 None
+    可倒帶的串流直接讀兩次（先算雜湊再上傳），否則先暫存（小的在記憶體，大的寫入暫存檔）
+    """
+    try:
+        if stream.seekable():
+            start = stream.tell()
+            digest, size = _hash_stream(stream)
+            stream.seek(start)
+            return _upload(stream, size, digest, _normalize_ext(ext), content_type)
+        with tempfile.SpooledTemporaryFile(max_size=GCS_SPOOL_MAX_BYTES) as spool:
+            digest, size = _hash_stream(stream, copy_to=spool)
+            spool.seek(0)
+            return _upload(spool, size, digest, _normalize_ext(ext), content_type)
+    except Exception as e:
+        print(f"GCS upload error: {e}")
+        return None
+
+def upload_async(source: Union[str, bytes, BinaryIO], content_type: str = None, ext: str = None) -> Future:
+    """
+    在背景上傳（source 可為檔案路徑、bytes 或串流），回傳 Future，結果為公開網址或 None
+    串流在上傳完成前不可關閉
+    """
+    if isinstance(source, str):
+        return _get_upload_pool().submit(upload_file_to_gcs, source, content_type)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _get_upload_pool().submit(upload_bytes, bytes(source), ext, content_type)
+    return _get_upload_pool().submit(upload_stream, source, ext, content_type)
+
+def _get_upload_pool() -> ThreadPoolExecutor:
+    global _upload_pool
+    if _upload_pool is None:
+        with _pool_lock:
+            if _upload_pool is None:
+                _upload_pool = ThreadPoolExecutor(max_workers=GCS_UPLOAD_WORKERS, thread_name_prefix="gcs-upload")
+    return _upload_pool
+
+def _upload(stream: BinaryIO, size: int, digest: str, ext: str, content_type: Optional[str]) -> Optional[str]:
+    """上傳的共同流程：決定物件名稱、去除重複、選擇一次上傳或分段上傳"""
     bucket_name = os.environ.get("GCS_BUCKET_NAME")
     if not bucket_name:
         print("GCS_BUCKET_NAME not set in environment variables")
@@ -42,33 +161,108 @@ def upload_file_to_gcs(source_file_path: str, content_type: str = None) -> str:
     if not client:
         return None
         
-    try:
-        bucket = client.bucket(bucket_name)
-        
-        # 生成唯一的檔案名稱
+    bucket = client.bucket(bucket_name)
+    
+    if not GCS_DEDUP:
+        # 舊的命名方式
         # 格式: year/month/uuid.ext
         # 例如: 2026/01/550e8400-e29b-41d4-a716-446655440000.png
-        ext = os.path.splitext(source_file_path)[1]
         now = datetime.now()
-        destination_blob_name = f"{now.year}/{now.month:02d}/{uuid.uuid4()}{ext}"
-        
-        blob = bucket.blob(destination_blob_name)
-        
-        # 設定快取控制（例如：快取 1 小時）
+        blob = bucket.blob(f"{now.year}/{now.month:02d}/{uuid.uuid4()}{ext}", chunk_size=_chunk_size_for(size))
         blob.cache_control = "public, max-age=3600"
-        
-        # 上傳檔案
-        blob.upload_from_filename(source_file_path, content_type=content_type)
-        
-        print(f"File uploaded to GCS: gs://{bucket_name}/{destination_blob_name}")
-        
-        # 回傳公開網址
-        # 格式: https://storage.googleapis.com/bucket-name/blob-name
+        blob.upload_from_file(stream, size=size, content_type=content_type)
+        _record('uploads', size)
+        print(f"File uploaded to GCS: gs://{bucket_name}/{blob.name}")
         return blob.public_url
-        
+    
+    # 以內容命名：同一名稱的內容永遠不變
+    # 格式: cas/<sha256>.ext
+    destination_blob_name = f"cas/{digest}{ext}"
+    # 索引也記錄 content type：確認過類型正確的物件才會直接回傳
+    index_key = f"{bucket_name}/{destination_blob_name}|{content_type or ''}"
+    
+    public_url = _lookup_uploaded(index_key)
+    if public_url:
+        _record('index_hits', size)
+        return public_url
+    
+    existing = bucket.get_blob(destination_blob_name)
+    if existing is not None:
+        if content_type and existing.content_type != content_type:
+            # 之前以錯誤的類型上傳過（例如 MP3 被當成 image/png），只修正 metadata
+            print(f"Fixing content type of gs://{bucket_name}/{destination_blob_name}: "
+                  f"{existing.content_type} -> {content_type}")
+            existing.content_type = content_type
+            existing.patch()
+        _remember_uploaded(index_key, existing.public_url)
+        _record('remote_hits', size)
+        print(f"File already in GCS, skipped upload: gs://{bucket_name}/{destination_blob_name}")
+        return existing.public_url
+
+    blob = bucket.blob(destination_blob_name, chunk_size=_chunk_size_for(size))
+    
+    # 內容不會改變，可以長時間快取
+    blob.cache_control = "public, max-age=31536000, immutable"
+    
+    # 上傳檔案（if_generation_match=0：其他 Worker 剛好同時上傳時不會覆寫）
+    try:
+        blob.upload_from_file(stream, size=size, content_type=content_type, if_generation_match=0)
+        _record('uploads', size)
+        print(f"File uploaded to GCS: gs://{bucket_name}/{destination_blob_name} ({size} bytes)")
     except Exception as e:
-        print(f"GCS upload error: {e}")
+        if getattr(e, 'code', None) != 412:
+            raise
+        _record('remote_hits', size)  # 412 Precondition Failed：物件已存在
+    
+    _remember_uploaded(index_key, blob.public_url)
+    
+    # 回傳公開網址
+    # 格式: https://storage.googleapis.com/bucket-name/blob-name
+    return blob.public_url
+
+def _chunk_size_for(size: int) -> Optional[int]:
+    """大檔案使用分段的 resumable upload；小檔案一次上傳（None）"""
+    if size < GCS_RESUMABLE_THRESHOLD:
+        return None
+    return max(_CHUNK_ALIGNMENT, GCS_CHUNK_SIZE // _CHUNK_ALIGNMENT * _CHUNK_ALIGNMENT)
+
+def _lookup_uploaded(index_key: str):
+    public_url = _uploaded.get(index_key)
+    if public_url or not db:
+        return public_url
+    try:
+        public_url = db.get(KEY_PREFIX + index_key)
+    except Exception as e:
+        print(f"GCS index read error: {e}")
         return None
+    if public_url:
+        _uploaded[index_key] = public_url
+    return public_url
+
+def _remember_uploaded(index_key: str, public_url: str):
+    _uploaded[index_key] = public_url
+    if not db:
+        return
+    try:
+        db.set(KEY_PREFIX + index_key, public_url, ttl=GCS_DEDUP_INDEX_TTL)
+    except Exception as e:
+        print(f"GCS index write error: {e}")
+
+def _record(field: str, size: int):
+    with _stats_lock:
+        _stats[field] += 1
+        if field == 'uploads':
+            _stats['bytes_uploaded'] += size
+        else:
+            _stats['bytes_saved'] += size
+
+def upload_stats() -> dict:
+    """上傳與去除重複的統計（監控用）"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['dedup'] = GCS_DEDUP
+    stats['indexed'] = len(_uploaded)
+    return stats
 
 def upload_image_to_gcs(image_path: str) -> str:
     """上傳圖片到 GCS"""
@@ -0,0 +1,154 @@
+"""
+字形圖塊模組 - 長輩圖逐字繪製
+- 未旋轉的字直接以 draw.text 畫到文字圖層，不建立遮罩與圖塊：每張圖的字體大小（自動縮放 ±2px）與
+  AI 選的顏色幾乎都不同，快取大多不會命中，直接繪製最省時間
+- 旋轉的字才需要小圖塊：灰階遮罩（含描邊，FreeType 最花時間的部分）只光柵化一次並快取，
+  上色後的圖塊同樣快取，旋轉只處理小圖塊，不必旋轉整張單字畫布
+- 遮罩與顏色無關，換顏色（彩虹字）仍可重複使用
+- 快取項目持有字體物件，字體的 id 不會被其他物件重用
+"""
+import os
+import math
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+from PIL import Image, ImageColor, ImageDraw
+
+from bounded_cache import BoundedCache
+
+GLYPH_CACHE_MAX_ITEMS = int(os.environ.get("GLYPH_CACHE_MAX_ITEMS", "2048"))
+GLYPH_CACHE_MAX_BYTES = int(os.environ.get("GLYPH_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))  # 遮罩與圖塊各自的上限
+
+# 一個繪製步驟：(x 偏移, y 偏移, 填色, 描邊寬度, 描邊顏色)，依序疊加
+GlyphPass = Tuple[int, int, str, int, Optional[str]]
+
+
+def _image_sizeof(value) -> int:
+    _, image, _ = value
+    return image.width * image.height * len(image.getbands()) + 200
+
+
+class GlyphAtlas:
+    """字形圖塊快取與繪製（執行緒安全）"""
+
+    def __init__(self, max_items: int = GLYPH_CACHE_MAX_ITEMS, max_bytes: int = GLYPH_CACHE_MAX_BYTES):
+        # {(字體 id, 字, 描邊寬度): (字體, 遮罩, 遮罩左上角相對於文字原點的偏移)}
+        self._masks = BoundedCache(max_items=max_items, max_bytes=max_bytes, sizeof=_image_sizeof, name="glyph_masks")
+        # {(字體 id, 字, 繪製步驟): (字體, 上色後的圖塊, 偏移)}
+        self._tiles = BoundedCache(max_items=max_items, max_bytes=max_bytes, sizeof=_image_sizeof, name="glyph_tiles")
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'tile_hits': 0, 'tile_misses': 0, 'drawn': 0, 'direct': 0, 'rotated': 0}
+
+    def mask(self, char: str, font, stroke_width: int = 0) -> Tuple[Image.Image, Tuple[int, int]]:
+        """
+        取得字的灰階遮罩（含描邊時為描邊外框以內的整個範圍）與其相對於文字原點的偏移
+        遮罩為共用物件，呼叫端不可修改
+        """
+        key = (id(font), char, stroke_width)
+        cached = self._masks.get(key)
+        if cached is not None:
+            self._count('hits')
+            return cached[1], cached[2]
+
+        mask = Image.new('L', (1, 1), 0)
+        left, top, right, bottom = ImageDraw.Draw(mask).textbbox((0, 0), char, font=font, stroke_width=stroke_width)
+        left, top = int(math.floor(left)), int(math.floor(top))
+        mask = Image.new('L', (max(1, int(math.ceil(right)) - left), max(1, int(math.ceil(bottom)) - top)), 0)
+        draw = ImageDraw.Draw(mask)
+        if stroke_width:
+            draw.text((-left, -top), char, font=font, fill=255, stroke_width=stroke_width, stroke_fill=255)
+        else:
+            draw.text((-left, -top), char, font=font, fill=255)
+
+        self._masks[key] = (font, mask, (left, top))
+        self._count('misses')
+        return mask, (left, top)
+
+    def glyph(self, char: str, font, passes: Sequence[GlyphPass]) -> Tuple[Image.Image, Tuple[int, int]]:
+        """
+        依繪製步驟上色，回傳字形圖塊與其相對於文字原點（draw.text 的座標）的左上角偏移
+        與 draw.text 相同：有描邊時先以描邊顏色畫外框，再以填色畫字
+        圖塊為共用物件，呼叫端不可修改
+        """
+        key = (id(font), char, tuple(passes))
+        cached = self._tiles.get(key)
+        if cached is not None:
+            self._count('tile_hits')
+            return cached[1], cached[2]
+
+        layers = []  # (顏色, 遮罩, x, y)
+        for dx, dy, fill, stroke, stroke_fill in passes:
+            if stroke:
+                mask, (x, y) = self.mask(char, font, stroke)
+                layers.append((stroke_fill, mask, dx + x, dy + y))
+            mask, (x, y) = self.mask(char, font)
+            layers.append((fill, mask, dx + x, dy + y))
+
+        left = min(x for _, _, x, _ in layers)
+        top = min(y for _, _, _, y in layers)
+        right = max(x + mask.width for _, mask, x, _ in layers)
+        bottom = max(y + mask.height for _, mask, _, y in layers)
+        tile = Image.new('RGBA', (right - left, bottom - top), (255, 255, 255, 0))
+        for color, mask, x, y in layers:
+            tile.paste(ImageColor.getcolor(color, 'RGBA'), (x - left, y - top), mask)
+
+        self._tiles[key] = (font, tile, (left, top))
+        self._count('tile_misses')
+        return tile, (left, top)
+
+    def draw(self, layer: Image.Image, xy: Tuple[float, float], char: str, font, passes: Sequence[GlyphPass],
+             angle: float = 0.0, pivot: Optional[Tuple[float, float]] = None):
+        """
+        把一個字畫到 layer 上，xy 為文字原點（與 draw.text 相同）
+        angle 為逆時針角度，繞 pivot（layer 座標，預設為圖塊中心）旋轉；未旋轉時直接繪製，不經過快取
+        """
+        x, y = int(round(xy[0])), int(round(xy[1]))
+        if abs(angle) <= 0.5:
+            draw = ImageDraw.Draw(layer)
+            for dx, dy, fill, stroke, stroke_fill in passes:
+                if stroke:
+                    draw.text((x + dx, y + dy), char, font=font, fill=fill, stroke_width=stroke, stroke_fill=stroke_fill)
+                else:
+                    draw.text((x + dx, y + dy), char, font=font, fill=fill)
+            self._count('direct')
+            self._count('drawn')
+            return
+
+        tile, (off_x, off_y) = self.glyph(char, font, passes)
+        x += off_x
+        y += off_y
+        center_x = x + tile.width / 2
+        center_y = y + tile.height / 2
+        if pivot is not None:
+            # 圖塊中心繞 pivot 旋轉後的位置（影像座標 y 軸向下）
+            rad = math.radians(angle)
+            dx, dy = center_x - pivot[0], center_y - pivot[1]
+            center_x = pivot[0] + dx * math.cos(rad) + dy * math.sin(rad)
+            center_y = pivot[1] - dx * math.sin(rad) + dy * math.cos(rad)
+        tile = tile.rotate(angle, expand=True, resample=Image.Resampling.BICUBIC)
+        x = int(round(center_x - tile.width / 2))
+        y = int(round(center_y - tile.height / 2))
+        self._count('rotated')
+
+        layer.paste(tile, (x, y), tile)
+        self._count('drawn')
+
+    def stats(self) -> Dict:
+        """命中率與快取大小（監控用）"""
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 3) if total else 0.0
+        tiles = stats['tile_hits'] + stats['tile_misses']
+        stats['tile_hit_rate'] = round(stats['tile_hits'] / tiles, 3) if tiles else 0.0
+        stats['cached_masks'] = len(self._masks)
+        stats['cached_tiles'] = len(self._tiles)
+        return stats
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+
+# 全域字形快取
+glyph_atlas = GlyphAtlas()
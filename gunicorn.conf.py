@@ -7,9 +7,13 @@ timeout = 120  # 從預設 30 秒增加到 120 秒
 # 優雅關閉超時
 graceful_timeout = 30
 
-# Worker 數量（使用環境變數或預設 2）
+# Worker 數量（使用環境變數 GUNICORN_WORKERS，預設 1）
 import os
-workers = 1  # [Fix] 強制單一 Worker 以確保記憶體變數 (State) 不會因為負載平衡而丟失
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+if os.environ.get("STATE_BACKEND", "memory").lower() == "memory" and workers > 1:
+    # 記憶體狀態無法跨 Worker 共用，需設定 STATE_BACKEND=db 或 redis 才能開多個 Worker
+    print("[GUNICORN] STATE_BACKEND=memory only supports a single worker, forcing workers = 1")
+    workers = 1
 
 # 綁定地址
 bind = "0.0.0.0:" + os.environ.get("PORT", "8080")
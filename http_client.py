@@ -0,0 +1,180 @@
+"""
+HTTP 用戶端模組 - 專案內所有對外 HTTP 請求的共用入口
+- 每個主機各自一個 Session（keep-alive 連線池），避免每次請求都重新建立 TLS 連線；
+  用戶貼上的網址可能來自任意主機，Session 數量有上限（LRU），閒置或被淘汰時關閉連線
+- Session 不保存 cookie，避免不同用戶的請求共用同一個主機的 cookie
+- 預設連線 / 讀取逾時
+- 429 / 5xx 與連線錯誤自動重試（指數退避 + 隨機抖動，遵守 Retry-After）
+- 依主機統計請求數、錯誤數與延遲
+"""
+import os
+import time
+import random
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bounded_cache import BoundedCache
+from latency_stats import LatencyStats
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))  # 失敗後最多重試次數
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.5"))  # 秒
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", "8"))  # 單次等待上限（秒）
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))  # 每個主機的連線池大小
+HTTP_MAX_HOSTS = int(os.environ.get("HTTP_MAX_HOSTS", "32"))  # 最多保留幾個主機的 Session 與統計
+HTTP_SESSION_IDLE_TTL = int(os.environ.get("HTTP_SESSION_IDLE_TTL", "600"))  # Session 閒置多久後關閉（秒）
+
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class _HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.status: Dict[str, int] = {}
+        self.latency = LatencyStats()
+
+    def snapshot(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'status': dict(self.status),
+            'latency': self.latency.snapshot(),
+        }
+
+
+class HttpClient:
+    """
+    共用 HTTP 用戶端（執行緒安全）
+
+    - request() 的參數與 requests.request() 相同，另可指定 retries
+    - 預設只重試冪等的方法（GET 等）；POST 上傳檔案時串流無法重送，需明確指定 retries 才會重試
+    - 重試後仍失敗時：HTTP 錯誤回傳最後一次的 Response，連線錯誤則拋出例外（與 requests 相同）
+    """
+
+    def __init__(self, connect_timeout: float = HTTP_CONNECT_TIMEOUT, read_timeout: float = HTTP_READ_TIMEOUT,
+                 max_retries: int = HTTP_MAX_RETRIES, backoff_base: float = HTTP_BACKOFF_BASE,
+                 backoff_max: float = HTTP_BACKOFF_MAX, pool_size: int = HTTP_POOL_SIZE,
+                 max_hosts: int = HTTP_MAX_HOSTS, session_ttl: float = HTTP_SESSION_IDLE_TTL):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self._sessions = BoundedCache(max_items=max_hosts, ttl=session_ttl, on_evict=self._close_session,
+                                      name="http_sessions")
+        self._stats = BoundedCache(max_items=max_hosts, name="http_stats")
+        self._lock = threading.Lock()
+
+    # ---- 請求 ----
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None,
+                retries: Optional[int] = None, **kwargs) -> requests.Response:
+        method = method.upper()
+        host = urlsplit(url).netloc.lower()
+        session = self.session_for(host)
+        if retries is None:
+            retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        timeout = self.timeout if timeout is None else timeout
+
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(host, started, None)
+                if attempt >= retries:
+                    raise
+                delay = self._backoff(attempt)
+                print(f"[HTTP] {method} {host} failed ({type(e).__name__}), retry {attempt + 1}/{retries} in {delay:.1f}s")
+            else:
+                self._record(host, started, response.status_code)
+                if response.status_code not in RETRY_STATUS or attempt >= retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                print(f"[HTTP] {method} {host} returned {response.status_code}, retry {attempt + 1}/{retries} in {delay:.1f}s")
+                response.close()
+
+            attempt += 1
+            with self._lock:
+                self._stats.setdefault(host, _HostStats()).retries += 1
+            time.sleep(delay)
+
+    def session_for(self, host: str) -> requests.Session:
+        """取得（或建立）某個主機專用的 Session"""
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))  # 不保存任何 cookie
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+                self._stats.setdefault(host, _HostStats())
+        return session
+
+    # ---- 其他 ----
+
+    def stats(self) -> Dict:
+        """各主機的請求統計（監控用，只保留最近用到的 max_hosts 個主機）"""
+        with self._lock:
+            hosts = {host: stats.snapshot() for host, stats in list(self._stats.items())}
+        return {'hosts': hosts, 'sessions': self._sessions.stats()}
+
+    def close(self):
+        self._sessions.evict_all()
+
+    @staticmethod
+    def _close_session(host: str, session: requests.Session, reason: str):
+        # 正在使用中的連線會在請求結束、歸還連線池時關閉
+        session.close()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """指數退避加上隨機抖動（full jitter）；伺服器有指定 Retry-After 秒數時以其為準（不超過上限）"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass  # HTTP 日期格式，改用預設退避
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, host: str, started: float, status: Optional[int]):
+        elapsed = time.monotonic() - started
+        with self._lock:
+            stats = self._stats.setdefault(host, _HostStats())
+            stats.requests += 1
+            stats.latency.add(elapsed)
+            if status is None:
+                stats.errors += 1
+                key = "error"
+            else:
+                key = f"{status // 100}xx"
+                if status >= 500 or status == 429:
+                    stats.errors += 1
+            stats.status[key] = stats.status.get(key, 0) + 1
+
+
+# 全域 HTTP 用戶端
+http_client = HttpClient()
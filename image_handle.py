@@ -0,0 +1,201 @@
+"""
+圖片處理模組 - 在處理流程中傳遞圖片，不必反覆寫入 / 讀取 /tmp/uploads
+- ImageHandle 同時持有原始 bytes、解碼後的 PIL 影像與磁碟路徑，各自只在第一次需要時產生（解碼一次、編碼一次）
+- 只有需要跨訊息保存（用戶狀態只能存路徑、可能由其他 worker 讀取）時才寫入磁碟
+- image_store 依路徑記住本行程的 ImageHandle，同一個 worker 之後的步驟不必重新讀檔與解碼
+"""
+import io
+import os
+import threading
+from typing import Dict, Optional
+
+from PIL import Image
+
+from bounded_cache import BoundedCache
+
+IMAGE_STORE_MAX_BYTES = int(os.environ.get("IMAGE_STORE_MAX_BYTES", str(128 * 1024 * 1024)))
+IMAGE_STORE_TTL = int(os.environ.get("IMAGE_STORE_TTL", "1800"))  # 長輩圖流程等待用戶輸入的時間
+
+_FORMATS = {  # PIL 格式: (副檔名, Content-Type)
+    'PNG': ('.png', 'image/png'),
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'GIF': ('.gif', 'image/gif'),
+    'WEBP': ('.webp', 'image/webp'),
+}
+
+# 全行程的 I/O 統計（監控用）
+_io_stats = {'decodes': 0, 'encodes': 0, 'bytes_read': 0, 'bytes_written': 0}
+_io_lock = threading.Lock()
+
+
+def _record(field: str, amount: int = 1):
+    with _io_lock:
+        _io_stats[field] += amount
+
+
+def _sniff_format(data: bytes) -> Optional[str]:
+    """由檔頭判斷格式（不必解碼）"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'PNG'
+    if data[:3] == b'\xff\xd8\xff':
+        return 'JPEG'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+class ImageHandle:
+    """
+    處理流程中的一張圖片（執行緒安全）
+    image() 回傳的 PIL 影像為共用物件，要修改時請先 copy()
+    """
+
+    def __init__(self, data: Optional[bytes] = None, image: Optional[Image.Image] = None,
+                 path: Optional[str] = None, format: Optional[str] = None):
+        self._data = bytes(data) if data is not None else None
+        self._image = image
+        self.path = path
+        self.format = format or (_sniff_format(self._data) if self._data else None)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, format: Optional[str] = None) -> 'ImageHandle':
+        return cls(data=data, format=format)
+
+    @classmethod
+    def from_path(cls, path: str) -> 'ImageHandle':
+        return cls(path=path)
+
+    @classmethod
+    def from_image(cls, image: Image.Image, format: str = 'PNG') -> 'ImageHandle':
+        """由處理完成的影像建立；bytes 在第一次需要時才以 format 編碼"""
+        return cls(image=image, format=format)
+
+    @property
+    def data(self) -> bytes:
+        """圖片檔的 bytes（必要時讀檔或編碼一次）"""
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    if self.path and os.path.exists(self.path):
+                        with open(self.path, 'rb') as f:
+                            self._data = f.read()
+                        _record('bytes_read', len(self._data))
+                        self.format = self.format or _sniff_format(self._data)
+                    elif self._image is None:
+                        raise FileNotFoundError(self.path)
+                    else:
+                        buffer = io.BytesIO()
+                        self._image.save(buffer, format=self.format or 'PNG')
+                        self._data = buffer.getvalue()
+                        self.format = self.format or 'PNG'
+                        _record('encodes')
+        return self._data
+
+    @property
+    def has_data(self) -> bool:
+        """bytes 已在記憶體或磁碟上（讀取 data 不必編碼）"""
+        return self._data is not None or bool(self.path and os.path.exists(self.path))
+
+    def image(self) -> Image.Image:
+        """解碼後的影像（只解碼一次）"""
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    if self._data is None and self.path:
+                        image = Image.open(self.path)
+                        _record('bytes_read', os.path.getsize(self.path))
+                    else:
+                        image = Image.open(io.BytesIO(self.data))
+                    image.load()
+                    self.format = self.format or image.format
+                    self._image = image
+                    _record('decodes')
+        return self._image
+
+    def save(self, path: str) -> str:
+        """確保圖片在磁碟上（已在其他路徑時仍寫入指定路徑），回傳路徑"""
+        data = self.data
+        with self._lock:
+            if self.path == path and os.path.exists(path):
+                return path
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.path = path
+        _record('bytes_written', len(data))
+        return path
+
+    def spill(self, directory: str, name: str) -> str:
+        """需要跨訊息保存時才寫入磁碟；已有檔案時直接回傳原路徑"""
+        if self.path and os.path.exists(self.path):
+            return self.path
+        return self.save(os.path.join(directory, name))
+
+    @property
+    def ext(self) -> str:
+        return _FORMATS.get(self.format, ('.png', 'image/png'))[0]
+
+    @property
+    def content_type(self) -> str:
+        return _FORMATS.get(self.format, ('.png', 'image/png'))[1]
+
+    def nbytes(self) -> int:
+        """估計佔用的記憶體（bytes + 解碼後的像素）"""
+        size = len(self._data) if self._data is not None else 0
+        if self._image is not None:
+            size += self._image.width * self._image.height * len(self._image.getbands())
+        return size
+
+    def __repr__(self) -> str:
+        return f"ImageHandle(format={self.format}, path={self.path}, bytes={len(self._data) if self._data else None})"
+
+
+class ImageStore:
+    """依路徑記住本行程的 ImageHandle（有容量與存活時間上限）"""
+
+    def __init__(self, max_bytes: int = IMAGE_STORE_MAX_BYTES, ttl: float = IMAGE_STORE_TTL):
+        self._handles = BoundedCache(max_bytes=max_bytes, ttl=ttl, sizeof=lambda handle: handle.nbytes() + 500,
+                                     name="image_store")
+        self._stats = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    def put(self, handle: ImageHandle) -> ImageHandle:
+        """登記已寫入磁碟的圖片（沒有路徑的圖片不登記）"""
+        if handle.path:
+            self._handles[handle.path] = handle
+        return handle
+
+    def get(self, path: str, decode: bool = False) -> ImageHandle:
+        """
+        取得路徑對應的圖片；其他 worker 寫入的檔案會在第一次使用時讀取
+        decode=True 時先解碼（並更新快取大小）
+        """
+        handle = self._handles.get(path)
+        with self._lock:
+            self._stats['hits' if handle is not None else 'misses'] += 1
+        if handle is None:
+            handle = self.put(ImageHandle.from_path(path))
+        if decode:
+            handle.image()
+            self._handles.resize(path)
+        return handle
+
+    def stats(self) -> Dict:
+        """命中率與 I/O 統計（監控用）"""
+        with self._lock:
+            stats = dict(self._stats)
+        with _io_lock:
+            stats.update(_io_stats)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 3) if total else 0.0
+        stats['cached_images'] = len(self._handles)
+        return stats
+
+
+# 全域圖片暫存
+image_store = ImageStore()
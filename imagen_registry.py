@@ -0,0 +1,149 @@
+"""
+Imagen 模型管理模組 - 行程內共用的 Vertex AI 初始化與圖片生成模型
+- aiplatform.init() 與 ImageGenerationModel.from_pretrained() 每個行程只執行一次，不必每次生圖都重新載入
+- 預設模型依 IMAGEN_MODELS 的順序嘗試，第一個可用的結果會被記住
+- 啟動時可在背景預先載入（warm_up），第一位用戶不必等待
+- 分別統計初始化、載入、取得（已載入時）、生成與儲存各階段的耗時，各階段互不重疊
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from latency_stats import LatencyStats
+
+IMAGEN_LOCATION = os.environ.get("IMAGEN_LOCATION", "us-central1")
+# 依序嘗試的模型（Imagen 2 已停止服務）
+IMAGEN_MODELS = [name.strip() for name in os.environ.get(
+    "IMAGEN_MODELS", "imagen-3.0-generate-001,imagen-3.0-capability-001").split(",") if name.strip()]
+IMAGEN_WARMUP = os.environ.get("IMAGEN_WARMUP", "true").lower() == "true"
+
+
+class ImagenRegistry:
+    """Vertex AI 圖片生成模型的共用入口（執行緒安全）"""
+
+    def __init__(self, models: List[str] = IMAGEN_MODELS, location: str = IMAGEN_LOCATION):
+        self.models = models
+        self.location = location
+        self._initialized = False
+        self._handles: Dict[str, object] = {}  # {模型名稱: 模型}
+        self._default: Optional[str] = None  # 解析後的預設模型名稱
+        self._lock = threading.RLock()
+        self._phases: Dict[str, LatencyStats] = {}
+        self._stats_lock = threading.Lock()
+        self._errors = 0
+
+    def ensure_init(self, into: Optional[Dict[str, float]] = None):
+        """初始化 Vertex AI（每個行程只執行一次）"""
+        if self._initialized:
+            return
+        with self._lock:
+            if self._initialized:
+                return
+            from google.cloud import aiplatform
+            with self.timed('init', into=into):
+                aiplatform.init(project=os.environ.get("GOOGLE_CLOUD_PROJECT"), location=self.location)
+            self._initialized = True
+
+    def get(self, model_name: str, into: Optional[Dict[str, float]] = None):
+        """取得指定名稱的模型（第一次使用時載入）"""
+        handle = self._handles.get(model_name)
+        if handle is not None:
+            return handle
+        self.ensure_init(into=into)
+        with self._lock:
+            handle = self._handles.get(model_name)
+            if handle is None:
+                from vertexai.preview.vision_models import ImageGenerationModel
+                with self.timed('load', into=into):
+                    handle = ImageGenerationModel.from_pretrained(model_name)
+                self._handles[model_name] = handle
+                print(f"[IMAGEN] Loaded model {model_name}")
+            return handle
+
+    def generation_model(self, into: Optional[Dict[str, float]] = None):
+        """
+        預設的生成模型：依序嘗試 IMAGEN_MODELS，第一個成功的結果會被記住
+        已載入時記錄為 acquire；需要初始化或載入時只記錄 init / load，避免重複計算
+        """
+        started = time.monotonic()
+        handle = self._handles.get(self._default) if self._default else None
+        if handle is not None:
+            self._record('acquire', time.monotonic() - started, into)
+            return handle
+        with self._lock:
+            if self._default:
+                return self.get(self._default, into=into)
+            last_error = None
+            for name in self.models:
+                try:
+                    handle = self.get(name, into=into)
+                except Exception as e:
+                    print(f"[IMAGEN] Failed to load {name}: {e}. Trying next model...")
+                    last_error = e
+                    continue
+                self._default = name
+                return handle
+            self._count_error()
+            raise last_error or RuntimeError("No Imagen model configured")
+
+    def invalidate(self, model_name: Optional[str] = None):
+        """模型失效（例如下架）時移除快取；None 表示重新解析預設模型"""
+        with self._lock:
+            if model_name:
+                self._handles.pop(model_name, None)
+                if self._default == model_name:
+                    self._default = None
+            else:
+                self._default = None
+
+    def warm_up(self):
+        """在背景初始化並載入預設模型"""
+        if not IMAGEN_WARMUP:
+            return
+
+        def run():
+            try:
+                started = time.monotonic()
+                self.generation_model()
+                print(f"[IMAGEN] Warm-up done in {(time.monotonic() - started) * 1000:.0f} ms ({self._default})")
+            except Exception as e:
+                print(f"[IMAGEN] Warm-up failed: {e}")
+
+        threading.Thread(target=run, name="imagen-warmup", daemon=True).start()
+
+    @contextmanager
+    def timed(self, phase: str, into: Optional[Dict[str, float]] = None):
+        """統計某個階段的耗時；into 不為 None 時另外記錄到該 dict（單次請求的明細）"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record(phase, time.monotonic() - started, into)
+
+    def stats(self) -> Dict:
+        """各階段耗時與已載入的模型（監控用）"""
+        with self._stats_lock:
+            phases = {phase: stats.snapshot() for phase, stats in self._phases.items()}
+        return {
+            'initialized': self._initialized,
+            'default_model': self._default,
+            'loaded_models': list(self._handles.keys()),
+            'load_errors': self._errors,
+            'phases': phases,
+        }
+
+    def _record(self, phase: str, elapsed: float, into: Optional[Dict[str, float]] = None):
+        with self._stats_lock:
+            self._phases.setdefault(phase, LatencyStats()).add(elapsed)
+        if into is not None:
+            into[phase] = into.get(phase, 0.0) + elapsed
+
+    def _count_error(self):
+        with self._stats_lock:
+            self._errors += 1
+
+
+# 全域模型管理
+imagen_registry = ImagenRegistry()
@@ -0,0 +1,314 @@
+"""
+意圖判斷模組 - 本地規則優先，必要時才呼叫 LLM
+1. 固定關鍵字規則（與原本 classify_user_intent 相同，信心 100%）
+2. 加權關鍵字 / n-gram 評分：分數與領先幅度都達門檻才採用
+3. 仍無法判斷的訊息交給 LLM，結果以正規化後的文字快取
+"""
+import os
+import re
+import time
+import threading
+import unicodedata
+from typing import Callable, Dict, Optional
+
+from bounded_cache import BoundedCache
+
+INTENT_MIN_SCORE = float(os.environ.get("INTENT_MIN_SCORE", "1.0"))  # 最高分至少要有的分數
+INTENT_MIN_MARGIN = float(os.environ.get("INTENT_MIN_MARGIN", "0.5"))  # 最高分需領先第二名的分數
+INTENT_CACHE_SIZE = int(os.environ.get("INTENT_CACHE_SIZE", "5000"))
+INTENT_CACHE_TTL = int(os.environ.get("INTENT_CACHE_TTL", str(24 * 60 * 60)))
+
+INTENTS = [
+    'video_generation', 'image_generation', 'image_modification', 'meme_creation',
+    'trip_planning', 'set_reminder', 'show_reminders', 'cancel_reminder', 'chat',
+]
+
+# 各意圖的加權特徵
+# 中文特徵以子字串比對，英文特徵以完整單字比對；單一字的特徵不計入 SINGLE_CHAR_COMPOUNDS 中的詞
+# （不依賴斷詞：jieba 預設的簡體詞典對繁體文字常切錯，例如「幫我畫」→「幫 / 我畫」、「長輩圖」→「張長 / 輩圖」）
+INTENT_FEATURES: Dict[str, Dict[str, float]] = {
+    'trip_planning': {
+        '行程': 1.0, '旅遊': 1.0, '旅行': 1.0, '景點': 1.0, '出遊': 1.0, '自由行': 1.2,
+        '一日遊': 1.2, '二日遊': 1.2, '兩天一夜': 1.2, '三天兩夜': 1.2, '天一夜': 0.8, '天兩夜': 0.8,
+        '哪裡玩': 1.0, '踏青': 0.9, '住宿': 0.6, '民宿': 0.6, '規劃': 0.5,
+        'trip': 1.0, 'travel': 1.0,
+    },
+    'image_generation': {
+        '畫': 0.8, '幫我畫': 1.2, '畫一': 1.2, '畫個': 1.2, '圖片': 0.4, '一張': 0.4, '生成': 0.6,
+        '產生': 0.4, '繪': 0.6, '插畫': 1.0, '圖': 0.2, '來一張': 0.8, 'draw': 1.2, 'image': 0.4,
+    },
+    'image_modification': {
+        '改成': 0.9, '換成': 0.9, '修改': 0.8, '修圖': 1.2, '換背景': 1.2, '背景': 0.4, '去背': 1.2,
+        '變成': 0.6, '調亮': 1.0, '調暗': 1.0, '去掉': 0.7, '移除': 0.7, '拿掉': 0.7, '換掉': 0.8,
+        '加一': 0.4, '這張': 0.4, '融合': 1.0, '合成': 0.9, '照片': 0.3, '顏色': 0.3, '改': 0.3,
+    },
+    'meme_creation': {
+        '早安圖': 1.5, '午安圖': 1.5, '晚安圖': 1.5, '問候圖': 1.5, '賀圖': 1.2, '祝福圖': 1.2,
+        '長輩': 0.6, '梗': 0.8,
+    },
+    'set_reminder': {
+        '鬧鐘': 1.0, '通知我': 1.0, '別忘了': 0.8, '記得叫': 1.0, '記得': 0.4, '吃藥': 0.6, '點叫': 0.8,
+        '回診': 0.5, '預約': 0.4,
+    },
+    'show_reminders': {
+        '行事曆': 0.9, '有什麼事': 0.6, '要做什麼': 0.6,
+    },
+    'video_generation': {
+        '影片': 0.8, '短片': 0.8, '動畫': 0.8, '生成影片': 1.5, '做影片': 1.5, '製作影片': 1.5, 'video': 1.0,
+    },
+    'chat': {
+        '早安': 1.0, '午安': 1.0, '晚安': 1.0, '你好': 1.0, '您好': 1.0, '哈囉': 1.0, '嗨': 1.0,
+        'hi': 1.0, 'hello': 1.0, '謝謝': 1.0, '感謝': 1.0, '哈哈': 1.0, '呵呵': 1.0, '加油': 0.8,
+        '嗎': 0.4, '呢': 0.3, '什麼': 0.4, '是什麼': 0.6, '為什麼': 0.8, '怎麼': 0.4, '如何': 0.4,
+        '是不是': 0.4, '可不可以': 0.2, '心情': 0.6, '難過': 0.8, '傷心': 0.8, '開心': 0.6, '無聊': 0.8,
+        '累': 0.4, '天氣': 0.6, '身體': 0.4, '健康': 0.5, '血壓': 0.6, '醫生': 0.4, '孫子': 0.4,
+        '吃飯': 0.4, '你是誰': 1.2, '聊天': 0.8, '故事': 0.6, '笑話': 0.8, '意思': 0.5, '請問': 0.4,
+        '告訴我': 0.4, '介紹': 0.4, '知道': 0.3, '想你': 0.8, '愛你': 0.8, '睡不著': 0.8,
+    },
+}
+
+# 只在同一意圖的 INTENT_FEATURES 也有命中時才計分的特徵
+# 地名與「想去 / 好玩」在一般聊天也很常見（「我孫子明天要去台中」、「你覺得日本好玩嗎」），
+# 沒有「行程 / 旅遊 / 規劃 / 景點」等明確的旅遊詞時不計分，交給 LLM 判斷
+CONTEXT_FEATURES: Dict[str, Dict[str, float]] = {
+    'trip_planning': {
+        '去玩': 1.2, '想去': 0.8, '帶我去': 1.0, '要去': 0.5, '去哪': 0.7, '好玩': 0.6, '走走': 0.6,
+        '逛逛': 0.5, '玩': 0.4, '遊': 0.3,
+        '宜蘭': 0.5, '花蓮': 0.5, '台東': 0.5, '臺東': 0.5, '墾丁': 0.5, '綠島': 0.5, '蘭嶼': 0.5,
+        '日月潭': 0.5, '阿里山': 0.5, '九份': 0.5, '淡水': 0.5, '台南': 0.5, '臺南': 0.5, '高雄': 0.5,
+        '台中': 0.5, '臺中': 0.5, '澎湖': 0.5, '金門': 0.5, '馬祖': 0.5, '清境': 0.5, '合歡山': 0.5,
+        '日本': 0.4, '東京': 0.5, '大阪': 0.5, '京都': 0.5, '沖繩': 0.5, '韓國': 0.4, '首爾': 0.5,
+    },
+}
+
+# 單一字特徵不算命中的詞，避免「計畫」中的「畫」被當成畫圖
+SINGLE_CHAR_COMPOUNDS: Dict[str, tuple] = {
+    '畫': ('計畫', '規畫', '企畫'),
+    '圖': ('地圖', '圖書', '企圖', '意圖'),
+    '改': ('改天', '改善', '改變', '改期'),
+    '玩': ('玩笑',),
+    '遊': ('遊戲',),
+    '累': ('累積',),
+}
+
+# 清除記憶判斷
+CLEAR_MEMORY_PHRASES = ["重新開始", "清除記憶", "忘記我", "重置對話", "新的開始", "清空記憶", "reset", "重來", "忘掉", "清空"]
+CLEAR_MEMORY_GATE = ["重新", "清除", "忘記", "重置", "清空", "reset", "記憶", "對話", "開始"]
+CLEAR_MEMORY_ACTIONS = ["清除", "清掉", "刪除", "刪掉", "忘記", "重置", "清空", "洗掉", "重新"]
+CLEAR_MEMORY_OBJECTS = ["記憶", "對話", "聊天", "紀錄", "記錄", "剛剛", "剛才", "之前", "前面", "說過"]
+CLEAR_MEMORY_NEGATIONS = ["不要忘記", "別忘記", "不要忘了", "別忘了", "不要清除", "不要刪除", "記得"]
+
+# 提問時通常是詢問圖片內容（例如「他穿什麼顏色」），屬於聊天而不是修改圖片
+QUESTION_MARKERS = ["嗎", "什麼", "哪", "為什麼", "怎麼", "多少", "?"]
+
+_PUNCTUATION = re.compile(r"[\s\u3000-\u303f\uff00-\uff0f\uff1a-\uff20\uff3b-\uff40\uff5b-\uff65!-/:-@\[-`{-~]+")
+
+
+def normalize_text(text: str) -> str:
+    """正規化文字（全半形、大小寫、標點與空白），作為快取的 key"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return _PUNCTUATION.sub('', text)
+
+
+def single_char_hit(char: str, norm: str) -> bool:
+    """單一字特徵是否出現在 norm 中（排除 SINGLE_CHAR_COMPOUNDS 的詞）"""
+    for compound in SINGLE_CHAR_COMPOUNDS.get(char, ()):
+        norm = norm.replace(compound, ' ')
+    return char in norm
+
+
+def rule_based_intent(text: str) -> Optional[str]:
+    """固定關鍵字規則（依優先順序）"""
+    # 1. 優先判斷取消/刪除提醒 (因為包含「提醒」二字，必須先於設定提醒判斷)
+    if any(kw in text for kw in ["取消提醒", "刪除提醒", "不要提醒", "cancel reminder", "delete reminder"]):
+        return "cancel_reminder"
+
+    # 查看提醒同樣包含「提醒」，需先於設定提醒判斷
+    if any(kw in text for kw in ["我的提醒", "查看提醒", "待辦", "提醒列表", "my reminders"]):
+        return "show_reminders"
+    if any(kw in text for kw in ["提醒我", "設提醒", "叫我", "提醒", "remind me"]):
+        return "set_reminder"
+
+    # 2. 優先判斷長輩圖/梗圖製作 (包含「加文字」指令)
+    if any(kw in text for kw in ["長輩圖", "梗圖", "加文字", "加上文字", "迷因", "meme"]):
+        return "meme_creation"
+
+    # 3. 判斷一般圖片生成 (避免 AI 誤判為 chat)
+    # 「生成一段影片」之類交給評分判斷，不當成圖片
+    if any(kw in text for kw in ["影片", "短片", "動畫", "video"]):
+        return None
+    # 用戶說 "畫一隻...", "生成一張...", "給我一張...圖片"
+    if any(kw in text for kw in ["畫一", "生成一", "產生一", "製作一", "create a image", "generate a image"]):
+        return "image_generation"
+    if "圖片" in text and any(kw in text for kw in ["給我", "想要", "來一張", "一張", "生"]):
+        return "image_generation"
+    return None
+
+
+class IntentResult:
+    """意圖判斷結果"""
+
+    __slots__ = ('intent', 'confidence', 'source', 'scores')
+
+    def __init__(self, intent: Optional[str], confidence: float, source: str, scores: Optional[Dict] = None):
+        self.intent = intent          # None 代表本地無法判斷
+        self.confidence = confidence  # 0 ~ 1
+        self.source = source          # 'rule' / 'score' / 'cache' / 'llm' / 'undecided'
+        self.scores = scores or {}
+
+    def __repr__(self):
+        return f"IntentResult({self.intent!r}, confidence={self.confidence:.2f}, source={self.source!r})"
+
+
+class IntentEngine:
+    """本地意圖判斷引擎（附 LLM 結果快取）"""
+
+    def __init__(self, features: Dict[str, Dict[str, float]] = INTENT_FEATURES,
+                 context_features: Dict[str, Dict[str, float]] = CONTEXT_FEATURES,
+                 min_score: float = INTENT_MIN_SCORE, min_margin: float = INTENT_MIN_MARGIN,
+                 cache_size: int = INTENT_CACHE_SIZE, cache_ttl: int = INTENT_CACHE_TTL):
+        self.features = features
+        self.context_features = context_features
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.llm_cache = BoundedCache(max_items=cache_size, ttl=cache_ttl, name="intent_llm_cache")
+        self._lock = threading.Lock()
+        self._stats = {'rule': 0, 'score': 0, 'cache_hits': 0, 'llm': 0, 'llm_errors': 0,
+                       'clear_local': 0, 'clear_llm': 0}
+
+    # ---- 評分 ----
+
+    def score(self, text: str) -> Dict[str, float]:
+        """計算每個意圖的分數"""
+        norm = normalize_text(text)
+        words = set(re.findall(r"[a-z]+", unicodedata.normalize('NFKC', text or '').lower()))
+        scores = {}
+        for intent, feats in self.features.items():
+            total = sum(weight for feat, weight in feats.items() if self._hit(feat, norm, words))
+            if total:
+                # 有明確特徵時，才加上 CONTEXT_FEATURES 的分數
+                total += sum(weight for feat, weight in self.context_features.get(intent, {}).items()
+                             if self._hit(feat, norm, words))
+                scores[intent] = round(total, 3)
+        return scores
+
+    @staticmethod
+    def _hit(feat: str, norm: str, words: set) -> bool:
+        if feat.isascii() and feat.isalpha():
+            # 英文單字以詞比對，避免 "hi" 出現在 "this" 之中
+            return feat in words
+        if len(feat) > 1:
+            return feat in norm
+        return single_char_hit(feat, norm)
+
+    def classify(self, text: str) -> IntentResult:
+        """只用本地規則判斷（不呼叫 LLM）"""
+        intent = rule_based_intent(text)
+        if intent:
+            self._count('rule')
+            return IntentResult(intent, 1.0, 'rule')
+
+        scores = self.score(text)
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+        top_intent, top = ranked[0] if ranked else (None, 0.0)
+        second = ranked[1][1] if len(ranked) > 1 else 0.0
+        margin = top - second
+
+        norm = normalize_text(text)
+        ambiguous = top_intent == 'image_modification' and any(
+            q in text for q in QUESTION_MARKERS
+        )
+        if top >= self.min_score and margin >= self.min_margin and not ambiguous:
+            self._count('score')
+            return IntentResult(top_intent, min(1.0, margin / top), 'score', scores)
+
+        # 很短、又完全沒有功能相關特徵的訊息（例如「好」、「嗯嗯」、「ok」）視為聊天
+        action_score = sum(v for k, v in scores.items() if k != 'chat')
+        if len(norm) <= 4 and action_score == 0:
+            self._count('score')
+            return IntentResult('chat', 0.7, 'score', scores)
+
+        return IntentResult(None, 0.0, 'undecided', scores)
+
+    def classify_with_fallback(self, text: str, llm_classify: Callable[[str], str]) -> IntentResult:
+        """本地無法判斷時呼叫 llm_classify(text)，並快取結果"""
+        result = self.classify(text)
+        if result.intent:
+            return result
+        return self._cached_llm('intent', text, llm_classify, result.scores)
+
+    # ---- 清除記憶 ----
+
+    def clear_memory_intent(self, text: str) -> Optional[bool]:
+        """
+        判斷是否想清除對話記憶：True / False，無法確定時回傳 None
+        """
+        norm = normalize_text(text)
+        if any(p in norm for p in CLEAR_MEMORY_NEGATIONS):
+            # 「不要忘記我的生日」：去掉否定詞後仍明確要求清除才算
+            stripped = norm
+            for p in CLEAR_MEMORY_NEGATIONS:
+                stripped = stripped.replace(p, ' ')
+            return any(p in stripped for p in CLEAR_MEMORY_PHRASES)
+        if any(p in norm for p in CLEAR_MEMORY_PHRASES):
+            return True
+        if not any(k in norm for k in CLEAR_MEMORY_GATE):
+            return False
+        has_action = any(a in norm for a in CLEAR_MEMORY_ACTIONS)
+        has_object = any(o in norm for o in CLEAR_MEMORY_OBJECTS)
+        if has_action and has_object:
+            return True
+        if not has_action:
+            # 只提到「開始」、「對話」、「記憶」等字，沒有清除的動作
+            return False
+        return None
+
+    def should_clear_memory(self, text: str, llm_decide: Callable[[str], bool]) -> bool:
+        """本地判斷清除記憶意圖，無法確定時呼叫 llm_decide(text)（結果會快取）"""
+        decision = self.clear_memory_intent(text)
+        if decision is not None:
+            self._count('clear_local')
+            return decision
+        self._count('clear_llm')
+        return self._cached_llm('clear_memory', text, llm_decide).intent
+
+    # ---- 其他 ----
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        local = stats['rule'] + stats['score']
+        total = local + stats['cache_hits'] + stats['llm']
+        stats['local_ratio'] = round(local / total, 3) if total else 0.0
+        stats['cache'] = self.llm_cache.stats()
+        return stats
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _cached_llm(self, kind: str, text: str, llm_fn: Callable, scores: Optional[Dict] = None) -> IntentResult:
+        key = f"{kind}:{normalize_text(text)}"
+        try:
+            value = self.llm_cache[key]
+            if kind == 'intent':
+                self._count('cache_hits')
+            return IntentResult(value, 1.0, 'cache', scores)
+        except KeyError:
+            pass
+
+        started = time.perf_counter()
+        try:
+            value = llm_fn(text)
+        except Exception:
+            self._count('llm_errors')
+            raise
+        if kind == 'intent':
+            self._count('llm')
+        self.llm_cache[key] = value
+        print(f"[INTENT] LLM {kind} for '{text[:20]}' -> {value} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+        return IntentResult(value, 1.0, 'llm', scores)
+
+
+# 全域意圖判斷實例
+intent_engine = IntentEngine()
@@ -0,0 +1,38 @@
+"""
+延遲統計模組 - 各元件共用的耗時統計（/stats 監控用）
+保留最近的樣本計算百分位數，次數、平均與最大值則涵蓋所有樣本
+"""
+from collections import deque
+from typing import Dict
+
+
+class LatencyStats:
+    """延遲統計（保留最近的樣本計算百分位數；呼叫端負責加鎖）"""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def snapshot(self) -> Dict:
+        ordered = sorted(self.samples)
+
+        def pct(p):
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 1)
+
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            'p50_ms': pct(0.50),
+            'p95_ms': pct(0.95),
+            'max_ms': round(self.max * 1000, 1),
+        }
@@ -0,0 +1,135 @@
+"""
+LINE 圖片編碼模組 - 傳送前把圖片轉成符合 LINE 規格的原圖與預覽圖
+- LINE 的 originalContentUrl / previewImageUrl 只接受 JPEG 或 PNG（不支援 WebP），上限分別為 10 MB 與 1 MB
+- 原圖：照片類的大 PNG（Imagen 輸出、長輩圖）轉成 JPEG；已符合規格的 JPEG 直接沿用，不重新壓縮
+- 預覽圖：長邊 LINE_PREVIEW_SIDE 的小 JPEG，聊天室只顯示預覽，長輩的手機不必為了預覽下載整張原圖
+- 統計原始 / 原圖 / 預覽圖的大小與編碼時間（記憶體中尚未編碼的影像不為了統計而編碼）
+"""
+import io
+import os
+import time
+import threading
+from typing import Dict, Tuple, Union
+
+from PIL import Image
+
+from image_handle import ImageHandle
+from latency_stats import LatencyStats
+
+LINE_ORIGINAL_MAX_BYTES = 10 * 1024 * 1024  # LINE 規格上限
+LINE_PREVIEW_MAX_BYTES = 1 * 1024 * 1024
+LINE_IMAGE_MAX_SIDE = int(os.environ.get("LINE_IMAGE_MAX_SIDE", "2048"))  # 原圖長邊上限（px）
+LINE_IMAGE_QUALITY = int(os.environ.get("LINE_IMAGE_QUALITY", "88"))
+LINE_PREVIEW_SIDE = int(os.environ.get("LINE_PREVIEW_SIDE", "480"))  # 預覽圖長邊（px）
+LINE_PREVIEW_QUALITY = int(os.environ.get("LINE_PREVIEW_QUALITY", "75"))
+
+_MIN_QUALITY = 50  # 超過上限時逐步降低品質，最低到這裡之後改為縮小尺寸
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """JPEG 不支援透明：透明部分鋪白底"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+
+def _fit(image: Image.Image, max_side: int) -> Image.Image:
+    """長邊縮到 max_side 以內（不放大；回傳新影像，不修改原影像）"""
+    if max(image.size) <= max_side:
+        return image
+    scale = max_side / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+
+def _jpeg(image: Image.Image, quality: int, max_bytes: int) -> bytes:
+    """編碼 JPEG；超過 max_bytes 時逐步降低品質，再不行就縮小尺寸"""
+    while True:
+        for q in range(quality, _MIN_QUALITY - 1, -10):
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=q, optimize=True, progressive=True)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue()
+        image = _fit(image, int(max(image.size) * 0.75))
+
+
+class LineImageEncoder:
+    """LINE 圖片訊息的原圖 / 預覽圖編碼（執行緒安全）"""
+
+    def __init__(self, max_side: int = LINE_IMAGE_MAX_SIDE, quality: int = LINE_IMAGE_QUALITY,
+                 preview_side: int = LINE_PREVIEW_SIDE, preview_quality: int = LINE_PREVIEW_QUALITY):
+        self.max_side = max_side
+        self.quality = quality
+        self.preview_side = preview_side
+        self.preview_quality = preview_quality
+        self._lock = threading.Lock()
+        self._encode = LatencyStats()
+        self._upload = LatencyStats()
+        self._stats = {'images': 0, 'in_memory': 0, 'reused_original': 0,
+                       'source_bytes': 0, 'original_bytes': 0, 'preview_bytes': 0}
+        self._sized = {'original_bytes': 0, 'preview_bytes': 0}  # 有原始檔大小的圖片，用於計算比例
+
+    def encode(self, source: Union[str, ImageHandle]) -> Tuple[ImageHandle, ImageHandle]:
+        """回傳 (原圖, 預覽圖)，皆為 JPEG 的 ImageHandle（source 可為檔案路徑或 ImageHandle）"""
+        started = time.monotonic()
+        handle = source if isinstance(source, ImageHandle) else ImageHandle.from_path(source)
+        # 只有已存在的 bytes 才計入原始大小；剛畫好的長輩圖（from_image）不為了統計再編碼一次 PNG
+        in_memory = not handle.has_data
+        source_bytes = 0 if in_memory else len(handle.data)
+        image = handle.image()
+
+        # 已經是夠小的 JPEG：原圖直接沿用，避免再壓縮一次
+        reused = (not in_memory and handle.format == 'JPEG' and source_bytes <= LINE_ORIGINAL_MAX_BYTES
+                  and max(image.size) <= self.max_side)
+        if reused:
+            original = handle
+        else:
+            data = _jpeg(_fit(_to_rgb(image), self.max_side), self.quality, LINE_ORIGINAL_MAX_BYTES)
+            original = ImageHandle.from_bytes(data, format='JPEG')
+
+        preview_image = _to_rgb(image)
+        preview_image = _fit(preview_image, self.preview_side)
+        preview = ImageHandle.from_bytes(_jpeg(preview_image, self.preview_quality, LINE_PREVIEW_MAX_BYTES), format='JPEG')
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._encode.add(elapsed)
+            self._stats['images'] += 1
+            self._stats['in_memory'] += int(in_memory)
+            self._stats['reused_original'] += int(reused)
+            self._stats['source_bytes'] += source_bytes
+            self._stats['original_bytes'] += len(original.data)
+            self._stats['preview_bytes'] += len(preview.data)
+            if not in_memory:
+                self._sized['original_bytes'] += len(original.data)
+                self._sized['preview_bytes'] += len(preview.data)
+        source = "in-memory" if in_memory else f"{handle.format} {source_bytes // 1024} KB"
+        print(f"[LINE IMAGE] {source} {image.width}x{image.height} -> "
+              f"original {len(original.data) // 1024} KB{' (reused)' if reused else ''}, "
+              f"preview {len(preview.data) // 1024} KB ({elapsed * 1000:.0f} ms)")
+        return original, preview
+
+    def record_upload(self, seconds: float):
+        """記錄原圖與預覽圖（平行）上傳完成的時間"""
+        with self._lock:
+            self._upload.add(seconds)
+
+    def stats(self) -> Dict:
+        """大小與延遲的節省（監控用）"""
+        with self._lock:
+            stats = dict(self._stats)
+            sized = dict(self._sized)
+            stats['encode'] = self._encode.snapshot()
+            stats['upload'] = self._upload.snapshot()
+        if stats['source_bytes']:
+            # 原圖相對於原始檔的大小；預覽圖相對於原本預覽也使用的原始檔（只計算有原始檔大小的圖片）
+            stats['original_ratio'] = round(sized['original_bytes'] / stats['source_bytes'], 3)
+            stats['preview_ratio'] = round(sized['preview_bytes'] / stats['source_bytes'], 3)
+        return stats
+
+
+# 全域編碼器
+line_image_encoder = LineImageEncoder()
@@ -0,0 +1,200 @@
+"""
+LLM 回應快取模組 - 相同的 Gemini 請求只付費一次
+快取 key 為 (模型、提示範本 id、正規化後的輸入、生成設定) 的 SHA-256，
+記憶體中以 BoundedCache 保存，另寫入 kv_store 讓重新啟動或其他 Worker 也能命中
+
+注意：修改提示內容時請一併更新範本 id（例如 "region_check:v2"），避免沿用舊的結果
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from typing import Any, Dict, Optional
+
+from bounded_cache import BoundedCache
+
+LLM_CACHE_MAX_ITEMS = int(os.environ.get("LLM_CACHE_MAX_ITEMS", "2000"))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+LLM_CACHE_DEFAULT_TTL = int(os.environ.get("LLM_CACHE_DEFAULT_TTL", str(24 * 60 * 60)))
+LLM_CACHE_PERSIST = os.environ.get("LLM_CACHE_PERSIST", "true").lower() == "true"
+
+KEY_PREFIX = "llm:"
+
+
+def normalize_input(value: Any) -> Any:
+    """正規化輸入（全半形、前後空白、連續空白），讓只差在格式的請求共用快取"""
+    if isinstance(value, str):
+        return " ".join(unicodedata.normalize('NFKC', value).split())
+    if isinstance(value, dict):
+        return {str(k): normalize_input(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(v) for v in value]
+    return value
+
+
+def _config_dict(config) -> Any:
+    """把 GenerationConfig / dict 轉成可序列化的形式"""
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        return config
+    try:
+        from dataclasses import asdict, is_dataclass
+        if is_dataclass(config):
+            return {k: v for k, v in asdict(config).items() if v is not None}
+    except Exception:
+        pass
+    return repr(config)
+
+
+def model_fingerprint(model) -> Dict:
+    """模型識別：名稱 + 系統提示 + 模型預設的生成設定（同名模型的不同人設不可共用快取）"""
+    system_instruction = getattr(model, '_system_instruction', None)
+    return {
+        'name': getattr(model, 'model_name', None) or type(model).__name__,
+        'system': hashlib.sha256(repr(system_instruction).encode('utf-8')).hexdigest()[:16],
+        'config': _config_dict(getattr(model, '_generation_config', None)),
+    }
+
+
+def make_cache_key(model, template_id: str, inputs: Any, generation_config=None) -> str:
+    """計算快取 key"""
+    payload = {
+        'model': model_fingerprint(model),
+        'template': template_id,
+        'inputs': normalize_input(inputs),
+        'config': _config_dict(generation_config),
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    LLM 回應快取
+
+    - generate_text() 命中時直接回傳文字，未命中才呼叫 model.generate_content()
+    - 相同 key 同時有多個請求時只呼叫一次，其他請求等待結果
+    - 只快取成功且非空的回應；例外會直接拋出給呼叫端
+    """
+
+    def __init__(self, database=None, max_items: int = LLM_CACHE_MAX_ITEMS,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, default_ttl: int = LLM_CACHE_DEFAULT_TTL):
+        self.db = database if LLM_CACHE_PERSIST else None
+        self.default_ttl = default_ttl
+        # 值為 (到期時間, 文字)；BoundedCache 負責數量與大小上限
+        self.memory = BoundedCache(max_items=max_items, max_bytes=max_bytes, name="llm_cache")
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def generate_text(self, model, template_id: str, prompt, inputs: Any = None,
+                      generation_config=None, ttl: Optional[int] = None) -> str:
+        """
+        產生（或從快取取得）回應文字
+
+        template_id：提示範本名稱，用來區分用途與統計命中率
+        inputs：填入範本的變數（決定快取 key）；None 時以整個 prompt 為輸入
+        """
+        key = make_cache_key(model, template_id, prompt if inputs is None else inputs, generation_config)
+        ttl = self.default_ttl if ttl is None else ttl
+
+        while True:
+            text = self._lookup(key, template_id)
+            if text is not None:
+                return text
+            with self._lock:
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if owner:
+                break
+            # 其他執行緒正在產生相同的回應，等它完成後再查一次快取
+            self._count(template_id, 'waited')
+            event.wait(120)
+
+        try:
+            self._count(template_id, 'misses')
+            if generation_config is not None:
+                response = model.generate_content(prompt, generation_config=generation_config)
+            else:
+                response = model.generate_content(prompt)
+            text = response.text
+            if text and text.strip():
+                self._store(key, text, ttl)
+            return text
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def invalidate(self, model, template_id: str, inputs: Any, generation_config=None):
+        """移除某個請求的快取"""
+        key = make_cache_key(model, template_id, inputs, generation_config)
+        self.memory.pop(key, None)
+        if self.db:
+            try:
+                self.db.delete(KEY_PREFIX + key)
+            except Exception as e:
+                print(f"[LLM CACHE] Failed to delete {key[:12]}: {e}")
+
+    def stats(self) -> Dict:
+        """各範本的命中率與記憶體用量（監控用）"""
+        with self._lock:
+            templates = {name: dict(counts) for name, counts in self._stats.items()}
+        for counts in templates.values():
+            hits = counts.get('memory_hits', 0) + counts.get('db_hits', 0)
+            total = hits + counts.get('misses', 0)
+            counts['hit_rate'] = round(hits / total, 3) if total else 0.0
+        return {'templates': templates, 'memory': self.memory.stats(), 'persistent': bool(self.db)}
+
+    # ---- 內部 ----
+
+    def _lookup(self, key: str, template_id: str) -> Optional[str]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            expires_at, text = entry
+            if expires_at > time.time():
+                self._count(template_id, 'memory_hits')
+                return text
+            self.memory.pop(key, None)
+
+        if not self.db:
+            return None
+        try:
+            raw = self.db.get(KEY_PREFIX + key)
+        except Exception as e:
+            print(f"[LLM CACHE] Read error: {e}")
+            return None
+        if raw is None:
+            return None
+        try:
+            data = json.loads(raw)
+            expires_at, text = data['expires_at'], data['text']
+        except (ValueError, KeyError, TypeError):
+            return None
+        if expires_at <= time.time():
+            return None
+        self.memory[key] = (expires_at, text)
+        self._count(template_id, 'db_hits')
+        return text
+
+    def _store(self, key: str, text: str, ttl: int):
+        expires_at = time.time() + ttl
+        self.memory[key] = (expires_at, text)
+        if not self.db:
+            return
+        try:
+            self.db.set(KEY_PREFIX + key, json.dumps({'expires_at': expires_at, 'text': text}, ensure_ascii=False), ttl=ttl)
+        except Exception as e:
+            print(f"[LLM CACHE] Write error: {e}")
+
+    def _count(self, template_id: str, field: str):
+        with self._lock:
+            counts = self._stats.setdefault(template_id, {})
+            counts[field] = counts.get(field, 0) + 1
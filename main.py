@@ -66,7 +66,6 @@ except Exception as e:
      print(f"Bootstrapping error: {e}")
 
 
-from google.cloud import aiplatform
 from google.cloud import speech
 from google.cloud import texttospeech
 from region_helper import check_region_need_clarification
@@ -76,8 +75,8 @@ from trip_modify_helper import modify_trip_plan, validate_and_fix_trip_plan
 import PIL
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance
 
-# HTTP requests
-import requests
+# HTTP requests（所有對外請求都透過共用用戶端：keep-alive、逾時、重試與統計）
+from http_client import http_client
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)  # 抑制 SSL 警告
 
@@ -106,7 +105,7 @@ except ImportError as e:
     maps = None
     ADVANCED_FEATURES_ENABLED = False
 
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
 from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.webhooks import (
@@ -215,48 +214,72 @@ configuration = Configuration(access_token=channel_access_token)
 # User State Management
 # ======================
 # ======================
-# 儲存每個用戶的對話歷史（用 user_id 當 key）
-chat_sessions = {}
+# 以下狀態透過 state_store 存放（STATE_BACKEND=db/redis 時可跨 Worker 共用），
+# 事件處理完畢後由 state_store.flush() 寫回；標註「本機」者僅存在於目前程序
+from state_store import state_store
 # 儲存每個用戶的最後活動時間
-last_activity = {}
+last_activity = state_store.namespace('last_activity')
 # 儲存每個用戶上傳的圖片（改為list保留最近5張）
-user_images = {}  # 格式: {user_id: [image_path1, image_path2, ...]}
+user_images = state_store.namespace('user_images')  # 格式: {user_id: [image_path1, image_path2, ...]}
 # 儲存每個用戶的圖片修改狀態和歷史
-user_uploaded_image_pending = {}  # 格式: {user_id: {'images': [...], 'history': [...]}}
-# 圖片批次回覆機制（延遲合併多張圖片）
-import threading
-image_batch_timers = {}   # {user_id: threading.Timer}
-image_batch_tokens = {}   # {user_id: reply_token}  保存最後一個reply_token
+user_uploaded_image_pending = state_store.namespace('user_uploaded_image_pending')  # 格式: {user_id: {'images': [...], 'history': [...]}}
 # 儲存每個用戶最後一次生圖的 Prompt
-user_last_image_prompt = {} 
+user_last_image_prompt = state_store.namespace('user_last_image_prompt')
 # 儲存每個用戶的圖片生成狀態
-user_image_generation_state = {}  # 'idle', 'waiting_for_prompt', 'generating'
+user_image_generation_state = state_store.namespace('user_image_generation_state')  # 'idle', 'waiting_for_prompt', 'generating'
 # 儲存每個用戶最後一次生成的圖片路徑 (for Image-to-Image editing)
-user_last_generated_image_path = {}
+user_last_generated_image_path = state_store.namespace('user_last_generated_image_path')
 # 儲存每個用戶的長輩圖製作狀態
-user_meme_state = {}
+user_meme_state = state_store.namespace('user_meme_state')
 # 儲存每個用戶的行程規劃狀態
-user_trip_plans = {}
-# [New] 儲存當前批次上傳的圖片 (用於描述，描述完即清空)
-user_image_batch = {}
+user_trip_plans = state_store.namespace('user_trip_plans')
 
 # 儲存每個用戶的提醒事項
 user_reminders = {}
 # 對話過期時間：7天
 SESSION_TIMEOUT = timedelta(days=7)
 
+# 儲存每個用戶的對話歷史（本機：ChatSession 物件無法序列化）
+# 記憶體中只保留有上限的活躍對話，被淘汰的對話寫入 chat_history，用戶回來時自動還原
+from chat_memory import ChatMemory
+chat_memory = ChatMemory(model, db if ADVANCED_FEATURES_ENABLED else None, session_timeout=SESSION_TIMEOUT)
+chat_sessions = chat_memory.sessions
+
+# 意圖判斷：本地規則與關鍵字評分優先，無法判斷才呼叫 AI
+from intent_engine import intent_engine
+
+# Imagen 模型：Vertex AI 初始化與模型載入每個行程只做一次
+from imagen_registry import imagen_registry
+
+# 字體：路徑與 FreeTypeFont 物件共用，不必每次重新解析字型檔
+from font_registry import font_registry
+from glyph_atlas import glyph_atlas
+from text_region import EdgeDensityMap, TEXT_BOX_FRACTION
+# 圖片在處理流程中以 ImageHandle 傳遞（解碼一次、編碼一次），只有跨訊息保存時才寫入磁碟
+from image_handle import ImageHandle, image_store
+# 傳送前轉成符合 LINE 規格的 JPEG 原圖與預覽小圖
+from line_image import line_image_encoder
+
+# Gemini 回應快取：跨用戶相同的請求（地區判斷、翻譯、摘要）只呼叫一次
+from llm_cache import LLMCache
+llm_cache = LLMCache(db if ADVANCED_FEATURES_ENABLED else None)
+
+# 語音合成快取：相同文字與聲音只合成、上傳一次（音檔存於磁碟，公開網址記在 kv_store）
+from tts_cache import TTSCache
+tts_cache = TTSCache(os.path.join(UPLOAD_FOLDER, "tts_cache"), database=db if ADVANCED_FEATURES_ENABLED else None)
+
 # 儲存待確認的語音內容 (格式: {'user_id': {'text': '...', 'original_intent': '...'}})
-user_audio_confirmation_pending = {}
+user_audio_confirmation_pending = state_store.namespace('user_audio_confirmation_pending')
 
 # ======================
 # 連結查證與新聞功能狀態
 # ======================
 # 用戶待處理連結狀態
-user_link_pending = {}
-# 新聞快取 (減少API呼叫)
-news_cache = {'data': None, 'timestamp': None}
-# 用戶新聞快取(語音播報)
-user_news_cache = {}
+user_link_pending = state_store.namespace('user_link_pending')
+# 新聞索引（本機，背景執行緒以條件式請求定期更新各 RSS 來源）
+from news_service import news_service, NewsBriefing
+# 用戶新聞快取(語音播報)：共用摘要只記錄新聞版本，個人化摘要才存全文
+user_news_cache = state_store.namespace('user_news_cache')
 
 # ======================
 # Daily Quota (圖片 6次/天, 提醒 3次/天)
@@ -264,6 +287,7 @@ user_news_cache = {}
 # ======================
 MAX_DAILY_IMAGES = 6
 MAX_DAILY_REMINDERS = 3
+QUOTA_KEY_TTL = 2 * 24 * 60 * 60  # 每日配額 key 保留 2 天後自動過期
 QUOTA_WHITELIST = {'Uef7a27fdb40659345ccd473051078f67','U98fe7f3eca4714b1b122d6efdcb4f1cf'}  # ← 您的專屬 API ID
 #QUOTA_WHITELIST = set()  # ← 恢復成這樣就是空無一人的名單
 
@@ -273,9 +297,16 @@ def _quota_key_today(prefix, user_id):
     tw_now = datetime.now(timezone(timedelta(hours=8)))
     return f"{prefix}:{user_id}:{tw_now.strftime('%Y-%m-%d')}"
 
-def check_image_quota(user_id):
+IMAGE_QUOTA_MSG = (
+    f"抱歉，您今天的畫圖/修圖配額（共 {MAX_DAILY_IMAGES} 次）已用完囉！\n"
+    "請明天再來繼續玩吧 🌅\n(每天台灣時間凌晨零點自動重置)"
+)
+
+def reserve_image_quota(user_id):
     """
-    檢查今日圖片配額（生成/修改/融合/背景 共用同一份）
+    預留一次今日圖片配額（生成/修改/融合/背景 共用同一份）
+    以單一原子 incr 完成檢查與扣除，多個 worker 同時請求也不會超額；超過上限時立即退回
+    圖片操作失敗時請呼叫 release_image_quota 退回
     回傳: (is_allowed: bool, remaining: int, blocked_msg: str or None)
     """
     if user_id in QUOTA_WHITELIST:
@@ -284,29 +315,24 @@ def check_image_quota(user_id):
         return (True, MAX_DAILY_IMAGES, None)
     try:
         key = _quota_key_today("img_quota", user_id)
-        used = int(db.get(key) or 0)
-        remaining = MAX_DAILY_IMAGES - used
-        if remaining <= 0:
-            msg = (
-                f"抱歉，您今天的畫圖/修圖配額（共 {MAX_DAILY_IMAGES} 次）已用完囉！\n"
-                "請明天再來繼續玩吧 🌅\n(每天台灣時間凌晨零點自動重置)"
-            )
-            return (False, 0, msg)
-        return (True, remaining, None)
+        used = db.incr(key, 1, ttl=QUOTA_KEY_TTL)
+        if used > MAX_DAILY_IMAGES:
+            db.incr(key, -1, ttl=QUOTA_KEY_TTL, minimum=0)
+            return (False, 0, IMAGE_QUOTA_MSG)
+        return (True, MAX_DAILY_IMAGES - used, None)
     except Exception as e:
-        print(f"[QUOTA] check_image_quota error: {e}")
+        print(f"[QUOTA] reserve_image_quota error: {e}")
         return (True, MAX_DAILY_IMAGES, None)
 
-def increment_image_quota(user_id):
-    """圖片操作成功後才呼叫，將今日計數 +1"""
+def release_image_quota(user_id):
+    """圖片操作失敗時呼叫，退回 reserve_image_quota 預留的一次"""
     if user_id in QUOTA_WHITELIST or not db:
         return
     try:
         key = _quota_key_today("img_quota", user_id)
-        used = int(db.get(key) or 0)
-        db.set(key, used + 1)
+        db.incr(key, -1, ttl=QUOTA_KEY_TTL, minimum=0)
     except Exception as e:
-        print(f"[QUOTA] increment_image_quota error: {e}")
+        print(f"[QUOTA] release_image_quota error: {e}")
 
 def remain_img_hint(user_id):
     """成功後顯示剩餘配額提示字串（白名單不顯示）"""
@@ -320,51 +346,38 @@ def remain_img_hint(user_id):
     except:
         return ""
 
-def check_reminder_quota(user_id):
+def reserve_reminder_quota(user_id):
     """
-    檢查今日提醒配額（max 3）
-    回傳: (is_allowed: bool, used_count: int, blocked_msg: str or None)
+    預留一個今日提醒配額（max 3），以單一原子 incr 完成檢查與扣除；超過上限時立即退回
+    提醒設定失敗時請呼叫 decrement_reminder_quota 退回
+    回傳: (is_allowed: bool, remaining: int, blocked_msg: str or None)
     """
     if user_id in QUOTA_WHITELIST:
-        return (True, 0, None)
+        return (True, MAX_DAILY_REMINDERS, None)
     if not db:
-        return (True, 0, None)
+        return (True, MAX_DAILY_REMINDERS, None)
     try:
         key = _quota_key_today("remind_quota", user_id)
-        used = int(db.get(key) or 0)
-        if used >= MAX_DAILY_REMINDERS:
+        used = db.incr(key, 1, ttl=QUOTA_KEY_TTL)
+        if used > MAX_DAILY_REMINDERS:
+            db.incr(key, -1, ttl=QUOTA_KEY_TTL, minimum=0)
             msg = (
                 f"抱歉，您今天已設定 {MAX_DAILY_REMINDERS} 個提醒，已達每日上限！\n"
                 "請明天再設定🌅 (若有尚未發送的提醒，可輸入「刪除提醒」來釋出額度)"
             )
-            return (False, used, msg)
-        return (True, used, None)
-    except Exception as e:
-        print(f"[QUOTA] check_reminder_quota error: {e}")
-        return (True, 0, None)
-
-def increment_reminder_quota(user_id):
-    """提醒設定成功後呼叫，計數 +1 並回傳剩餘數"""
-    if user_id in QUOTA_WHITELIST or not db:
-        return MAX_DAILY_REMINDERS
-    try:
-        key = _quota_key_today("remind_quota", user_id)
-        used = int(db.get(key) or 0)
-        db.set(key, used + 1)
-        return MAX_DAILY_REMINDERS - used - 1
+            return (False, 0, msg)
+        return (True, MAX_DAILY_REMINDERS - used, None)
     except Exception as e:
-        print(f"[QUOTA] increment_reminder_quota error: {e}")
-        return MAX_DAILY_REMINDERS
+        print(f"[QUOTA] reserve_reminder_quota error: {e}")
+        return (True, MAX_DAILY_REMINDERS, None)
 
 def decrement_reminder_quota(user_id, count=1):
-    """提醒取消後呼叫，退回計數"""
+    """提醒取消或設定失敗後呼叫，退回計數"""
     if user_id in QUOTA_WHITELIST or not db:
         return
     try:
         key = _quota_key_today("remind_quota", user_id)
-        used = int(db.get(key) or 0)
-        new_used = max(0, used - count)
-        db.set(key, new_used)
+        db.incr(key, -count, ttl=QUOTA_KEY_TTL, minimum=0)
     except Exception as e:
         print(f"[QUOTA] decrement_reminder_quota error: {e}")
 
@@ -606,7 +619,6 @@ def fetch_webpage_content(url):
     """
     try:
         from bs4 import BeautifulSoup
-        import requests
         
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -616,7 +628,7 @@ def fetch_webpage_content(url):
         import urllib3
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
         
-        response = requests.get(url, headers=headers, timeout=10, verify=False)
+        response = http_client.get(url, headers=headers, timeout=10, verify=False)
         response.encoding = 'utf-8'
         
         soup = BeautifulSoup(response.text, 'html.parser')
@@ -667,92 +679,20 @@ def summarize_content(content, user_id):
         (3 bullet points)
         """
         
-        response = model_functional.generate_content(prompt)
-        return response.text
+        # 相同內容（例如多人分享同一個網址）只摘要一次
+        return llm_cache.generate_text(model_functional, "summarize_content:v1", prompt,
+                                       inputs={'content': content[:4000]}, ttl=6 * 60 * 60)
     except Exception as e:
         print(f"Summarize error: {e}")
         return "抱歉，我無法讀取這個網頁的內容。可能是網站有防護機制。"
 
 def fetch_latest_news():
     """
-    抓取最新新聞 (使用 RSS)
+    取得最新新聞 (RSS，由 news_service 在背景定期更新)
     返回: 新聞列表 (list of dict)
     """
     try:
-        import feedparser
-        from datetime import datetime, timedelta
-        
-        # 檢查快取 (5 分鐘內不重複抓取)
-        if news_cache['data'] and news_cache['timestamp']:
-            if datetime.now() - news_cache['timestamp'] < timedelta(minutes=5):
-                return news_cache['data']
-        
-        feeds = [
-            'https://news.ltn.com.tw/rss/all.xml',  # 自由時報 - 所有新聞
-            'https://newtalk.tw/rss/all',  # 新頭殼 - 所有新聞
-            'https://feeds.feedburner.com/rsscna/politics',  # 中央社 - 政治
-            'https://feeds.feedburner.com/rsscna/finance',  # 中央社 - 財經
-            'https://udn.com/rssfeed/news/2/6638?ch=news',  # 聯合報 - 即時新聞
-        ]
-        
-        news_items = []
-        import random
-        user_agents = [
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0'
-        ]
-
-        for feed_url in feeds:
-            try:
-                # [FIX] Rotate User-Agent and disable SSL verify for problematic feeds
-                headers = {'User-Agent': random.choice(user_agents)}
-                response = requests.get(feed_url, headers=headers, timeout=10, verify=False)
-                if response.status_code == 200:
-                    feed = feedparser.parse(response.content)
-                    for entry in feed.entries[:10]:  # 增加到 10 則，確保有足夠新聞供挑選
-                        # [FIX] 增強內容抓取邏輯 (避免 News ID 錯誤或空白)
-                        raw_summary = entry.get('summary', '') or entry.get('description', '')
-                        # 如果 summary 還是空的，嘗試 content
-                        if not raw_summary and 'content' in entry:
-                             raw_summary = entry.get('content', [{'value': ''}])[0]['value']
-                        
-                        # 清理 HTML 標籤
-                        import re
-                        clean_summary = re.sub('<[^<]+?>', '', raw_summary).strip()
-                        
-                        # [FIX] 如果真的都沒內容，使用標題作為摘要 (Fallback to Title)
-                        if not clean_summary or len(clean_summary) < 5:
-                            # 優先使用 Description (如果不同於 Summary)
-                            desc = entry.get('description', '')
-                            if desc and len(desc) > 5:
-                                clean_summary = re.sub('<[^<]+?>', '', desc).strip()
-                            else:
-                                clean_summary = entry.get('title', '')
-                            # print(f"[DEBUG] Fallback to Title/Desc: {clean_summary[:20]}...")
-                            
-                        # If still empty (no title?), skip
-                        if not clean_summary:
-                            # print(f"[DEBUG] News Skipped (No Content): {entry.get('title', 'Unknown')}")
-                            continue
-
-                        news_items.append({
-                            'title': entry.title,
-                            'summary': clean_summary[:100] + "..." if len(clean_summary) > 100 else clean_summary,
-                            'link': entry.link,
-                            'published': entry.get('published', '')
-                        })
-                else:
-                    print(f"Feed error {feed_url}: {response.status_code}")
-            except Exception as e:
-                print(f"Feed parse error for {feed_url}: {e}")
-                continue
-        
-        # 更新快取
-        news_cache['data'] = news_items
-        news_cache['timestamp'] = datetime.now()
-        
-        return news_items
+        return news_service.latest()
     except Exception as e:
         print(f"Fetch news error: {e}")
         return []
@@ -762,24 +702,21 @@ def detect_news_intent(text):
     keywords = ['新聞', '消息', '最新', '頭條', '報導', '發生什麼', '看新聞', '聽新聞', '今日新聞', '新聞快報', '最近新聞', '語音', '播報', '唸給我聽']
     return any(keyword in text for keyword in keywords)
 
-def generate_news_summary():
-    """生成新聞摘要"""
-    news_items = fetch_latest_news()
+def summarize_news_items(news_items):
+    """
+    用 Gemini 摘要新聞（由 news_briefing 對每個新聞版本呼叫一次，所有用戶共用結果）
+    失敗時拋出例外
+    """
+    # 使用 Gemini 摘要新聞
+    # 使用較少的新聞項目 (前 15 則) 加速處理
+    # 為了確保連結正確，我們建立索引映射
+    indexed_news = []
+    for i, item in enumerate(news_items[:15], 1):
+         indexed_news.append(f"[{i}] 標題: {item['title']}\n內容: {item['summary']}")
     
-    if not news_items:
-        return "抱歉，目前無法取得新聞資訊。請稍後再試！"
+    news_text = "\n\n".join(indexed_news)
     
-    # 使用 Gemini 摘要新聞
-    try:
-        # 使用較少的新聞項目 (前 15 則) 加速處理
-        # 為了確保連結正確，我們建立索引映射
-        indexed_news = []
-        for i, item in enumerate(news_items[:15], 1):
-             indexed_news.append(f"[{i}] 標題: {item['title']}\n內容: {item['summary']}")
-        
-        news_text = "\n\n".join(indexed_news)
-        
-        prompt = f"""
+    prompt = f"""
 請摘要以下新聞，挑選7則最重要的。
 
 {news_text}
@@ -797,109 +734,299 @@ def generate_news_summary():
 
 ... 7則 ...
 """
-        generation_config = genai.types.GenerationConfig(
-            temperature=0.1,
-        )
-        
-        
-        # 查新聞使用 Flash 模型（快速回報），語音播報才用 Pro
-        response = model_functional.generate_content(prompt, generation_config=generation_config)
-        print("[INFO] Using Flash for news summary (fast display)")
-        
-        # DEBUG: 檢查 AI 輸出是否包含數字
-        import re
-        ai_output = response.text.strip()
-        has_numbers = bool(re.search(r'\d', ai_output))
-        print(f"[DEBUG] AI news output has numbers: {has_numbers}")
-        if not has_numbers:
-            print(f"[WARNING] AI removed all numbers! First 300 chars: {ai_output[:300]}")
+    generation_config = genai.types.GenerationConfig(
+        temperature=0.1,
+    )
+    
+    
+    # 查新聞使用 Flash 模型（快速回報），語音播報才用 Pro
+    # 新聞內容相同時共用摘要（新聞更新後 key 會改變）
+    response_text = llm_cache.generate_text(model_functional, "news_summary:v1", prompt,
+                                            inputs={'news': news_text},
+                                            generation_config=generation_config, ttl=30 * 60)
+    print("[INFO] Using Flash for news summary (fast display)")
+    
+    # DEBUG: 檢查 AI 輸出是否包含數字
+    import re
+    ai_output = response_text.strip()
+    has_numbers = bool(re.search(r'\d', ai_output))
+    print(f"[DEBUG] AI news output has numbers: {has_numbers}")
+    if not has_numbers:
+        print(f"[WARNING] AI removed all numbers! First 300 chars: {ai_output[:300]}")
 
+    
+    final_text = ai_output
+    
+    # Post-process: Replace [ID] with actual links
+    import re
+    lines = final_text.split('\n')
+    processed_lines = []
+    
+    current_link = ""
+    
+    for line in lines:
+        # Check for ID pattern like "1️⃣ [5] 【標題】" or just "[5]"
+        # Regex to find [ID]
+        match = re.search(r'\[(\d+)\]', line)
+        if match:
+            try:
+                idx = int(match.group(1)) - 1 # 0-indexed
+                if 0 <= idx < len(news_items):
+                    current_link = news_items[idx]['link']
+                    # Remove the [ID] tag from the display text
+                    line = line.replace(f"[{match.group(1)}]", "")
+                else:
+                    current_link = ""
+            except:
+                current_link = ""
         
-        final_text = ai_output
-        
-        # Post-process: Replace [ID] with actual links
-        import re
-        lines = final_text.split('\n')
-        processed_lines = []
-        
-        current_link = ""
+        processed_lines.append(line)
         
-        for line in lines:
-            # Check for ID pattern like "1️⃣ [5] 【標題】" or just "[5]"
-            # Regex to find [ID]
-            match = re.search(r'\[(\d+)\]', line)
-            if match:
-                try:
-                    idx = int(match.group(1)) - 1 # 0-indexed
-                    if 0 <= idx < len(news_items):
-                        current_link = news_items[idx]['link']
-                        # Remove the [ID] tag from the display text
-                        line = line.replace(f"[{match.group(1)}]", "")
-                    else:
-                        current_link = ""
-                except:
-                    current_link = ""
-            
-            processed_lines.append(line)
-            
-            # append link after summary block (usually detecting empty line or next number?)
-            # strategy: simply append link immediately after the title line? 
-            # Or better: The format implies title line, then summary.
-            # Let's simplify: Just append the link to the NEXT line if we found an ID.
-            if current_link and "【" in line:
-                 processed_lines.append(f"   🔗 來源：{current_link}")
-                 current_link = "" # reset
-        
-        final_text = "\n".join(processed_lines)
-
-        # 強制附加語音引導 (如果 AI 沒加)
-        if "語音" not in final_text[-50:]:
-            final_text += "\n\n💡 想聽語音播報？回覆「語音」即可"
-            
-        return final_text
-    except Exception as e:
-        print(f"News summary error: {e}")
-        return "抱歉，新聞摘要生成失敗。請稍後再試！"
+        # append link after summary block (usually detecting empty line or next number?)
+        # strategy: simply append link immediately after the title line? 
+        # Or better: The format implies title line, then summary.
+        # Let's simplify: Just append the link to the NEXT line if we found an ID.
+        if current_link and "【" in line:
+             processed_lines.append(f"   🔗 來源：{current_link}")
+             current_link = "" # reset
+    
+    final_text = "\n".join(processed_lines)
 
-def generate_news_audio(text, user_id):
+    # 強制附加語音引導 (如果 AI 沒加)
+    if "語音" not in final_text[-50:]:
+        final_text += "\n\n💡 想聽語音播報？回覆「語音」即可"
+
+    return final_text
+
+def generate_news_summary():
     """
-    生成新聞語音播報
-    返回: 音檔路徑 (str) 或 None
+    取得目前的新聞摘要（同一版本的新聞所有用戶共用一份）
+    返回: (摘要文字, 新聞版本)；失敗時版本為 None
     """
+    news_items = fetch_latest_news()
+    
+    if not news_items:
+        return "抱歉，目前無法取得新聞資訊。請稍後再試！", None
+    
     try:
-        # 使用 Google Cloud TTS (免費額度)
-        from google.cloud import texttospeech
-        
-        global tts_client
-        if tts_client is None:
-            tts_client = texttospeech.TextToSpeechClient()
-        client = tts_client
-        
-        synthesis_input = texttospeech.SynthesisInput(text=text)
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="zh-TW",
-            name="cmn-TW-Wavenet-A"  # 台灣女聲
-        )
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
+        briefing = news_briefing.current()
+    except Exception as e:
+        print(f"News summary error: {e}")
+        briefing = None
+    if not briefing:
+        return "抱歉，新聞摘要生成失敗。請稍後再試！", None
+    return briefing['summary'], briefing['version']
+
+# Google Cloud TTS 設定（同時是語音快取 key 的一部分）
+NEWS_TTS_VOICE = {'language_code': 'zh-TW', 'name': 'cmn-TW-Wavenet-A'}  # 台灣女聲
+REPLY_TTS_VOICE = {'language_code': 'zh-TW', 'name': 'zh-TW-Wavenet-A'}
+TTS_AUDIO_CONFIG = {'audio_encoding': 'MP3'}
+
+def synthesize_speech(text, voice, audio_config):
+    """呼叫 Google Cloud TTS (免費額度)，返回音訊 bytes（tts_cache 未命中時才會呼叫）"""
+    global tts_client
+    if tts_client is None:
+        tts_client = texttospeech.TextToSpeechClient()
+    
+    response = tts_client.synthesize_speech(
+        input=texttospeech.SynthesisInput(text=text),
+        voice=texttospeech.VoiceSelectionParams(**voice),
+        audio_config=texttospeech.AudioConfig(
+            audio_encoding=getattr(texttospeech.AudioEncoding, audio_config['audio_encoding'])
         )
+    )
+    return response.audio_content
+
+def build_news_voice_text(summary_text):
+    """將新聞摘要轉成語音播報用的純文字（Pro 模型改寫 + 數字轉中文）"""
+    # 使用 Pro 模型重新生成語音專用文字（保留數字）
+    print("[VOICE] Generating TTS text with Pro model for number preservation...")
+    
+    try:
+        # 使用 Pro 模型重新處理，確保數字被保留
+        voice_prompt = f"""將以下新聞改寫為適合語音播報的純文字。
         
-        response = client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
+重要規則：
+1. 必須保留所有日期和數字（如：4日、100萬、2月9日）
+2. 移除所有標點符號和表情符號
+3. 用口語化的方式表達
+4. 每則新聞約50字
+5. 每則新聞開頭必須以「第一則、第二則、第三則...」等方式唸出則數，例如：「第一則。台灣...」
+
+原始新聞：
+{summary_text[:2000]}
+
+直接輸出語音稿，不要加任何解釋。"""
+
+        model_pro = genai.GenerativeModel(
+            model_name="gemini-2.5-pro",
+            system_instruction="你是專業新聞播報員，必須精準保留所有日期與數字。"
         )
-        
-        # 儲存音檔
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-        audio_path = os.path.join(UPLOAD_FOLDER, f"{user_id}_news.mp3")
-        with open(audio_path, 'wb') as f:
-            f.write(response.audio_content)
-        
-        return audio_path
+        response = model_pro.generate_content(voice_prompt)
+        news_text = response.text.strip()
+        print(f"[VOICE PRO] Generated text with numbers preserved: {news_text[:100]}...")
     except Exception as e:
-        print(f"TTS error: {e}")
-        return None
+        print(f"[VOICE] Pro model failed, using cached text: {e}")
+        news_text = summary_text
+    
+    # 清理文字（TTS 專用）- 重要：保留內容數字
+    import re
+    
+    # 步驟 1：先移除 URL（包含 URL 中的數字）
+    clean_text = re.sub(r'https?://[^\s]+', '', news_text)
+    clean_text = re.sub(r'www\.[^\s]+', '', clean_text)
+    
+    # 步驟 2：移除「來源：」後面的所有內容（通常是 URL 或網站名）
+    clean_text = re.sub(r'來源：[^\n]*', '', clean_text)
+    
+    # 步驟 3：移除特定 emoji 符號（不使用 emoji 數字字符，避免誤刪普通數字）
+    # 改用 unicode 移除常見表情符號
+    emoji_pattern = re.compile("["
+        u"\U0001F600-\U0001F64F"  # emoticons
+        u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+        u"\U0001F680-\U0001F6FF"  # transport & map symbols
+        u"\U0001F1E0-\U0001F1FF"  # flags
+        u"\U00002702-\U000027B0"  # dingbats
+        u"\U0001F4A0-\U0001F4FF"  # 其他符號
+        "]+", flags=re.UNICODE)
+    clean_text = emoji_pattern.sub('', clean_text)
+    # 移除中括號等標記
+    clean_text = re.sub(r'[【】🔗💡📰🔊]', '', clean_text)
+    
+    # 步驟 4：移除標題文字
+    clean_text = clean_text.replace('今日新聞摘要', '').replace('想聽語音播報？回覆「語音」即可', '').strip()
+    
+    # DEBUG: 檢查數字保留情況
+    has_digits_before = bool(re.search(r'\d', clean_text))
+    print(f"[DEBUG] Before digit conversion - has digits: {has_digits_before}")
+    if has_digits_before:
+        digit_sample = re.findall(r'\d+', clean_text)[:5]
+        print(f"[DEBUG] Sample digits found: {digit_sample}")
+    
+    # 步驟 5：將日期格式 X/Y 轉換為 X月Y日
+    clean_text = re.sub(r'(\d{1,2})/(\d{1,2})', r'\1月\2日', clean_text)
+    
+    # 步驟 6：完整的中文數字轉換（含位數單位）
+    def num_to_chinese(num_str):
+        """將阿拉伯數字轉為中文（含單位）"""
+        digit_map = {'0': '零', '1': '一', '2': '二', '3': '三', '4': '四', 
+                     '5': '五', '6': '六', '7': '七', '8': '八', '9': '九'}
+        
+        # 處理小數
+        if '.' in num_str:
+            parts = num_str.split('.')
+            integer_part = num_to_chinese(parts[0])
+            decimal_part = ''.join(digit_map.get(d, d) for d in parts[1])
+            return f"{integer_part}點{decimal_part}"
+        
+        # 處理整數
+        num = int(num_str)
+        if num == 0:
+            return '零'
+        
+        units = ['', '十', '百', '千', '萬', '十萬', '百萬', '千萬', '億']
+        result = []
+        
+        # 億位
+        if num >= 100000000:
+            result.append(digit_map[str(num // 100000000)])
+            result.append('億')
+            num %= 100000000
+            if num > 0 and num < 10000000:
+                result.append('零')
+        
+        # 萬位
+        if num >= 10000:
+            wan = num // 10000
+            if wan >= 10:
+                result.append(num_to_chinese(str(wan)))
+            else:
+                result.append(digit_map[str(wan)])
+            result.append('萬')
+            num %= 10000
+            if num > 0 and num < 1000:
+                result.append('零')
+        
+        # 千位
+        if num >= 1000:
+            result.append(digit_map[str(num // 1000)])
+            result.append('千')
+            num %= 1000
+            if num > 0 and num < 100:
+                result.append('零')
+        
+        # 百位
+        if num >= 100:
+            result.append(digit_map[str(num // 100)])
+            result.append('百')
+            num %= 100
+            if num > 0 and num < 10:
+                result.append('零')
+        
+        # 十位
+        if num >= 10:
+            tens = num // 10
+            if tens != 1 or len(result) > 0:  # 避免 "一十" 只說 "十"
+                result.append(digit_map[str(tens)])
+            result.append('十')
+            num %= 10
+        
+        # 個位
+        if num > 0:
+            result.append(digit_map[str(num)])
+        
+        return ''.join(result)
+    
+    # 替換所有數字（包括小數）
+    def replace_number(match):
+        return num_to_chinese(match.group(0))
+    
+    # 步驟 7：處理百分比（23% → 百分之二十三）
+    def replace_percent(match):
+        num = match.group(1)
+        chinese_num = num_to_chinese(num)
+        return f"百分之{chinese_num}"
+    clean_text = re.sub(r'(\d+\.?\d*)%', replace_percent, clean_text)
+    
+    # 步驟 8：跳過字母數字混合碼（如 M1A2T, F-16, A380）
+    # 讓 TTS 直接唸英文字母和數字
+    alphanumeric_pattern = r'[A-Za-z][\dA-Za-z-]*\d[\dA-Za-z-]*|[A-Za-z]+-\d+'
+    
+    # 只轉換「純數字」，跳過字母數字混合
+    def smart_replace_number(match):
+        num_str = match.group(0)
+        # 檢查前後是否有字母
+        start = match.start()
+        end = match.end()
+        text = match.string
+        # 如果前面或後面有字母，不轉換
+        if (start > 0 and text[start-1].isalpha()) or (end < len(text) and text[end].isalpha()):
+            return num_str  # 保持原樣
+        return num_to_chinese(num_str)
+    
+    clean_text = re.sub(r'\d+\.?\d*', smart_replace_number, clean_text)
+    
+    # DEBUG: 驗證轉換結果
+    has_chinese_digits = any(c in clean_text for c in '零一二三四五六七八九十百千萬億點')
+    print(f"[DEBUG] After digit conversion - has Chinese digits: {has_chinese_digits}")
+    
+    print(f"[DEBUG] Voice text after cleaning (first 200 chars): {clean_text[:200]}")
+    
+    return clean_text
+
+def produce_news_audio(summary_text):
+    """
+    將新聞摘要製作成語音並上傳
+    返回: 音檔網址 (str) 或 None
+    """
+    clean_text = build_news_voice_text(summary_text)
+    # 相同的語音稿只合成、上傳一次
+    return tts_cache.audio_url(clean_text, NEWS_TTS_VOICE, TTS_AUDIO_CONFIG, synthesize_speech,
+                               upload_audio_to_external_host)
+
+# 每個新聞版本只產生一次摘要與語音，所有用戶共用（新聞更新時在背景預先產生）
+news_briefing = NewsBriefing(news_service, summarize_news_items, produce_news_audio,
+                             database=db if ADVANCED_FEATURES_ENABLED else None)
 
 
 def generate_image_with_imagen(prompt, user_id, base_image_path=None):
@@ -915,32 +1042,22 @@ def generate_image_with_imagen(prompt, user_id, base_image_path=None):
         tuple: (成功與否, 圖片路徑或錯誤訊息)
     """
     
-    # 1. 檢查配額 (若額度用盡，直接回傳 False 及錯誤訊息)
+    # 1. 預留配額 (若額度用盡，直接回傳 False 及錯誤訊息；失敗時退回)
     if user_id:
-        quota_ok, remain, quota_msg = check_image_quota(user_id)
+        quota_ok, remain, quota_msg = reserve_image_quota(user_id)
         if not quota_ok:
             return False, quota_msg
     
+    phases = {}  # 本次請求各階段耗時（秒）
     try:
-        # 初始化 Vertex AI
-        project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
-        location = "us-central1"
-        
-        aiplatform.init(project=project_id, location=location)
-        
         # 使用 Imagen 3 生成圖片
-        from vertexai.preview.vision_models import ImageGenerationModel, Image
+        from vertexai.preview.vision_models import Image
         import time
         
+        # Vertex AI 初始化與模型載入由 imagen_registry 在行程內共用（啟動時已在背景預先載入）
         # [Fix] Update to Imagen 3 (Imagen 2 is EOL)
-        # imagen-3.0-generate-001 or imagen-3.0-capability-001
-        model_name = "imagen-3.0-generate-001"
-            
-        try:
-            imagen_model = ImageGenerationModel.from_pretrained(model_name)
-        except Exception as e:
-             print(f"[IMAGEN] Failed to load {model_name}: {e}. Trying capability model...")
-             imagen_model = ImageGenerationModel.from_pretrained("imagen-3.0-capability-001")
+        # 依序嘗試 imagen-3.0-generate-001、imagen-3.0-capability-001，可用的模型會被記住
+        imagen_model = imagen_registry.generation_model(into=phases)
 
         # 優化提示詞（加入品質關鍵字）
         enhanced_prompt = f"{prompt}, high quality, detailed, vibrant colors"
@@ -960,31 +1077,34 @@ def generate_image_with_imagen(prompt, user_id, base_image_path=None):
                     base_img = Image.load_from_file(base_image_path)
                     try:
                         # [Fix] SDK Update: edit_images -> edit_image (Singular) for version 1.133+
-                        response = imagen_model.edit_image(
-                            prompt=prompt,
-                            base_image=base_img,
-                            number_of_images=1,
-                            # guidance_scale=15.0, # Optional
-                        )
+                        with imagen_registry.timed('edit', into=phases):
+                            response = imagen_model.edit_image(
+                                prompt=prompt,
+                                base_image=base_img,
+                                number_of_images=1,
+                                # guidance_scale=15.0, # Optional
+                            )
                         generated_image = response.images[0]
                     except Exception as edit_e:
                         print(f"[IMAGEN] edit_image failed: {edit_e}. Falling back to generate_images.")
                         # If edit_image fails, try generate_images as a fallback
-                        response = imagen_model.generate_images(
-                            prompt=enhanced_prompt,
-                            number_of_images=1,
-                            aspect_ratio="1:1",
-                        )
+                        with imagen_registry.timed('generate', into=phases):
+                            response = imagen_model.generate_images(
+                                prompt=enhanced_prompt,
+                                number_of_images=1,
+                                aspect_ratio="1:1",
+                            )
                         generated_image = response.images[0]
                 else:
                     # Text-to-Image (Generation) Mode
                     # ... (keep existing code)
                     print(f"[IMAGEN] Generating new image")
-                    response = imagen_model.generate_images(
-                        prompt=enhanced_prompt,
-                        number_of_images=1,
-                        aspect_ratio="1:1",
-                    )
+                    with imagen_registry.timed('generate', into=phases):
+                        response = imagen_model.generate_images(
+                            prompt=enhanced_prompt,
+                            number_of_images=1,
+                            aspect_ratio="1:1",
+                        )
                 
                 # ... (keep response handling)
                 if hasattr(response, 'images'):
@@ -999,12 +1119,11 @@ def generate_image_with_imagen(prompt, user_id, base_image_path=None):
                 # 儲存圖片
                 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
                 image_path = os.path.join(UPLOAD_FOLDER, f"{user_id}_generated_{int(time.time()*1000)}.png")
-                images[0].save(location=image_path)
+                with imagen_registry.timed('save', into=phases):
+                    images[0].save(location=image_path)
+                print("[IMAGEN] Timing: " + ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in phases.items()))
                 
-                # 生圖成功，扣除配額
-                if user_id:
-                    increment_image_quota(user_id)
-                    
+                # 生圖成功，保留已預留的配額
                 return (True, image_path)
 
             except Exception as e:
@@ -1025,7 +1144,7 @@ def generate_image_with_imagen(prompt, user_id, base_image_path=None):
                      
                      # 切換到 Imagen 3 (生成專用模型)
                      try:
-                         imagen_model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-001")
+                         imagen_model = imagen_registry.get("imagen-3.0-generate-001")
                          print("[IMAGEN] Successfully switched to Imagen 3")
                      except Exception as switch_e:
                          print(f"[IMAGEN] Failed to switch model: {switch_e}")
@@ -1047,6 +1166,9 @@ def generate_image_with_imagen(prompt, user_id, base_image_path=None):
     except Exception as e:
         error_str = str(e)
         print(f"Image generation error: {error_str}")
+        # 生圖失敗，退回預留的配額
+        if user_id:
+            release_image_quota(user_id)
         
         # 解析錯誤原因
         if "safety" in error_str.lower() or "policy" in error_str.lower():
@@ -1066,97 +1188,8 @@ def generate_image_with_imagen(prompt, user_id, base_image_path=None):
 
 
 def get_font_path(font_type):
-    """取得字體路徑，自動下載 Google Fonts (支援 Linux/Zeabur)"""
-    import os
-    import requests
-    
-    # 定義字體目錄
-    font_dir = os.path.join(os.getcwd(), "static", "fonts")
-    os.makedirs(font_dir, exist_ok=True)
-    
-    # 字體映射 (備份檔案邏輯 + 雲端支援)
-    # 優先檢查 Windows 本地字體 (開發環境)
-    # 使用微軟正黑體粗體 (msjhbd.ttc) 作為主要字體，解決字體過細問題
-    win_paths = {
-        'msjh': "C:\\Windows\\Fonts\\msjhbd.ttc",   # 改用粗體
-        'heiti': "C:\\Windows\\Fonts\\msjhbd.ttc",  # 改用粗體
-        'kaiti': "C:\\Windows\\Fonts\\msjhbd.ttc",  # 改用正黑體粗體 (因為標楷體 kaiu.ttf 太細)
-        'ming': "C:\\Windows\\Fonts\\mingliu.ttc"
-    }
-    
-    # 如果是 Windows 且檔案存在，直接回傳
-    if os.name == 'nt':
-        win_path = win_paths.get(font_type)
-        # 如果粗體不存在，退回一般體
-        if win_path and not os.path.exists(win_path):
-            win_path = win_path.replace("bd.ttc", ".ttc")
-            
-        if win_path and os.path.exists(win_path):
-            return win_path
-
-    # Linux/Cloud 環境：使用 Free Google Fonts (TTF)
-    # 使用 NotoSerifTC (楷體/明體替代品) 和 NotoSansTC (黑體替代品)
-    cloud_font_map = {
-        'kaiti': 'NotoSansTC-Bold.otf',  # 改用 NotoSansTC-Bold (因為 NotoSerifTC-Regular 太細)
-        'heiti': 'NotoSansTC-Bold.otf',
-        'ming': 'NotoSerifTC-Regular.otf',
-        'default': 'NotoSansTC-Regular.otf'
-    }
-    
-    # 這裡改用 Google Fonts 公開的其他穩定源，或者使用 Noto CJK 的 TTF 版本
-    # 為了避免 complex OTF 問題，我們改下載 .ttf (雖然 Noto TC 很多是 OTF, 但我們試試看能否找到 TTF 或 Variable Font)
-    # 更新：直接使用 Google Fonts 的 raw github 連結通常是 OTF (對於 CJK)。
-    # 錯誤 "unknown file format" 通常是因為下載下來的不是字體檔 (例如 404 HTML)。
-    # 我們改用一個更確定的 URL。
-    
-    target_filename = cloud_font_map.get(font_type, cloud_font_map['default'])
-    local_font_path = os.path.join(font_dir, target_filename)
-    
-    if os.path.exists(local_font_path):
-        return local_font_path
-        
-    print(f"[FONT] Downloading {target_filename} for cloud environment...")
-    
-    # 修正下載連結：確認這些連結是有效的 raw file
-    # Noto Sans TC (OFL)
-    base_url = "https://github.com/google/fonts/raw/main/ofl"
-    
-    # 對應表
-    # 改用更穩定的 CDN (jsdelivr via github)
-    # 使用 Google Fonts 的 raw github 連結通常是 OTF (對於 CJK)。
-    # 我們改用一個更確定的 URL (來自第三方穩定的字體託管，或直接指向 Google Fonts 指定 commit)
-    
-    urls = {
-        # 使用 Noto Sans TC Bold (Static) - 來自 Google Fonts repo 的特定 commit (確保文件存在)
-        'NotoSansTC-Bold.otf': "https://github.com/google/fonts/raw/main/ofl/notosanstc/NotoSansTC%5Bwght%5D.ttf", 
-        # 暫時維持 Variable Font, 但我們會用 Fake Bold 增強
-        'NotoSansTC-Regular.otf': "https://github.com/google/fonts/raw/main/ofl/notosanstc/NotoSansTC%5Bwght%5D.ttf",
-        'NotoSerifTC-Regular.otf': "https://github.com/google/fonts/raw/main/ofl/notoseriftc/NotoSerifTC%5Bwght%5D.ttf"
-    }
-    
-    # 因為我們改用 TTF，所以要把 local_font_path 的副檔名也改掉，避免混淆
-    local_font_path = local_font_path.replace(".otf", ".ttf")
-    
-    url = urls.get(target_filename)
-    if not url: return None
-    
-    try:
-        print(f"[FONT] Attempting to download from {url}...")
-        # 模擬瀏覽器 User-Agent 避免被阻擋
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        r = requests.get(url, headers=headers, timeout=30) 
-        
-        if r.status_code == 200 and len(r.content) > 1000: # 確保不是空的或錯誤頁面
-            with open(local_font_path, 'wb') as f:
-                f.write(r.content)
-            print(f"[FONT] Successfully downloaded {local_font_path}, size: {len(r.content)} bytes")
-            return local_font_path
-        else:
-            print(f"[FONT] Download failed. Code: {r.status_code}, Content-Type: {r.headers.get('Content-Type')}")
-        return None
-    except Exception as e:
-        print(f"[FONT] Download exception: {e}")
-        return None
+    """取得字體路徑（由 font_registry 解析並記住；雲端環境的字體於啟動時在背景下載）"""
+    return font_registry.path(font_type)
 
 # ======================
 # [Layer 3] Pixel Analysis: Find Best Text Region
@@ -1164,15 +1197,14 @@ def get_font_path(font_type):
 def find_best_text_region(img, candidate_positions, padding=40):
     """
     分析圖片各候選位置的留白面積，選出背景最乾淨（邊緣密度最低）的角落。
+    每個位置以區域內一整個網格的候選文字框評分（取最乾淨的文字框），
+    邊緣圖的積分影像每張圖只計算一次，每個文字框的分數都是 O(1)。
     
     回傳: (best_position: str, region: tuple(x, y, w, h))
     - best_position: 候選位置中背景最乾淨的那個
     - region: 該位置的可用矩形區域 (x, y, 寬, 高)
     """
     try:
-        from PIL import ImageFilter
-        import math
-        
         w, h = img.size
         # 每個位置對應的取樣矩形 (相對座標，以圖片比例定義)
         # 取每個角落/邊的 40% 範圍作為取樣區
@@ -1188,9 +1220,8 @@ def find_best_text_region(img, candidate_positions, padding=40):
             'center':       (int(w*0.25), int(h*0.25), int(w*0.75), int(h*0.75)),
         }
         
-        # 轉灰階，套用 FIND_EDGES 濾鏡以計算邊緣密度
-        gray = img.convert('L')
-        edge_img = gray.filter(ImageFilter.FIND_EDGES)
+        # 轉灰階、FIND_EDGES 濾鏡並建立積分影像（每張圖一次）
+        edge_map = EdgeDensityMap(img)
         
         best_pos = candidate_positions[0]
         best_score = float('inf')  # 越低越好（越空白）
@@ -1199,15 +1230,17 @@ def find_best_text_region(img, candidate_positions, padding=40):
             if pos not in region_map:
                 continue
             rx1, ry1, rx2, ry2 = region_map[pos]
-            region_crop = edge_img.crop((rx1, ry1, rx2, ry2))
-            pixels = list(region_crop.getdata())
-            if not pixels:
+            avg_edge = edge_map.density((rx1, ry1, rx2, ry2))
+            if avg_edge is None:
                 continue
-            # 平均邊緣強度：越低代表越空白
-            avg_edge = sum(pixels) / len(pixels)
-            print(f"[PIXEL] Position '{pos}' edge density: {avg_edge:.2f}")
-            if avg_edge < best_score:
-                best_score = avg_edge
+            # 區域內最乾淨的文字框 (寬高為區域的 TEXT_BOX_FRACTION)：越低代表越有整塊空白可以放字
+            box, box_edge = edge_map.best_box(int((rx2 - rx1) * TEXT_BOX_FRACTION), int((ry2 - ry1) * TEXT_BOX_FRACTION),
+                                              bounds=(rx1, ry1, rx2, ry2))
+            # 與整個區域的平均一起計分，避免選到區域內一大塊單色的主體
+            score = (avg_edge + box_edge) / 2
+            print(f"[PIXEL] Position '{pos}' edge density: {avg_edge:.2f}, cleanest text box {box}: {box_edge:.2f}, score={score:.2f}")
+            if score < best_score:
+                best_score = score
                 best_pos = pos
         
         # 計算最佳位置的可用區域 (加入 padding)
@@ -1219,7 +1252,7 @@ def find_best_text_region(img, candidate_positions, padding=40):
             max(1, ry2 - ry1 - padding * 2),  # 高
         )
         
-        print(f"[PIXEL] Best position: '{best_pos}' (edge density={best_score:.2f}), usable area={region[2]}x{region[3]}px")
+        print(f"[PIXEL] Best position: '{best_pos}' (score={best_score:.2f}), usable area={region[2]}x{region[3]}px")
         return best_pos, region
         
     except Exception as e:
@@ -1228,16 +1261,31 @@ def find_best_text_region(img, candidate_positions, padding=40):
         w, h = img.size
         return candidate_positions[0], (padding, padding, w - padding*2, h - padding*2)
 
-def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size=60, position='top', color='white', angle=0, stroke_width=12, stroke_color=None, decorations=None, text_style='gentle'):
+def create_meme_image(bg_image_path, text, user_id, *args, **kwargs):
+    """製作長輩圖並存檔，回傳檔案路徑（給需要路徑的流程使用；參數同 render_meme_image）"""
+    meme = render_meme_image(bg_image_path, text, user_id, *args, **kwargs)
+    if not meme:
+        return None
+    try:
+        return meme.save(os.path.join(UPLOAD_FOLDER, f"{user_id}_meme.png"))
+    except Exception as e:
+        print(f"Meme save error: {e}")
+        return None
+
+def render_meme_image(bg_image, text, user_id, font_type='kaiti', font_size=60, position='top', color='white', angle=0, stroke_width=12, stroke_color=None, decorations=None, text_style='gentle'):
     """製作長輩圖（創意版 - 支援彩虹、波浪、大小變化、描邊等效果 + 裝飾元素）
     text_style: 'wave'(波浪+小旋轉), 'gentle'(輕微波浪), 'straight'(完全水平)
+    bg_image 可為檔案路徑或 ImageHandle；回傳 ImageHandle（PNG 在上傳 / 存檔時才編碼），失敗回傳 None
     """
     try:
         import random
         import math
         
-        # 開啟背景圖片
-        img = Image.open(bg_image_path)
+        # 開啟背景圖片（ImageHandle 已解碼的影像為共用物件，先複製再修改）
+        if isinstance(bg_image, ImageHandle):
+            img = bg_image.image().copy()
+        else:
+            img = Image.open(bg_image)
         
         # 調整大小（如果太大）
         max_size = (800, 800)
@@ -1252,12 +1300,8 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
             font_path = get_font_path(font_type)
             if font_path:
                 try:
-                    base_font = ImageFont.truetype(font_path, font_size)
-                    # 嘗試設定 Variable Font 的粗體 (如果支援)
-                    try:
-                        base_font.set_variation_by_name('Bold')
-                    except:
-                        pass
+                    # 字體物件依 (路徑, 大小, 字重) 共用；Variable Font 設為粗體 (如果支援)
+                    base_font = font_registry.font(font_path, font_size, variation='Bold')
                 except Exception as e:
                     print(f"[FONT] Error loading specific font: {e}")
                     base_font = ImageFont.load_default()
@@ -1314,12 +1358,7 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
             def load_v_font(size):
                 try:
                     if v_font_path:
-                        f = ImageFont.truetype(v_font_path, size)
-                        try:
-                            f.set_variation_by_name('Bold')
-                        except:
-                            pass
-                        return f
+                        return font_registry.font(v_font_path, size, variation='Bold')
                 except:
                     pass
                 return ImageFont.load_default()
@@ -1370,9 +1409,7 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
 
             img = Image.alpha_composite(img, txt_layer_v)
             img = img.convert('RGB')
-            meme_path = os.path.join(UPLOAD_FOLDER, f"{user_id}_meme.png")
-            img.save(meme_path)
-            return meme_path
+            return ImageHandle.from_image(img, format='PNG')
         # ===================================================================
 
 
@@ -1407,7 +1444,7 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
             
             try:
                 calc_font_size = font_size + 8
-                calc_font = ImageFont.truetype(font_path, calc_font_size)
+                calc_font = font_registry.font(font_path, calc_font_size)
             except:
                 calc_font = base_font
                 
@@ -1485,7 +1522,7 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
             
         # 更新 base_font 為最終決定的 font_size
         try:
-            base_font = ImageFont.truetype(font_path, font_size)
+            base_font = font_registry.font(font_path, font_size)
         except:
             base_font = ImageFont.load_default()
             
@@ -1534,7 +1571,7 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
                 char_size = font_size + random.randint(-2, 2)
                 
                 try:
-                    char_font = ImageFont.truetype(font_path, char_size)
+                    char_font = font_registry.font(font_path, char_size)
                 except:
                     char_font = base_font
                 
@@ -1557,25 +1594,8 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
                 
                 char_real_y = current_y + wave_offset
                 
-                # 創建單字圖層 - 關鍵修復：加大畫布以防文字裁切 (Glyph Truncation)
-                char_bbox = txt_draw.textbbox((0, 0), char, font=char_font)
-                raw_w = char_bbox[2] - char_bbox[0]
-                raw_h = char_bbox[3] - char_bbox[1]
-                
-                # 畫布大小：字寬的 3 倍，加上超大緩衝，確保旋轉也不會切到
-                canvas_w = int(raw_w * 3 + 100)
-                canvas_h = int(raw_h * 3 + 100)
-                
-                char_layer = Image.new('RGBA', (canvas_w, canvas_h), (255, 255, 255, 0))
-                cd = ImageDraw.Draw(char_layer)
-                
-                # 計算中心點
-                center_x, center_y = canvas_w // 2, canvas_h // 2
-                # 由於 draw.text 的座標是左上角，我們需要 offset
-                # 簡單置中：減去字寬字高的一半
-                text_x = center_x - (raw_w / 2)
-                text_y = center_y - (raw_h / 2)
-                
+                # 繪製步驟 (x偏移, y偏移, 填色, 描邊寬度, 描邊顏色)：未旋轉的字直接畫到文字圖層，
+                # 旋轉的字才使用快取的小圖塊並只旋轉小圖塊 (不再為每個字建立大畫布)
                 # 描邊處理 (AI 決定)
                 if stroke_width > 0:
                     effective_stroke_color = stroke_color if stroke_color else '#000000'
@@ -1586,41 +1606,28 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
                         # 強力加粗邏輯 (Double-Pass Rendering)
                         # 1. 計算加粗量 (介於中間值，約字體大小的 1/28，例如 100px -> 3px)
                         bold_sim_width = max(1, int(font_size / 28))
-                        
-                        # 2. 繪製底部輪廓 (總寬度 = 用戶描邊 + 加粗量)
-                        # Pass 1: Draw Thick Outline (Border + Boldness)
-                        cd.text((text_x, text_y), char, font=char_font, fill=char_color, 
-                               stroke_width=stroke_width + bold_sim_width, stroke_fill=effective_stroke_color)
-                               
-                        # 3. 繪製文字本體 (加粗量) -> 這會讓白色部分變粗，蓋掉內縮的黑色描邊
-                        # Pass 2: Draw Thick Body (Boldness)
-                        cd.text((text_x, text_y), char, font=char_font, fill=char_color, 
-                               stroke_width=bold_sim_width, stroke_fill=char_color)
-                               
+                        glyph_passes = (
+                            # Pass 1: Draw Thick Outline (Border + Boldness) 底部輪廓 (總寬度 = 用戶描邊 + 加粗量)
+                            (0, 0, char_color, stroke_width + bold_sim_width, effective_stroke_color),
+                            # Pass 2: Draw Thick Body (Boldness) 文字本體 -> 讓白色部分變粗，蓋掉內縮的黑色描邊
+                            (0, 0, char_color, bold_sim_width, char_color),
+                        )
                     else:
                         # Windows 環境或字體夠粗，直接標準描邊
-                        cd.text((text_x, text_y), char, font=char_font, fill=char_color, stroke_width=stroke_width, stroke_fill=effective_stroke_color)
+                        glyph_passes = ((0, 0, char_color, stroke_width, effective_stroke_color),)
                 else:
                     # 預設陰影 (如果沒描邊)
-                    cd.text((text_x + 3, text_y + 3), char, font=char_font, fill='#00000088')
-                    cd.text((text_x, text_y), char, font=char_font, fill=char_color)
+                    glyph_passes = ((3, 3, '#00000088', 0, None), (0, 0, char_color, 0, None))
                 
-                # 旋轉
+                # 旋轉中心：字框中心 (與原本以單字畫布中心旋轉相同)
+                pivot = None
                 if abs(char_angle) > 0.5:
-                    char_layer = char_layer.rotate(char_angle, expand=False, resample=Image.Resampling.BICUBIC)
+                    char_bbox = txt_draw.textbbox((0, 0), char, font=char_font)
+                    pivot = (current_x + (char_bbox[2] - char_bbox[0]) / 2,
+                             char_real_y + (char_bbox[3] - char_bbox[1]) / 2)
                 
-                # 貼上 - 需要計算從 center 回推到 top-left 的位置
-                # 我們原本的 current_x 是希望文字出現的位置 (大約左側)
-                # 貼上的位置應該是 current_x - (canvas_w - raw_w)/2 這樣... 比較複雜
-                # 簡化：我們知道 char_layer 的中心就是文字中心
-                # 目標中心點： current_x + raw_w/2, char_real_y + raw_h/2
-                target_center_x = current_x + (raw_w / 2)
-                target_center_y = char_real_y + (raw_h / 2)
-                
-                paste_x = int(target_center_x - (canvas_w / 2))
-                paste_y = int(target_center_y - (canvas_h / 2))
-                
-                txt_layer.paste(char_layer, (paste_x, paste_y), char_layer)
+                glyph_atlas.draw(txt_layer, (current_x, char_real_y), char, char_font, glyph_passes,
+                                 angle=char_angle, pivot=pivot)
                 
                 current_x += char_ws[i]
             
@@ -1662,7 +1669,7 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
                         # 嘗試找emoji字體（Noto Color Emoji或系統emoji字體）
                         emoji_font_path = get_font_path('heiti')  # 使用heiti作為備選
                         if emoji_font_path:
-                            emoji_font = ImageFont.truetype(emoji_font_path, deco_size)
+                            emoji_font = font_registry.font(emoji_font_path, deco_size)
                         else:
                             emoji_font = ImageFont.load_default()
                     except:
@@ -1689,11 +1696,8 @@ def create_meme_image(bg_image_path, text, user_id, font_type='kaiti', font_size
         img = Image.alpha_composite(img, txt_layer)
         img = img.convert('RGB')
         
-        # 儲存
-        meme_path = os.path.join(UPLOAD_FOLDER, f"{user_id}_meme.png")
-        img.save(meme_path)
-        
-        return meme_path
+        # 不寫入磁碟：由呼叫端直接上傳（或以 create_meme_image 存檔）
+        return ImageHandle.from_image(img, format='PNG')
     except Exception as e:
         print(f"Meme creation error: {e}")
         import traceback
@@ -1871,14 +1875,14 @@ CRITICAL RULES:
 def edit_image_with_gemini(edit_prompt, user_id, image_path1, image_path2=None):
     """使用 Gemini 2.5 Flash 進行圖片修改或融合，自帶配額防護。"""
     if user_id:
-        quota_ok, remain, quota_msg = check_image_quota(user_id)
+        quota_ok, remain, quota_msg = reserve_image_quota(user_id)
         if not quota_ok:
             return False, quota_msg
             
     success, result = gemini_edit_image_internal(edit_prompt, user_id, image_path1, image_path2)
     
-    if success and user_id:
-        increment_image_quota(user_id)
+    if not success and user_id:
+        release_image_quota(user_id)
         
     return success, result
 
@@ -1966,51 +1970,24 @@ def transcribe_audio_with_gemini(audio_path, model_to_use=None):
         return None
 
 def text_to_speech(text, user_id):
-    """文字轉語音"""
-    try:
-        global tts_client
-        if tts_client is None:
-            tts_client = texttospeech.TextToSpeechClient()
-        client = tts_client
-        
-        synthesis_input = texttospeech.SynthesisInput(text=text)
-        
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="zh-TW",
-            name="zh-TW-Wavenet-A",
-        )
-        
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
-        )
-        
-        response = client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
-        )
-        
-        # 儲存音訊檔案
-        audio_path = os.path.join(UPLOAD_FOLDER, f"{user_id}_reply.mp3")
-        with open(audio_path, "wb") as out:
-            out.write(response.audio_content)
-        
-        return audio_path
-    except Exception as e:
-        print(f"Text-to-speech error: {e}")
-        return None
+    """文字轉語音（相同文字直接使用快取的音檔；音檔由 tts_cache 管理，請勿刪除）"""
+    return tts_cache.synthesize(text, REPLY_TTS_VOICE, TTS_AUDIO_CONFIG, synthesize_speech)
 
-def upload_image_to_external_host(image_path):
+def upload_image_to_external_host(image, content_type="image/png", ext=".png"):
     """
     上傳圖片到外部主機(如 Imgur 或 imgbb)並取得公開 URL
     LINE 要求圖片必須是 HTTPS URL
+    image 可為檔案路徑或記憶體中的圖片 bytes（格式由 content_type / ext 指定）
     """
     try:
         # 優先嘗試上傳到 Google Cloud Storage (如果已啟用)
         if ADVANCED_FEATURES_ENABLED and gcs_utils:
             try:
                 print("Attempting to upload image to GCS...")
-                public_url = gcs_utils.upload_image_to_gcs(image_path)
+                if isinstance(image, (bytes, bytearray)):
+                    public_url = gcs_utils.upload_bytes(image, ext, content_type=content_type)
+                else:
+                    public_url = gcs_utils.upload_image_to_gcs(image)
                 if public_url:
                     print(f"Image uploaded to GCS: {public_url}")
                     return public_url
@@ -2018,36 +1995,87 @@ def upload_image_to_external_host(image_path):
                 print(f"GCS upload failed: {e}")
                 #如果 GCS 失敗，嘗試 fallback 到 Imgur
         
-        # 使用 imgbb API（免費，不需註冊）
-        # 注意：生產環境建議使用自己的圖床服務
-        api_key = os.environ.get("IMGBB_API_KEY", "")
+        return _upload_to_imgbb(image, ext)
+    except Exception as e:
+        print(f"Image upload error: {e}")
+        return None
+
+def upload_audio_to_external_host(audio_path):
+    """
+    上傳音檔（MP3）到 GCS 並取得公開 URL
+    imgbb 只接受圖片，音檔不走備援；GCS 無法使用時回傳 None
+    """
+    if not (ADVANCED_FEATURES_ENABLED and gcs_utils):
+        print("Audio upload requires GCS, which is disabled")
+        return None
+    try:
+        public_url = gcs_utils.upload_audio_to_gcs(audio_path)
+        if public_url:
+            print(f"Audio uploaded to GCS: {public_url}")
+        return public_url
+    except Exception as e:
+        print(f"Audio upload error: {e}")
+        return None
+
+def _upload_to_imgbb(image, ext=".png"):
+    """上傳到 imgbb（GCS 無法使用時的備援）；image 可為檔案路徑或 bytes"""
+    # 使用 imgbb API（免費，不需註冊）
+    # 注意：生產環境建議使用自己的圖床服務
+    api_key = os.environ.get("IMGBB_API_KEY", "")
+    
+    if not api_key:
+        print("Warning: IMGBB_API_KEY not set, image sending may fail. And GCS upload also failed or is disabled.")
+        return None
+    
+    try:
+        url = "https://api.imgbb.com/1/upload"
+        payload = {
+            "key": api_key,
+        }
+        # 檔案串流無法重送，POST 不自動重試
+        if isinstance(image, (bytes, bytearray)):
+            response = http_client.post(url, data=payload, files={"image": ("image" + ext, bytes(image))}, timeout=60)
+        else:
+            with open(image, "rb") as file:
+                response = http_client.post(url, data=payload, files={"image": file}, timeout=60)
         
-        if not api_key:
-            print("Warning: IMGBB_API_KEY not set, image sending may fail. And GCS upload also failed or is disabled.")
+        if response.status_code == 200:
+            data = response.json()
+            return data["data"]["url"]
+        else:
+            print(f"Imgur/ImgBB upload failed: {response.text}")
             return None
-        
-        with open(image_path, "rb") as file:
-            url = "https://api.imgbb.com/1/upload"
-            payload = {
-                "key": api_key,
-            }
-            files = {
-                "image": file,
-            }
-            response = requests.post(url, data=payload, files=files)
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data["data"]["url"]
-            else:
-                print(f"Imgur/ImgBB upload failed: {response.text}")
-                return None
     except Exception as e:
         print(f"Image upload error: {e}")
         return None
 
 def send_image_to_line(user_id, image_path, message_text="", reply_token=None):
-    """傳送圖片到 LINE(優先使用 reply_message 節省額度, 沒有 token 時用 push_message)"""
+    """傳送圖片到 LINE(優先使用 reply_message 節省額度, 沒有 token 時用 push_message)
+    image_path 可為檔案路徑或 ImageHandle（記憶體中的圖片直接上傳，不經過磁碟）
+    """
+    # 轉成符合 LINE 規格的 JPEG 原圖與預覽小圖（聊天室只下載預覽）；失敗時沿用原檔，預覽與原圖共用網址
+    preview = None
+    try:
+        original, preview = line_image_encoder.encode(image_path)
+        upload_source, content_type, ext = original.data, original.content_type, original.ext
+    except Exception as e:
+        print(f"[SEND IMAGE] LINE image encoding failed: {e}, sending the original file")
+        if isinstance(image_path, ImageHandle):
+            upload_source, content_type, ext = image_path.data, image_path.content_type, image_path.ext
+        else:
+            upload_source, content_type, ext = image_path, "image/png", ".png"
+
+    # GCS 可用時先在背景同時上傳原圖與預覽圖，同時檢查待讀取通知
+    upload_started = time.monotonic()
+    upload_future = preview_future = None
+    if ADVANCED_FEATURES_ENABLED and gcs_utils:
+        try:
+            upload_future = gcs_utils.upload_async(upload_source, content_type=content_type, ext=ext)
+            if preview:
+                preview_future = gcs_utils.upload_async(preview.data, content_type=preview.content_type, ext=preview.ext)
+        except Exception as e:
+            print(f"[SEND IMAGE] Background upload not started: {e}")
+    
     # ============================================
     # GLOBAL: Passive Notification Check
     # ============================================
@@ -2076,8 +2104,25 @@ def send_image_to_line(user_id, image_path, message_text="", reply_token=None):
     try:
         print(f"[SEND IMAGE] Starting for user {user_id}, image: {image_path}")
         
-        # 上傳圖片並取得公開 URL
-        image_url = upload_image_to_external_host(image_path)
+        # 上傳圖片並取得公開 URL（背景上傳失敗時改用 imgbb；預覽圖失敗時沿用原圖網址）
+        image_url = preview_url = None
+        if upload_future:
+            try:
+                image_url = upload_future.result(timeout=120)
+            except Exception as e:
+                print(f"[SEND IMAGE] Background upload failed: {e}")
+            if preview_future:
+                try:
+                    preview_url = preview_future.result(timeout=120)
+                except Exception as e:
+                    print(f"[SEND IMAGE] Preview upload failed: {e}")
+            if image_url and preview_url:
+                line_image_encoder.record_upload(time.monotonic() - upload_started)
+            if not image_url:
+                image_url = _upload_to_imgbb(upload_source, ext)
+        else:
+            image_url = upload_image_to_external_host(upload_source, content_type, ext)
+        preview_url = preview_url or image_url
         
         if not image_url:
             print("[SEND IMAGE] FAILED: upload_image_to_external_host returned None")
@@ -2093,7 +2138,7 @@ def send_image_to_line(user_id, image_path, message_text="", reply_token=None):
             # Fixed Order: Image FIRST, Text SECOND (用戶要求先傳圖片再傳文字)
             messages.append(ImageMessage(
                 original_content_url=image_url,
-                preview_image_url=image_url
+                preview_image_url=preview_url
             ))
             
             if message_text:
@@ -2182,6 +2227,52 @@ def send_status_notification(reply_token, status_text):
         return False
 
 
+# ======================
+# Webhook 事件背景處理
+# ======================
+# Webhook 驗證簽章後立即回 200，事件交給背景執行緒處理：
+# 同一用戶的事件依序執行，不同用戶平行處理；每個事件結束後寫回用戶狀態
+from event_executor import KeyedExecutor, QueueFullError
+import atexit
+import hmac
+import threading
+
+def after_event():
+    """每個事件處理完畢後：寫回用戶狀態，並把本次的對話輪次交給 chat_history 批次寫入"""
+    state_store.flush()
+    chat_memory.commit_touched()
+
+event_executor = KeyedExecutor(after_task=after_event)
+# atexit 依註冊的相反順序執行：先等事件處理完，再把記憶體中的對話寫入 chat_history
+atexit.register(chat_memory.shutdown)
+atexit.register(event_executor.shutdown)
+
+def get_event_key(event):
+    """事件分流用的 key（同一個 key 的事件依序處理）"""
+    source = getattr(event, 'source', None)
+    for attr in ('user_id', 'group_id', 'room_id'):
+        value = getattr(source, attr, None)
+        if value:
+            return value
+    return '_unknown'
+
+# callback 呼叫 handler.handle() 期間，on_line_event 註冊的函式只收集事件，解析完再一次排入佇列
+_webhook_batch = threading.local()
+
+def on_line_event(event_type, message=None):
+    """與 @handler.add 相同，但處理函式改在背景佇列執行（同一用戶依序處理）"""
+    def decorator(func):
+        def enqueue(event):
+            task = (get_event_key(event), func, (event,), {})
+            batch = getattr(_webhook_batch, 'tasks', None)
+            if batch is None:
+                event_executor.submit_many([task])
+            else:
+                batch.append(task)
+        handler.add(event_type, message=message)(enqueue)
+        return func
+    return decorator
+
 # ======================
 # Webhook Handlers
 # ======================
@@ -2190,6 +2281,38 @@ def send_status_notification(reply_token, status_text):
 def health_check():
     return "OK", 200
 
+# /stats 需帶 Authorization: Bearer <STATS_TOKEN>；未設定 STATS_TOKEN 時不開放
+STATS_TOKEN = os.environ.get("STATS_TOKEN", "")
+
+@app.route("/stats")
+def stats():
+    """執行狀態統計（監控用）"""
+    if not STATS_TOKEN:
+        abort(404)
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {STATS_TOKEN}".encode()):
+        abort(401)
+    data = {'state': state_store.stats(), 'chat_sessions': chat_memory.stats()}
+    if db:
+        data['db_pool'] = db.get_pool_stats()
+    data['event_queue'] = event_executor.stats()
+    data['intent'] = intent_engine.stats()
+    data['llm_cache'] = llm_cache.stats()
+    if maps:
+        data['maps_cache'] = maps.cache.stats()
+    if ADVANCED_FEATURES_ENABLED and gcs_utils:
+        data['gcs'] = gcs_utils.upload_stats()
+    data['http'] = http_client.stats()
+    data['news'] = news_service.stats()
+    data['news_briefing'] = news_briefing.stats()
+    data['tts_cache'] = tts_cache.stats()
+    data['imagen'] = imagen_registry.stats()
+    data['fonts'] = font_registry.stats()
+    data['glyphs'] = glyph_atlas.stats()
+    data['images'] = image_store.stats()
+    data['line_images'] = line_image_encoder.stats()
+    return jsonify(data), 200
+
 @app.route("/callback", methods=["POST"])
 def callback():
     # get X-Line-Signature header value
@@ -2198,14 +2321,24 @@ def callback():
     body = request.get_data(as_text=True)
     app.logger.info("Request body: " + body)
     
-    # parse webhook body
+    # handle webhook body（驗證簽章與解析；on_line_event 只收集事件，交給背景執行）
+    _webhook_batch.tasks = tasks = []
     try:
         handler.handle(body, signature)
     except InvalidSignatureError:
         abort(400)
+    finally:
+        _webhook_batch.tasks = None
+
+    try:
+        event_executor.submit_many(tasks)
+    except QueueFullError as e:
+        # 佇列已滿：回 503 讓 LINE 稍後重送，整批事件都不會被處理
+        print(f"[WEBHOOK] {e}")
+        return "Busy", 503
     return "OK"
 
-@handler.add(MessageEvent, message=TextMessageContent)
+@on_line_event(MessageEvent, message=TextMessageContent)
 def message_text(event):
     user_id = event.source.user_id
     print(f"==============================")
@@ -2482,8 +2615,7 @@ def message_text(event):
                     reply_text = "抱歉，我無法讀取這個網頁的內容。可能是網站有防護機制或連結已失效。"
                 
                 # [NEW] 將查證結果存入記憶，讓用戶可以追問
-                if user_id not in chat_sessions: chat_sessions[user_id] = model.start_chat(history=[])
-                chat = chat_sessions[user_id]
+                chat = chat_memory.get_session(user_id)
                 chat.history.append({'role': 'user', 'parts': [f"請幫我閱讀這個連結：{pending_url}"]})
                 chat.history.append({'role': 'model', 'parts': [reply_text]})
 
@@ -2551,8 +2683,7 @@ def message_text(event):
                     reply_text = f"{analysis.text}"
                 
                 # [NEW] 將查證結果存入記憶，讓用戶可以追問
-                if user_id not in chat_sessions: chat_sessions[user_id] = model.start_chat(history=[])
-                chat = chat_sessions[user_id]
+                chat = chat_memory.get_session(user_id)
                 chat.history.append({'role': 'user', 'parts': [f"請幫我查證這個連結：{pending_url}"]})
                 chat.history.append({'role': 'model', 'parts': [reply_text]})
 
@@ -2681,210 +2812,33 @@ def message_text(event):
         # 檢查是否是要語音播報 (這裡是既有邏輯，保留作為 fallback)
         # 檢查是否是要語音播報
         if user_id in user_news_cache and any(keyword in user_input for keyword in ['語音', '播報', '聽', '念', '讀']):
-            # 使用 Pro 模型重新生成語音專用文字（保留數字）
-            print("[VOICE] Generating TTS text with Pro model for number preservation...")
-            
-            try:
-                # 使用 Pro 模型重新處理，確保數字被保留
-                voice_prompt = f"""將以下新聞改寫為適合語音播報的純文字。
-                
-重要規則：
-1. 必須保留所有日期和數字（如：4日、100萬、2月9日）
-2. 移除所有標點符號和表情符號
-3. 用口語化的方式表達
-4. 每則新聞約50字
-5. 每則新聞開頭必須以「第一則、第二則、第三則...」等方式唸出則數，例如：「第一則。台灣...」
-
-原始新聞：
-{user_news_cache[user_id][:2000]}
-
-直接輸出語音稿，不要加任何解釋。"""
-
-                model_pro = genai.GenerativeModel(
-                    model_name="gemini-2.5-pro",
-                    system_instruction="你是專業新聞播報員，必須精準保留所有日期與數字。"
-                )
-                response = model_pro.generate_content(voice_prompt)
-                news_text = response.text.strip()
-                print(f"[VOICE PRO] Generated text with numbers preserved: {news_text[:100]}...")
-            except Exception as e:
-                print(f"[VOICE] Pro model failed, using cached text: {e}")
-                news_text = user_news_cache[user_id]
-            
-            # 清理文字（TTS 專用）- 重要：保留內容數字
-            import re
-            
-            # 步驟 1：先移除 URL（包含 URL 中的數字）
-            clean_text = re.sub(r'https?://[^\s]+', '', news_text)
-            clean_text = re.sub(r'www\.[^\s]+', '', clean_text)
-            
-            # 步驟 2：移除「來源：」後面的所有內容（通常是 URL 或網站名）
-            clean_text = re.sub(r'來源：[^\n]*', '', clean_text)
-            
-            # 步驟 3：移除特定 emoji 符號（不使用 emoji 數字字符，避免誤刪普通數字）
-            # 改用 unicode 移除常見表情符號
-            emoji_pattern = re.compile("["
-                u"\U0001F600-\U0001F64F"  # emoticons
-                u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                u"\U0001F1E0-\U0001F1FF"  # flags
-                u"\U00002702-\U000027B0"  # dingbats
-                u"\U0001F4A0-\U0001F4FF"  # 其他符號
-                "]+", flags=re.UNICODE)
-            clean_text = emoji_pattern.sub('', clean_text)
-            # 移除中括號等標記
-            clean_text = re.sub(r'[【】🔗💡📰🔊]', '', clean_text)
-            
-            # 步驟 4：移除標題文字
-            clean_text = clean_text.replace('今日新聞摘要', '').replace('想聽語音播報？回覆「語音」即可', '').strip()
-            
-            # DEBUG: 檢查數字保留情況
-            has_digits_before = bool(re.search(r'\d', clean_text))
-            print(f"[DEBUG] Before digit conversion - has digits: {has_digits_before}")
-            if has_digits_before:
-                digit_sample = re.findall(r'\d+', clean_text)[:5]
-                print(f"[DEBUG] Sample digits found: {digit_sample}")
-            
-            # 步驟 5：將日期格式 X/Y 轉換為 X月Y日
-            clean_text = re.sub(r'(\d{1,2})/(\d{1,2})', r'\1月\2日', clean_text)
-            
-            # 步驟 6：完整的中文數字轉換（含位數單位）
-            def num_to_chinese(num_str):
-                """將阿拉伯數字轉為中文（含單位）"""
-                digit_map = {'0': '零', '1': '一', '2': '二', '3': '三', '4': '四', 
-                             '5': '五', '6': '六', '7': '七', '8': '八', '9': '九'}
-                
-                # 處理小數
-                if '.' in num_str:
-                    parts = num_str.split('.')
-                    integer_part = num_to_chinese(parts[0])
-                    decimal_part = ''.join(digit_map.get(d, d) for d in parts[1])
-                    return f"{integer_part}點{decimal_part}"
-                
-                # 處理整數
-                num = int(num_str)
-                if num == 0:
-                    return '零'
-                
-                units = ['', '十', '百', '千', '萬', '十萬', '百萬', '千萬', '億']
-                result = []
-                
-                # 億位
-                if num >= 100000000:
-                    result.append(digit_map[str(num // 100000000)])
-                    result.append('億')
-                    num %= 100000000
-                    if num > 0 and num < 10000000:
-                        result.append('零')
-                
-                # 萬位
-                if num >= 10000:
-                    wan = num // 10000
-                    if wan >= 10:
-                        result.append(num_to_chinese(str(wan)))
-                    else:
-                        result.append(digit_map[str(wan)])
-                    result.append('萬')
-                    num %= 10000
-                    if num > 0 and num < 1000:
-                        result.append('零')
-                
-                # 千位
-                if num >= 1000:
-                    result.append(digit_map[str(num // 1000)])
-                    result.append('千')
-                    num %= 1000
-                    if num > 0 and num < 100:
-                        result.append('零')
-                
-                # 百位
-                if num >= 100:
-                    result.append(digit_map[str(num // 100)])
-                    result.append('百')
-                    num %= 100
-                    if num > 0 and num < 10:
-                        result.append('零')
-                
-                # 十位
-                if num >= 10:
-                    tens = num // 10
-                    if tens != 1 or len(result) > 0:  # 避免 "一十" 只說 "十"
-                        result.append(digit_map[str(tens)])
-                    result.append('十')
-                    num %= 10
-                
-                # 個位
-                if num > 0:
-                    result.append(digit_map[str(num)])
-                
-                return ''.join(result)
-            
-            # 替換所有數字（包括小數）
-            def replace_number(match):
-                return num_to_chinese(match.group(0))
-            
-            # 步驟 7：處理百分比（23% → 百分之二十三）
-            def replace_percent(match):
-                num = match.group(1)
-                chinese_num = num_to_chinese(num)
-                return f"百分之{chinese_num}"
-            clean_text = re.sub(r'(\d+\.?\d*)%', replace_percent, clean_text)
-            
-            # 步驟 8：跳過字母數字混合碼（如 M1A2T, F-16, A380）
-            # 讓 TTS 直接唸英文字母和數字
-            alphanumeric_pattern = r'[A-Za-z][\dA-Za-z-]*\d[\dA-Za-z-]*|[A-Za-z]+-\d+'
-            
-            # 只轉換「純數字」，跳過字母數字混合
-            def smart_replace_number(match):
-                num_str = match.group(0)
-                # 檢查前後是否有字母
-                start = match.start()
-                end = match.end()
-                text = match.string
-                # 如果前面或後面有字母，不轉換
-                if (start > 0 and text[start-1].isalpha()) or (end < len(text) and text[end].isalpha()):
-                    return num_str  # 保持原樣
-                return num_to_chinese(num_str)
-            
-            clean_text = re.sub(r'\d+\.?\d*', smart_replace_number, clean_text)
-            
-            # DEBUG: 驗證轉換結果
-            has_chinese_digits = any(c in clean_text for c in '零一二三四五六七八九十百千萬億點')
-            print(f"[DEBUG] After digit conversion - has Chinese digits: {has_chinese_digits}")
-            
-            print(f"[DEBUG] Voice text after cleaning (first 200 chars): {clean_text[:200]}")
-            
-            audio_path = generate_news_audio(clean_text, user_id)
+            cached = user_news_cache[user_id]
+            if isinstance(cached, dict):
+                # 共用摘要：同一版本的語音只合成、上傳一次，所有用戶共用
+                audio_url = news_briefing.audio_url(cached.get('version'))
+            else:
+                # 個人化（或舊格式）的摘要：單獨產生語音
+                audio_url = produce_news_audio(cached)
             
-            if audio_path:
-                # 上傳音檔並發送（不發送文字訊息以節省額度）
-                try:
-                    audio_url = upload_image_to_external_host(audio_path)
-                    
-                    with ApiClient(configuration) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[
-                                    AudioMessage(
-                                        original_content_url=audio_url,
-                                        duration=60000  # LINE 顯示問題，實際播放不受影響
-                                    )
-                                ]
-                            )
+            if audio_url:
+                # 發送音檔（不發送文字訊息以節省額度）
+                with ApiClient(configuration) as api_client:
+                    line_bot_api = MessagingApi(api_client)
+                    line_bot_api.reply_message(
+                        ReplyMessageRequest(
+                            reply_token=event.reply_token,
+                            messages=[
+                                AudioMessage(
+                                    original_content_url=audio_url,
+                                    duration=60000  # LINE 顯示問題，實際播放不受影響
+                                )
+                            ]
                         )
-                    
-                    # 成功發送後刪除本地檔案（節省空間）
-                    try:
-                        os.remove(audio_path)
-                        print(f"[CLEANUP] Deleted local audio file: {audio_path}")
-                    except Exception as e:
-                        print(f"[CLEANUP] Failed to delete audio file: {e}")
-                    return
-                except Exception as e:
-                    print(f"Audio upload error: {e}")
-                    reply_text = "抱歉，語音播報生成失敗。請稍後再試！"
+                    )
+                return
+            if isinstance(cached, dict) and not news_briefing.get(cached.get('version')):
+                # 用戶看到的版本已被新版取代：不播放內容不同的新版語音
+                reply_text = "新聞已經更新了，請再說一次「看新聞」，我再唸最新的給您聽！📢"
             else:
                 reply_text = "抱歉，語音播報生成失敗。請稍後再試！"
             
@@ -2898,11 +2852,12 @@ def message_text(event):
                 )
             return
         
-        # 生成新聞摘要
-        news_summary = generate_news_summary()
+        # 生成新聞摘要（同一版本所有用戶共用）
+        news_summary, news_version = generate_news_summary()
         
-        # 儲存到快取（用於後續語音播報）
-        user_news_cache[user_id] = news_summary
+        # 記錄用戶看到的新聞版本（用於後續語音播報）；共用摘要不必每位用戶各存一份
+        if news_version:
+            user_news_cache[user_id] = {'version': news_version}
         
         with ApiClient(configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
@@ -2949,7 +2904,63 @@ def message_text(event):
             pass
 
 
-@handler.add(MessageEvent, message=ImageMessageContent)
+# 圖片批次回覆：等待多久沒有新圖片才回覆 / 第一張起最多等待多久
+IMAGE_BATCH_DELAY = 2.0
+IMAGE_BATCH_MAX_WAIT = 10.0
+
+def reply_image_batch(user_id, batch):
+    """批次到期後，統一描述這批圖片並用最後一個 reply_token 回覆（batch: [(image_path, reply_token), ...]）"""
+    try:
+        # [Fix] 只描述當前批次的圖片，而不是歷史圖片
+        images_to_describe = [path for path, _ in batch]
+        saved_token = batch[-1][1]
+        if not images_to_describe or not saved_token:
+            return
+        
+        # 用 Gemini Vision 統一描述所有圖片
+        try:
+            # 最多描述最近5張 (批次內)
+            recent = images_to_describe[-5:]
+            img_objects = []
+            for p in recent:
+                try:
+                    img_objects.append(PIL.Image.open(p))
+                except:
+                    pass
+            
+            if len(img_objects) == 1:
+                vision_prompt = "請用繁體中文描述這張圖片的內容，保持簡短生動（不超過100字）。描述完後，直接說「我已經記得這張圖片了！」"
+                vision_response = model.generate_content([vision_prompt, img_objects[0]])
+            else:
+                count = len(img_objects)
+                labels = "\n".join([f"📸 第{i+1}張：..." for i in range(count)])
+                vision_prompt = f"請用繁體中文分別簡短描述這{count}張圖片的內容（每張不超過40字），格式為：\n{labels}\n描述完後，說「我已經記得這{count}張圖片了！」"
+                vision_response = model.generate_content([vision_prompt] + img_objects)
+            
+            finish_message = vision_response.text
+            if '加油' not in finish_message:
+                finish_message += "\n\n加油！Cheer up！讚啦！"
+        except:
+            count = len(images_to_describe)
+            if count > 1:
+                finish_message = f"我已經記得這{count}張圖片了！\n\n加油！Cheer up！讚啦！"
+            else:
+                finish_message = "我已經記得這張圖片了！\n\n加油！Cheer up！讚啦！"
+        
+        # 用最後一個 reply_token 回覆
+        with ApiClient(configuration) as api_client:
+            line_bot_api = MessagingApi(api_client)
+            line_bot_api.reply_message_with_http_info(
+                ReplyMessageRequest(
+                    reply_token=saved_token,
+                    messages=[TextMessage(text=finish_message)],
+                )
+            )
+        print(f"[IMAGE_BATCH] Replied for {user_id} with {len(images_to_describe)} image(s)")
+    except Exception as e:
+        print(f"[IMAGE_BATCH] Error: {e}")
+
+@on_line_event(MessageEvent, message=ImageMessageContent)
 def message_image(event):
     global user_images
     user_id = event.source.user_id
@@ -2973,16 +2984,15 @@ def message_image(event):
             # 為每個用戶建立獨立的圖片檔案（用時間戳區分多張）
             import time as _time
             image_filename = f"{user_id}_image_{int(_time.time()*1000)}.jpg"
-            image_path = os.path.join(UPLOAD_FOLDER, image_filename)
             
-            with open(image_path, 'wb') as f:
-                f.write(message_content)
+            # 只寫入一次（之後的訊息可能由其他 worker 處理）；同一個 worker 之後直接使用記憶體中的圖片
+            image_handle = ImageHandle.from_bytes(message_content)
+            image_path = image_handle.save(os.path.join(UPLOAD_FOLDER, image_filename))
+            image_store.put(image_handle)
         
         # 檢查是否在長輩圖製作流程中 (等待背景圖)
         if user_id in user_meme_state and user_meme_state[user_id].get('stage') == 'waiting_bg':
-             with open(image_path, 'rb') as f:
-                 image_data = f.read()
-             reply_text = handle_meme_agent(user_id, image_content=image_data, reply_token=reply_token)
+             reply_text = handle_meme_agent(user_id, image_content=image_handle, reply_token=reply_token)
              with ApiClient(configuration) as api_client:
                 line_bot_api = MessagingApi(api_client)
                 line_bot_api.reply_message_with_http_info(
@@ -2998,11 +3008,6 @@ def message_image(event):
             user_images[user_id] = []
         user_images[user_id].append(image_path)
         
-        # [New] 加入當前批次
-        if user_id not in user_image_batch:
-            user_image_batch[user_id] = []
-        user_image_batch[user_id].append(image_path)
-        
         # 保留最近5張
         if len(user_images[user_id]) > 5:
             old_image = user_images[user_id].pop(0)
@@ -3018,82 +3023,12 @@ def message_image(event):
         }
         
         # ===== 批次延遲回覆機制 =====
-        # 保存最新的 reply_token（只有最後一個有效）
-        image_batch_tokens[user_id] = reply_token
-        
-        # 如果已有計時器，取消並重置（等待更多圖片）
-        if user_id in image_batch_timers and image_batch_timers[user_id] is not None:
-            image_batch_timers[user_id].cancel()
+        # 收集 IMAGE_BATCH_DELAY 秒內連續上傳的圖片，合併成一次描述（在該用戶的事件佇列中執行）
+        event_executor.debounce(user_id, 'image_batch', IMAGE_BATCH_DELAY, reply_image_batch,
+                                (image_path, reply_token), max_wait=IMAGE_BATCH_MAX_WAIT)
+        print(f"[IMAGE_BATCH] Queued image for {user_id}, total images: {len(user_images[user_id])}")
         
-        def send_batch_reply(uid):
-            """計時器到期後，統一描述所有圖片並回覆"""
-            try:
-                saved_token = image_batch_tokens.get(uid)
-                if not saved_token:
-                    return
-                
-                # [Fix] 只描述當前批次的圖片，而不是歷史圖片
-                images_to_describe = user_image_batch.get(uid, [])
-                if not images_to_describe:
-                    return
-                
-                # 清空批次 (避免下次重複描述)
-                user_image_batch[uid] = []
-                
-                # 用 Gemini Vision 統一描述所有圖片
-                try:
-                    # 最多描述最近5張 (批次內)
-                    recent = images_to_describe[-5:]
-                    img_objects = []
-                    for p in recent:
-                        try:
-                            img_objects.append(PIL.Image.open(p))
-                        except:
-                            pass
-                    
-                    if len(img_objects) == 1:
-                        vision_prompt = "請用繁體中文描述這張圖片的內容，保持簡短生動（不超過100字）。描述完後，直接說「我已經記得這張圖片了！」"
-                        vision_response = model.generate_content([vision_prompt, img_objects[0]])
-                    else:
-                        count = len(img_objects)
-                        labels = "\n".join([f"📸 第{i+1}張：..." for i in range(count)])
-                        vision_prompt = f"請用繁體中文分別簡短描述這{count}張圖片的內容（每張不超過40字），格式為：\n{labels}\n描述完後，說「我已經記得這{count}張圖片了！」"
-                        vision_response = model.generate_content([vision_prompt] + img_objects)
-                    
-                    finish_message = vision_response.text
-                    if '加油' not in finish_message:
-                        finish_message += "\n\n加油！Cheer up！讚啦！"
-                except:
-                    count = len(images_to_describe)
-                    if count > 1:
-                        finish_message = f"我已經記得這{count}張圖片了！\n\n加油！Cheer up！讚啦！"
-                    else:
-                        finish_message = "我已經記得這張圖片了！\n\n加油！Cheer up！讚啦！"
-                
-                # 用最後一個 reply_token 回覆
-                with ApiClient(configuration) as api_client:
-                    line_bot_api = MessagingApi(api_client)
-                    line_bot_api.reply_message_with_http_info(
-                        ReplyMessageRequest(
-                            reply_token=saved_token,
-                            messages=[TextMessage(text=finish_message)],
-                        )
-                    )
-                print(f"[IMAGE_BATCH] Replied for {uid} with {len(images_to_describe)} image(s)")
-            except Exception as e:
-                print(f"[IMAGE_BATCH] Error: {e}")
-            finally:
-                # 清理計時器
-                image_batch_timers.pop(uid, None)
-                image_batch_tokens.pop(uid, None)
-        
-        # 設定2秒後觸發（等待用戶可能繼續傳圖）
-        timer = threading.Timer(2.0, send_batch_reply, args=[user_id])
-        image_batch_timers[user_id] = timer
-        timer.start()
-        print(f"[IMAGE_BATCH] Timer set for {user_id}, total images: {len(user_images[user_id])}")
-        
-        # 不在這裡回覆，由 Timer 統一回覆
+        # 不在這裡回覆，由 reply_image_batch 統一回覆
         return
         
     except Exception as e:
@@ -3112,7 +3047,7 @@ def message_image(event):
                 pass
 
 
-@handler.add(MessageEvent, message=AudioMessageContent)
+@on_line_event(MessageEvent, message=AudioMessageContent)
 def message_audio(event):
     user_id = event.source.user_id
     
@@ -3222,7 +3157,7 @@ def message_audio(event):
             )
         )
 
-@handler.add(MessageEvent, message=StickerMessageContent)
+@on_line_event(MessageEvent, message=StickerMessageContent)
 def message_sticker(event):
     """處理貼圖訊息 - 不觸發任何服務, 只回應表情"""
     user_id = event.source.user_id
@@ -3258,7 +3193,7 @@ def message_sticker(event):
             )
         )
 
-@handler.add(FollowEvent)
+@on_line_event(FollowEvent)
 def handle_follow(event):
     """處理加入好友/解除封鎖事件 (歡迎詞 - 發送功能總覽圖)"""
     user_id = event.source.user_id
@@ -3375,7 +3310,7 @@ def handle_trip_agent(user_id, user_input, is_new_session=False, reply_token=Non
                 extracted_dest = user_input
 
             # 使用功能性模型進行地區判斷，避免廢話
-            result = check_region_need_clarification(extracted_dest, model_functional)
+            result = check_region_need_clarification(extracted_dest, model_functional, cache=llm_cache)
             
             if result['need_clarification']:
                 # 需要進一步細化
@@ -3617,14 +3552,13 @@ def handle_meme_agent(user_id, user_input=None, image_content=None, is_new_sessi
                 del user_images[user_id]
             return "已取消長輩圖製作。"
         
-        # Handle Image Upload (Passed via image_content)
+        # Handle Image Upload (Passed via image_content: ImageHandle 或 bytes)
         if image_content:
-            # Save temporary image
+            # 背景圖要保存到用戶輸入文字與位置之後；已存檔的圖片（message_image）直接沿用，不再複製一份
             import tempfile
-            temp_dir = tempfile.gettempdir()
-            bg_path = os.path.join(temp_dir, f"{user_id}_bg_{int(datetime.now().timestamp())}.jpg")
-            with open(bg_path, "wb") as f:
-                f.write(image_content)
+            bg_handle = image_content if isinstance(image_content, ImageHandle) else ImageHandle.from_bytes(image_content)
+            bg_path = bg_handle.spill(tempfile.gettempdir(), f"{user_id}_bg_{int(datetime.now().timestamp())}.jpg")
+            image_store.put(bg_handle)
             
             state['bg_image'] = bg_path
             state['stage'] = 'waiting_text'  # 直接進入文字輸入階段，不需確認
@@ -3686,8 +3620,10 @@ Now generate English prompt for: "{user_input}" """
              
              try:
                  # 使用 Gemini 翻譯 (使用功能性模型，避免廢話)
-                 translation_response = model_functional.generate_content(translation_prompt)
-                 bg_prompt = translation_response.text.strip()
+                 # 相同的描述（例如「山水」、「荷花」）共用翻譯結果
+                 bg_prompt = llm_cache.generate_text(model_functional, "meme_bg_translation:v1", translation_prompt,
+                                                     inputs={'description': user_input},
+                                                     ttl=7 * 24 * 60 * 60).strip()
                  
                  # ===== 配額檢查已經移至 generate_image_with_imagen 內部 =====
                  
@@ -3783,8 +3719,7 @@ Output JSON: {{ "intent": "modify" or "switch" }}"""
                     3. Return ONLY the English prompt.
                     """
                     
-                    import PIL.Image
-                    current_bg_img = PIL.Image.open(current_bg)
+                    current_bg_img = image_store.get(current_bg, decode=True).image()
                     
                     # 使用功能性模型進行圖文理解
                     refined_response = model_functional.generate_content([refine_prompt, current_bg_img])
@@ -3898,7 +3833,6 @@ Output JSON: {{ "intent": "text" or "switch" }}"""
                 return "請輸入 1~9 或 0 來選擇位置喔！\n（輸入「取消」可結束）"
 
             import random
-            from PIL import Image
 
             # 公用預設值
             font = 'heiti'
@@ -3909,15 +3843,14 @@ Output JSON: {{ "intent": "text" or "switch" }}"""
             decorations = []
             color = None
             text_style = 'gentle'
-            final_path = None
+            final_meme = None
 
             if user_position == 'ai':
                 # ===== AI 判斷模式（保留 b3b7e69 完整邏輯）=====
                 try:
-                    from PIL import Image
                     import random
 
-                    bg_image = Image.open(bg_path)
+                    bg_image = image_store.get(bg_path, decode=True).image()
                     random_vibes = ["Pop Art", "Elegant", "Bold", "Minimalist", "Retro", "Modern", "Handwritten Style", "Cute", "Serious"]
                     current_vibe = random.choice(random_vibes)
 
@@ -4106,7 +4039,7 @@ Text to display: "{text}"
                         print(f"[PIXEL] Integration error: {pixel_e}, keeping AI decisions")
 
                     print(f"[AI CREATIVE] {text[:10]}... → {position}, {color}, {font}, {size}px, stroke={stroke_width}")
-                    final_path = create_meme_image(bg_path, text, user_id, font, size, position, color, angle, stroke_width, stroke_color, decorations, text_style)
+                    final_meme = render_meme_image(image_store.get(bg_path), text, user_id, font, size, position, color, angle, stroke_width, stroke_color, decorations, text_style)
 
                 except Exception as e:
                     print(f"[VISION ERROR] {e}，使用隨機創意 fallback")
@@ -4118,13 +4051,13 @@ Text to display: "{text}"
                     angle = random.choice([0, 5, 8, -5, -8])
                     size = 65
                     print(f"[FALLBACK CREATIVE] {text[:10]}... → {position}, {color}, {font}, {size}號")
-                    final_path = create_meme_image(bg_path, text, user_id, font, size, position, color, angle)
+                    final_meme = render_meme_image(image_store.get(bg_path), text, user_id, font, size, position, color, angle)
 
             else:
                 # ===== 用戶手動選位置：AI 判斷顏色 + 字體大小 =====
                 position = user_position
                 try:
-                    bg_image = Image.open(bg_path)
+                    bg_image = image_store.get(bg_path, decode=True).image()
 
                     # AI 同時判斷顏色、描邊顏色與字體大小（根據用戶選定的位置）
                     color_size_prompt = f"""Look at this image. The user wants to place text at the "{position}" area.
@@ -4188,12 +4121,12 @@ Text to place: "{text}"
                     size = 70
 
                 print(f"[MEME FINAL] {text[:10]}... → pos={position}, color={color}, font={font}, size={size}px")
-                final_path = create_meme_image(bg_path, text, user_id, font, size, position, color, angle, stroke_width, stroke_color, decorations)
+                final_meme = render_meme_image(image_store.get(bg_path), text, user_id, font, size, position, color, angle, stroke_width, stroke_color, decorations)
 
 
             # 發送結果
-            if final_path:
-                if send_image_to_line(user_id, final_path, "長輩圖製作完成，讚喔！", reply_token):
+            if final_meme:
+                if send_image_to_line(user_id, final_meme, "長輩圖製作完成，讚喔！", reply_token):
                     state['stage'] = 'idle'
                     return None
                 else:
@@ -4248,63 +4181,53 @@ def is_confirmation(user_input):
 # Main LLM Function
 # ======================
 
+def _llm_classify_intent(text):
+    """使用 AI 判斷用戶意圖（本地規則無法判斷時才呼叫）"""
+    classification_prompt = f"""
+    Analyze user input: "{text}"
+    
+    Classify into exactly one intent category (Return ONLY the code, nothing else):
+    1. video_generation (Make video, generate video)
+    2. image_generation (Draw picture, generate image)
+    3. image_modification (Explicitly ASK to CHANGE/MODIFY image content. Questions about image content -> chat)
+    4. meme_creation (Make meme, elderly greeting card)
+    5. trip_planning (Plan trip, travel, suggest spots)
+    6. set_reminder (Set reminder, remind me to...)
+    7. show_reminders (Check reminders, what to do)
+    8. chat (General chat, greeting, others, AND Questions about image content e.g. "What color is this?")
+    
+    Examples:
+    - "I want to go to Yilan" -> trip_planning
+    - "Bring me to Green Island" -> trip_planning
+    - "Change cat to dog" -> image_modification
+    - "What color is the person wearing?" -> chat
+    - "Draw a cat" -> image_generation
+    - "Remind me to eat medicine" -> set_reminder
+    - "Good morning" -> chat
+    
+    Your Answer (Just the code):"""
+    # 使用功能性模型進行意圖分類
+    response = model_functional.generate_content(classification_prompt)
+    intent = response.text.strip().lower()
+    
+    # 清理可能的多餘符號
+    import re
+    match = re.search(r'(video_generation|image_generation|image_modification|meme_creation|trip_planning|set_reminder|show_reminders|chat)', intent)
+    if match:
+        return match.group(1)
+    return "chat"
+
+def _llm_should_clear_memory(text):
+    """用簡單的 AI 呼叫來判斷是否想清除記憶 (使用功能性模型)"""
+    intent_prompt = f"使用者說：「{text}」。請判斷使用者是否想要清除對話記憶、重新開始對話？只回答「是」或「否」。"
+    intent_response = model_functional.generate_content(intent_prompt)
+    return "是" in intent_response.text
+
 def classify_user_intent(text):
-    """使用 AI 判斷用戶意圖"""
+    """判斷用戶意圖：先用本地規則與關鍵字評分，無法判斷時才呼叫 AI（結果會快取）"""
     try:
-        # 強制規則 (Regex Fallback) - 優先於 AI 判斷
-        # 1. 優先判斷取消/刪除提醒 (因為包含「提醒」二字，必須先於設定提醒判斷)
-        if any(kw in text for kw in ["取消提醒", "刪除提醒", "不要提醒", "cancel reminder", "delete reminder"]):
-            return "cancel_reminder"
-            
-        if any(kw in text for kw in ["提醒我", "設提醒", "叫我", "提醒", "remind me"]):
-            return "set_reminder"
-        if any(kw in text for kw in ["我的提醒", "查看提醒", "待辦", "提醒列表", "my reminders"]):
-            return "show_reminders"
-            
-        # 2. 優先判斷長輩圖/梗圖製作 (包含「加文字」指令)
-        if any(kw in text for kw in ["長輩圖", "梗圖", "加文字", "加上文字", "迷因", "meme"]):
-            return "meme_creation"
-
-        # 3. 判斷一般圖片生成 (避免 AI 誤判為 chat)
-        # 用戶說 "畫一隻...", "生成一張...", "給我一張...圖片"
-        if any(kw in text for kw in ["畫一", "生成一", "產生一", "製作一", "create a image", "generate a image"]):
-            return "image_generation"
-        if "圖片" in text and any(kw in text for kw in ["給我", "想要", "來一張", "一張", "生"]):
-            return "image_generation"
-            
-        classification_prompt = f"""
-        Analyze user input: "{text}"
-        
-        Classify into exactly one intent category (Return ONLY the code, nothing else):
-        1. video_generation (Make video, generate video)
-        2. image_generation (Draw picture, generate image)
-        3. image_modification (Explicitly ASK to CHANGE/MODIFY image content. Questions about image content -> chat)
-        4. meme_creation (Make meme, elderly greeting card)
-        5. trip_planning (Plan trip, travel, suggest spots)
-        6. set_reminder (Set reminder, remind me to...)
-        7. show_reminders (Check reminders, what to do)
-        8. chat (General chat, greeting, others, AND Questions about image content e.g. "What color is this?")
-        
-        Examples:
-        - "I want to go to Yilan" -> trip_planning
-        - "Bring me to Green Island" -> trip_planning
-        - "Change cat to dog" -> image_modification
-        - "What color is the person wearing?" -> chat
-        - "Draw a cat" -> image_generation
-        - "Remind me to eat medicine" -> set_reminder
-        - "Good morning" -> chat
-        
-        Your Answer (Just the code):"""
-        # 使用功能性模型進行意圖分類
-        response = model_functional.generate_content(classification_prompt)
-        intent = response.text.strip().lower()
-        
-        # 清理可能的多餘符號
-        import re
-        match = re.search(r'(video_generation|image_generation|image_modification|meme_creation|trip_planning|set_reminder|show_reminders|chat)', intent)
-        if match:
-            return match.group(1)
-        return "chat"
+        result = intent_engine.classify_with_fallback(text, _llm_classify_intent)
+        return result.intent or "chat"
     except Exception as e:
         print(f"Intent classification error: {e}")
         return "chat"
@@ -4328,21 +4251,12 @@ def gemini_llm_sdk(user_input, user_id=None, reply_token=None):
         
         should_clear = False
         if not in_active_flow:  # 只有在沒有進行中的流程時才檢查清除記憶
-            clear_keywords = ["重新開始", "清除記憶", "忘記我", "重置對話", "新的開始", "清空記憶", "reset", "重來", "忘掉", "清空"]
-            should_clear = any(keyword in user_input for keyword in clear_keywords)
-            
-            # 用 AI 判斷是否有清除記憶的意圖（更智慧的判斷）
-            intent_check_keywords = ["重新", "清除", "忘記", "重置", "清空", "reset", "記憶", "對話", "開始"]
-            if not should_clear and any(keyword in user_input for keyword in intent_check_keywords):
-                # 用簡單的 AI 呼叫來判斷意圖 (使用功能性模型)
-                intent_prompt = f"使用者說：「{user_input}」。請判斷使用者是否想要清除對話記憶、重新開始對話？只回答「是」或「否」。"
-                intent_response = model_functional.generate_content(intent_prompt)
-                should_clear = "是" in intent_response.text
+            # 先用本地關鍵字規則判斷（含「不要忘記…」等否定句），無法確定時才用 AI 判斷（結果會快取）
+            should_clear = intent_engine.should_clear_memory(user_input, _llm_should_clear_memory)
         
         if should_clear:
-            # 清除該用戶的所有記憶
-            if user_id in chat_sessions:
-                del chat_sessions[user_id]
+            # 清除該用戶的所有記憶（含資料庫中的聊天記錄）
+            chat_memory.forget(user_id)
             if user_id in last_activity:
                 del last_activity[user_id]
             if user_id in user_images:
@@ -4369,8 +4283,7 @@ def gemini_llm_sdk(user_input, user_id=None, reply_token=None):
             if time_diff > SESSION_TIMEOUT:
                 # 對話已過期，清除舊記錄
                 print(f"Session expired for user {user_id}, clearing history")
-                if user_id in chat_sessions:
-                    del chat_sessions[user_id]
+                chat_memory.forget(user_id)
                 if user_id in user_images:
                     del user_images[user_id]
                 if user_id in user_image_generation_state:
@@ -4529,11 +4442,7 @@ def gemini_llm_sdk(user_input, user_id=None, reply_token=None):
                     try:
                         print(f"[IMAGE_MERGE] Calling Gemini edit, user_input: {user_input}")
                         
-                        # ===== 配額檢查（融合/修改/生成三者共用每日 6 次）=====
-                        quota_ok, _, quota_msg = check_image_quota(user_id)
-                        if not quota_ok:
-                            return quota_msg
-                        
+                        # 配額（融合/修改/生成三者共用每日 6 次）由 edit_image_with_gemini 預留
                         # [Gemini Edit] 直接傳入兩張圖給 Gemini 進行融合
                         success, result = edit_image_with_gemini(
                             edit_prompt=user_input,
@@ -4568,6 +4477,8 @@ def gemini_llm_sdk(user_input, user_id=None, reply_token=None):
                                 return None  # 已回覆
                             else:
                                 return "融合完成，但發送失敗。"
+                        elif result == IMAGE_QUOTA_MSG:
+                            return result
                         else:
                             return f"融合失敗：{result}"
                     except Exception as e:
@@ -4581,11 +4492,7 @@ def gemini_llm_sdk(user_input, user_id=None, reply_token=None):
                     try:
                         print(f"[IMAGE_MODIFY] Calling Gemini edit, user_input: {user_input}")
                         
-                        # ===== 配額檢查（融合/修改/生成三者共用每日 6 次）=====
-                        quota_ok, _, quota_msg = check_image_quota(user_id)
-                        if not quota_ok:
-                            return quota_msg
-                        
+                        # 配額（融合/修改/生成三者共用每日 6 次）由 edit_image_with_gemini 預留
                         # [Gemini Edit] 直接傳入原圖給 Gemini 進行修改
                         success, result = edit_image_with_gemini(
                             edit_prompt=user_input,
@@ -4622,6 +4529,8 @@ def gemini_llm_sdk(user_input, user_id=None, reply_token=None):
                                 return None  # 已回覆
                             else:
                                 return "修改完成，但發送失敗。"
+                        elif result == IMAGE_QUOTA_MSG:
+                            return result
                         else:
                             return f"修改失敗：{result}"
                     except Exception as e:
@@ -5024,8 +4933,7 @@ Output JSON: {{ "intent": "modify" or "switch" }}"""
                  # 檢查是否有圖
                  has_image = user_id in user_images
                  
-                 if user_id not in chat_sessions: chat_sessions[user_id] = model.start_chat(history=[])
-                 chat = chat_sessions[user_id]
+                 chat = chat_memory.get_session(user_id)
                  
                  if has_image:
                      upload_image = PIL.Image.open(user_images[user_id])
@@ -5069,11 +4977,13 @@ Output JSON: {{ "intent": "modify" or "switch" }}"""
              # 7. 設定提醒
              elif current_intent == 'set_reminder':
                  if not ADVANCED_FEATURES_ENABLED or not db: return "提醒功能需要資料庫支援喔！"
+                 reserved = False
                  try:
-                     # ===== 每日提醒配額檢查 =====
-                     quota_ok, remind_count, quota_msg = check_reminder_quota(user_id)
+                     # ===== 預留每日提醒配額（設定失敗時退回）=====
+                     quota_ok, remain_reminders, quota_msg = reserve_reminder_quota(user_id)
                      if not quota_ok:
                          return quota_msg
+                     reserved = True
                      
                      parse_prompt = f"""System: User says: "{user_input}". Parse reminder and rewrite warmly in Traditional Chinese (繁體中文).
                      Return JSON: {{ "reminder_text": "...", "reminder_time": "2026-01-17T08:00:00" }}
@@ -5086,9 +4996,8 @@ Output JSON: {{ "intent": "modify" or "switch" }}"""
                      data = json.loads(re.search(r'\{[^}]+\}', resp.text).group())
                      t = datetime.fromisoformat(data['reminder_time'])
                      db.add_reminder(user_id, data['reminder_text'], t)
+                     reserved = False  # 設定成功，保留已預留的配額
                      
-                     # 設定成功後累加計數
-                     remain_reminders = increment_reminder_quota(user_id)
                      remain_hint = f"\n📊 今日剩餘提醒配額：{remain_reminders} 個" if user_id not in QUOTA_WHITELIST else ""
                      
                      reply = f"OK! 已為您設定提醒：{t.strftime('%m/%d %H:%M')}，提醒內容：「{data['reminder_text']}」。{remain_hint}"
@@ -5100,6 +5009,8 @@ Output JSON: {{ "intent": "modify" or "switch" }}"""
                      return reply
                  except Exception as e:
                      print(f"Set reminder error: {e}")
+                     if reserved:
+                         decrement_reminder_quota(user_id)
                      return "設定提醒失敗了...請說清楚一點，例如「明天早上8點吃藥」。"
 
              # 8. 一般聊天 (Chat)
@@ -5108,9 +5019,7 @@ Output JSON: {{ "intent": "modify" or "switch" }}"""
                  has_image = user_id in user_images
                  
 
-                 if user_id not in chat_sessions: chat_sessions[user_id] = model.start_chat(history=[])
-                     
-                 chat = chat_sessions[user_id]
+                 chat = chat_memory.get_session(user_id)
                  
                  if has_image:
                      # [Fix Bug 3] user_images stores a list; get the latest one
@@ -5301,13 +5210,7 @@ Output JSON: {{ "intent": "modify" or "switch" }}"""
                     
                     print(f"生成圖片，Prompt: {image_prompt}")
                     
-                    # ===== 配額檢查（融合/修改/生成三者共用每日 6 次）=====
-                    quota_ok, _, quota_msg = check_image_quota(user_id)
-                    if not quota_ok:
-                        user_image_generation_state[user_id] = 'idle'
-                        return quota_msg
-                    
-                    # 生成圖片
+                    # 生成圖片（配額由 generate_image_with_imagen 預留，融合/修改/生成三者共用每日 6 次）
                     success, result = generate_image_with_imagen(image_prompt, user_id)
                     image_path = result if success else None
                     error_reason = result if not success else None
@@ -5337,6 +5240,8 @@ Output JSON: {{ "intent": "modify" or "switch" }}"""
                         if user_id in user_last_image_prompt:
                             user_last_image_prompt[user_id].pop('pending_description', None)
                         user_image_generation_state[user_id] = 'idle'
+                        if error_reason == IMAGE_QUOTA_MSG:
+                            return error_reason
                         # 顯示詳細錯誤原因
                         failure_msg = f"圖片生成失敗。\n\n失敗原因：{error_reason if error_reason else '未知錯誤'}\n\n如需重新生成，請再次說「生成圖片」並描述您的需求。"
                         return failure_msg
@@ -5630,6 +5535,13 @@ if ADVANCED_FEATURES_ENABLED:
     except Exception as e:
         print(f"⚠️ Failed to start scheduler: {e}")
 
+    # 在背景預先初始化 Vertex AI 並載入 Imagen 模型，第一次生圖不必等待（未設定專案時不載入）
+    if os.environ.get("GOOGLE_CLOUD_PROJECT"):
+        imagen_registry.warm_up()
+
+# 在背景下載（必要時）並驗證字體，長輩圖請求中不必下載
+font_registry.preload()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     print(f"🚀 Starting bot on port {port}...")
@@ -3,31 +3,173 @@ Google Maps API 整合模組
 提供地點搜尋、路線規劃、距離計算等功能
 """
 import os
-import requests
+import copy
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 
+from bounded_cache import BoundedCache
+from http_client import http_client
+
 # Google Maps API Key
 GOOGLE_MAPS_API_KEY = os.environ.get("GOOGLE_MAPS_API_KEY", "")
 
+# ==================
+# 查詢結果快取
+# ==================
+
+# 各 API 的快取時間（秒）
+# Google Maps Platform 條款：place_id 可長期保存、經緯度最多保存 30 天，
+# 其他地點內容（地址、名稱、評分、營業時間等）不可保存：只放在行程內快取（BoundedCache），不寫入資料庫
+MAPS_CACHE_TTL = {
+    'geocode': int(os.environ.get("MAPS_CACHE_TTL_GEOCODE", str(30 * 24 * 60 * 60))),
+    'reverse_geocode': int(os.environ.get("MAPS_CACHE_TTL_REVERSE", str(24 * 60 * 60))),
+    'nearby': int(os.environ.get("MAPS_CACHE_TTL_NEARBY", str(24 * 60 * 60))),
+    'place_details': int(os.environ.get("MAPS_CACHE_TTL_DETAILS", str(24 * 60 * 60))),
+}
+MAPS_LATLNG_MAX_TTL = 30 * 24 * 60 * 60  # 條款允許保存經緯度的上限
+# 可寫入資料庫（跨 worker 共用）的 API 與欄位；其他欄位寫入時設為 None，未列出的 API 只放在行程內
+MAPS_PERSISTABLE_FIELDS = {
+    'geocode': ('lat', 'lng', 'place_id'),
+}
+MAPS_NEGATIVE_TTL = int(os.environ.get("MAPS_NEGATIVE_TTL", str(60 * 60)))  # 查無結果 (ZERO_RESULTS) 的快取時間
+MAPS_CACHE_MAX_ITEMS = int(os.environ.get("MAPS_CACHE_MAX_ITEMS", "5000"))
+MAPS_CACHE_PERSIST = os.environ.get("MAPS_CACHE_PERSIST", "true").lower() == "true"
+
+MAPS_MAX_CONCURRENCY = int(os.environ.get("MAPS_MAX_CONCURRENCY", "6"))  # 同時發出的 API 請求數
+MAPS_HTTP_TIMEOUT = float(os.environ.get("MAPS_HTTP_TIMEOUT", "10"))
+
+
+def normalize_query(value) -> str:
+    """正規化查詢字串（全半形、大小寫、連續空白），「台南」與「 台南 」共用快取"""
+    return " ".join(unicodedata.normalize('NFKC', str(value)).lower().split())
+
+
+class MapsCache:
+    """
+    兩層快取：行程內 LRU（BoundedCache）+ 資料庫 kv_store（key 前綴 maps:）
+
+    值以 (到期時間, 結果) 保存；結果為 None 代表查無資料（負向快取）
+    API 錯誤（例外、OVER_QUERY_LIMIT 等）不會被快取
+    資料庫只保存 MAPS_PERSISTABLE_FIELDS 中的 API 與欄位（最多 MAPS_LATLNG_MAX_TTL），其他只放在行程內；
+    從資料庫讀到的結果缺少其他欄位，只有呼叫端指定的 fields 都有保存時才算命中
+    """
+
+    KEY_PREFIX = "maps:"
+
+    def __init__(self, database=None, max_items: int = MAPS_CACHE_MAX_ITEMS):
+        self.db = database
+        self.memory = BoundedCache(max_items=max_items, name="maps_cache")
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def make_key(self, endpoint: str, *parts) -> str:
+        raw = json.dumps([normalize_query(p) for p in parts], ensure_ascii=False)
+        return f"{self.KEY_PREFIX}{endpoint}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str, fields: Optional[Tuple[str, ...]] = None) -> Tuple[bool, object]:
+        """
+        回傳 (是否命中, 結果)
+        fields：呼叫端需要的欄位（None 代表完整結果）；只保存了部分欄位的結果不足時視為未命中
+        """
+        endpoint = key.split(':')[1]
+        persisted = MAPS_PERSISTABLE_FIELDS.get(endpoint, ())
+        enough = fields is not None and set(fields) <= set(persisted)
+        entry = self.memory.get(key)
+        if entry is not None and entry[0] > time.time() and (entry[2] or entry[1] is None or enough):
+            self._count(endpoint, 'memory_hits')
+            return True, copy.deepcopy(entry[1])  # 避免呼叫端修改到快取中的結果
+
+        if self.db and persisted:
+            try:
+                raw = self.db.get(key)
+                if raw is not None:
+                    data = json.loads(raw)
+                    if data['expires_at'] > time.time() and (data['value'] is None or enough):
+                        self.memory[key] = (data['expires_at'], data['value'], False)
+                        self._count(endpoint, 'db_hits')
+                        return True, data['value']
+            except Exception as e:
+                print(f"[MAPS CACHE] Read error: {e}")
+
+        self._count(endpoint, 'misses')
+        return False, None
+
+    def set(self, key: str, value, ttl: int):
+        expires_at = time.time() + ttl
+        self.memory[key] = (expires_at, value, True)  # (到期時間, 結果, 是否為完整結果)
+        fields = MAPS_PERSISTABLE_FIELDS.get(key.split(':')[1])
+        if not self.db or fields is None:
+            return
+        if isinstance(value, dict):
+            value = {k: (v if k in fields else None) for k, v in value.items()}
+        ttl = min(ttl, MAPS_LATLNG_MAX_TTL)
+        try:
+            self.db.set(key, json.dumps({'expires_at': time.time() + ttl, 'value': value}, ensure_ascii=False), ttl=ttl)
+        except Exception as e:
+            print(f"[MAPS CACHE] Write error: {e}")
+
+    def stats(self) -> Dict:
+        """各 API 的命中統計（監控用）"""
+        with self._lock:
+            endpoints = {name: dict(counts) for name, counts in self._stats.items()}
+        for counts in endpoints.values():
+            hits = counts.get('memory_hits', 0) + counts.get('db_hits', 0)
+            total = hits + counts.get('misses', 0)
+            counts['hit_rate'] = round(hits / total, 3) if total else 0.0
+        return {'endpoints': endpoints, 'memory': self.memory.stats(), 'persistent': bool(self.db),
+                'persisted_endpoints': sorted(MAPS_PERSISTABLE_FIELDS) if self.db else []}
+
+    def _count(self, endpoint: str, field: str):
+        with self._lock:
+            counts = self._stats.setdefault(endpoint, {})
+            counts[field] = counts.get(field, 0) + 1
+
+
+def _default_cache_database():
+    if not MAPS_CACHE_PERSIST:
+        return None
+    try:
+        from database import db
+        return db
+    except ImportError:
+        return None
+
+
 class MapsIntegration:
     """Google Maps API 整合類別"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, cache: Optional[MapsCache] = None):
         self.api_key = api_key or GOOGLE_MAPS_API_KEY
         self.base_url = "https://maps.googleapis.com/maps/api"
+        self.cache = cache or MapsCache(_default_cache_database())
+        # 透過共用 HTTP 用戶端（keep-alive 連線池、逾時與重試）
+        self.http = http_client
     
-    def geocode(self, address: str, language: str = "zh-TW") -> Optional[Dict]:
+    def geocode(self, address: str, language: str = "zh-TW",
+                fields: Optional[Tuple[str, ...]] = None) -> Optional[Dict]:
         """
         地址轉經緯度（Geocoding）
         
         Args:
             address: 地址或地點名稱
             language: 語言代碼
+            fields: 只需要部分欄位時指定（例如 ('lat', 'lng')），可使用資料庫保存的座標；
+                此時未指定的欄位（formatted_address）可能為 None
             
         Returns:
             包含經緯度和格式化地址的字典，失敗返回 None
         """
+        cache_key = self.cache.make_key('geocode', address, language)
+        hit, cached = self.cache.get(cache_key, fields=fields)
+        if hit:
+            return cached
+        
         try:
             url = f"{self.base_url}/geocode/json"
             params = {
@@ -36,19 +178,23 @@ class MapsIntegration:
                 "language": language
             }
             
-            response = requests.get(url, params=params)
+            response = self.http.get(url, params=params, timeout=MAPS_HTTP_TIMEOUT)
             data = response.json()
             
             if data["status"] == "OK" and len(data["results"]) > 0:
                 result = data["results"][0]
-                return {
+                geocode_result = {
                     "lat": result["geometry"]["location"]["lat"],
                     "lng": result["geometry"]["location"]["lng"],
                     "formatted_address": result["formatted_address"],
                     "place_id": result.get("place_id")
                 }
+                self.cache.set(cache_key, geocode_result, MAPS_CACHE_TTL['geocode'])
+                return geocode_result
             else:
                 print(f"Geocoding failed: {data.get('status')}")
+                if data.get("status") == "ZERO_RESULTS":
+                    self.cache.set(cache_key, None, MAPS_NEGATIVE_TTL)
                 return None
         except Exception as e:
             print(f"Geocoding error: {e}")
@@ -66,6 +212,12 @@ class MapsIntegration:
         Returns:
             格式化的地址字串，失敗返回 None
         """
+        # 座標取到小數第 5 位（約 1 公尺）作為快取 key
+        cache_key = self.cache.make_key('reverse_geocode', f"{lat:.5f},{lng:.5f}", language)
+        hit, cached = self.cache.get(cache_key)
+        if hit:
+            return cached
+        
         try:
             url = f"{self.base_url}/geocode/json"
             params = {
@@ -74,11 +226,15 @@ class MapsIntegration:
                 "language": language
             }
             
-            response = requests.get(url, params=params)
+            response = self.http.get(url, params=params, timeout=MAPS_HTTP_TIMEOUT)
             data = response.json()
             
             if data["status"] == "OK" and len(data["results"]) > 0:
-                return data["results"][0]["formatted_address"]
+                address = data["results"][0]["formatted_address"]
+                self.cache.set(cache_key, address, MAPS_CACHE_TTL['reverse_geocode'])
+                return address
+            if data.get("status") == "ZERO_RESULTS":
+                self.cache.set(cache_key, None, MAPS_NEGATIVE_TTL)
             return None
         except Exception as e:
             print(f"Reverse geocoding error: {e}")
@@ -98,15 +254,27 @@ class MapsIntegration:
         Returns:
             地點清單
         """
+        # 先取得經緯度
+        geocode_result = self.geocode(location, language, fields=('lat', 'lng'))
+        if not geocode_result:
+            return []
+        return self.search_nearby_coordinates(geocode_result["lat"], geocode_result["lng"],
+                                              place_type, radius, language)
+    
+    def search_nearby_coordinates(self, lat: float, lng: float, place_type: str = "tourist_attraction",
+                                  radius: int = 5000, language: str = "zh-TW") -> List[Dict]:
+        """
+        以經緯度搜尋附近地點（已有座標時可省下一次 Geocoding）
+        
+        Returns:
+            地點清單（最多 10 個）
+        """
+        cache_key = self.cache.make_key('nearby', f"{lat:.5f},{lng:.5f}", place_type, radius, language)
+        hit, cached = self.cache.get(cache_key)
+        if hit:
+            return cached or []
+        
         try:
-            # 先取得經緯度
-            geocode_result = self.geocode(location, language)
-            if not geocode_result:
-                return []
-            
-            lat = geocode_result["lat"]
-            lng = geocode_result["lng"]
-            
             url = f"{self.base_url}/place/nearbysearch/json"
             params = {
                 "location": f"{lat},{lng}",
@@ -116,7 +284,7 @@ class MapsIntegration:
                 "language": language
             }
             
-            response = requests.get(url, params=params)
+            response = self.http.get(url, params=params, timeout=MAPS_HTTP_TIMEOUT)
             data = response.json()
             
             if data["status"] == "OK":
@@ -130,7 +298,10 @@ class MapsIntegration:
                         "place_id": place.get("place_id"),
                         "types": place.get("types", [])
                     })
+                self.cache.set(cache_key, places, MAPS_CACHE_TTL['nearby'])
                 return places
+            if data.get("status") == "ZERO_RESULTS":
+                self.cache.set(cache_key, [], MAPS_NEGATIVE_TTL)
             return []
         except Exception as e:
             print(f"Search nearby places error: {e}")
@@ -161,7 +332,7 @@ class MapsIntegration:
                 "region": "TW"
             }
             
-            response = requests.get(url, params=params)
+            response = self.http.get(url, params=params, timeout=MAPS_HTTP_TIMEOUT)
             data = response.json()
             
             if data["status"] == "OK" and len(data["routes"]) > 0:
@@ -228,6 +399,11 @@ class MapsIntegration:
         Returns:
             地點詳細資訊
         """
+        cache_key = self.cache.make_key('place_details', place_id, language)
+        hit, cached = self.cache.get(cache_key)
+        if hit:
+            return cached
+        
         try:
             url = f"{self.base_url}/place/details/json"
             params = {
@@ -237,12 +413,12 @@ class MapsIntegration:
                 "fields": "name,formatted_address,rating,opening_hours,wheelchair_accessible_entrance,formatted_phone_number,website"
             }
             
-            response = requests.get(url, params=params)
+            response = self.http.get(url, params=params, timeout=MAPS_HTTP_TIMEOUT)
             data = response.json()
             
             if data["status"] == "OK":
                 result = data["result"]
-                return {
+                details = {
                     "name": result.get("name"),
                     "address": result.get("formatted_address"),
                     "rating": result.get("rating"),
@@ -251,6 +427,10 @@ class MapsIntegration:
                     "wheelchair_accessible": result.get("wheelchair_accessible_entrance"),
                     "opening_hours": result.get("opening_hours", {}).get("weekday_text", [])
                 }
+                self.cache.set(cache_key, details, MAPS_CACHE_TTL['place_details'])
+                return details
+            if data.get("status") in ("NOT_FOUND", "ZERO_RESULTS"):
+                self.cache.set(cache_key, None, MAPS_NEGATIVE_TTL)
             return None
         except Exception as e:
             print(f"Get place details error: {e}")
@@ -269,17 +449,33 @@ class MapsIntegration:
         Returns:
             建議的景點清單
         """
-        all_places = []
+        # 起始地點只查詢一次經緯度
+        geocode_result = self.geocode(location, fields=('lat', 'lng'))
+        if not geocode_result or not interests:
+            return []
+        lat, lng = geocode_result["lat"], geocode_result["lng"]
         
-        for interest in interests:
-            places = self.search_nearby_places(location, interest)
-            all_places.extend(places)
+        # 各興趣類型的附近搜尋同時發出（共用 keep-alive 連線，連線池需不小於 MAPS_MAX_CONCURRENCY）
+        workers = min(len(interests), MAPS_MAX_CONCURRENCY)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="maps-nearby") as pool:
+            results = list(pool.map(lambda interest: self.search_nearby_coordinates(lat, lng, interest), interests))
+        
+        # 同一地點可能符合多個類型（例如公園也是景點），依 place_id 去除重複
+        all_places = []
+        seen = set()
+        for places in results:
+            for place in places:
+                place_id = place.get("place_id")
+                if place_id and place_id in seen:
+                    continue
+                seen.add(place_id)
+                all_places.append(place)
         
-        # 簡單排序：根據評分和評論數
+        # 簡單排序：根據評分和評論數（沒有評分的地點視為 0）
         sorted_places = sorted(
             all_places,
-            key=lambda x: (x.get("rating", 0) * 0.7 + 
-                          min(x.get("user_ratings_total", 0) / 1000, 5) * 0.3),
+            key=lambda x: ((x.get("rating") or 0) * 0.7 + 
+                          min((x.get("user_ratings_total") or 0) / 1000, 5) * 0.3),
             reverse=True
         )
         
@@ -0,0 +1,429 @@
+"""
+新聞服務模組 - 背景更新 RSS 新聞
+- 多個來源同時抓取，並以 ETag / Last-Modified 做條件式請求（沒更新的來源只收到 304）
+- 新聞以連結為 key 增量保存，只有新出現的新聞需要解析與清理
+- 背景執行緒定期更新，用戶查詢時直接回傳目前的結果，不必等待抓取
+"""
+import os
+import re
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from http_client import http_client
+
+NEWS_REFRESH_INTERVAL = int(os.environ.get("NEWS_REFRESH_INTERVAL", "300"))  # 背景更新間隔（秒）
+NEWS_FETCH_TIMEOUT = float(os.environ.get("NEWS_FETCH_TIMEOUT", "10"))
+NEWS_ITEMS_PER_FEED = 10  # 每個來源取最新 10 則，確保有足夠新聞供挑選
+NEWS_BRIEFING_MIN_INTERVAL = int(os.environ.get("NEWS_BRIEFING_MIN_INTERVAL", "600"))  # 兩次重新摘要的最短間隔（秒）
+NEWS_AUDIO_WARM_WINDOW = int(os.environ.get("NEWS_AUDIO_WARM_WINDOW", "3600"))  # 最近有人聽語音時，新聞更新後預先產生語音
+NEWS_AUDIO_URL_TTL = int(os.environ.get("NEWS_AUDIO_URL_TTL", str(24 * 60 * 60)))
+
+NEWS_FEEDS = [
+    'https://news.ltn.com.tw/rss/all.xml',  # 自由時報 - 所有新聞
+    'https://newtalk.tw/rss/all',  # 新頭殼 - 所有新聞
+    'https://feeds.feedburner.com/rsscna/politics',  # 中央社 - 政治
+    'https://feeds.feedburner.com/rsscna/finance',  # 中央社 - 財經
+    'https://udn.com/rssfeed/news/2/6638?ch=news',  # 聯合報 - 即時新聞
+]
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0'
+]
+
+_HTML_TAG = re.compile('<[^<]+?>')
+
+
+def parse_entry(entry) -> Optional[Dict]:
+    """把一則 RSS 項目轉成新聞 dict；沒有任何內容時回傳 None"""
+    # [FIX] 增強內容抓取邏輯 (避免 News ID 錯誤或空白)
+    raw_summary = entry.get('summary', '') or entry.get('description', '')
+    # 如果 summary 還是空的，嘗試 content
+    if not raw_summary and 'content' in entry:
+        raw_summary = entry.get('content', [{'value': ''}])[0]['value']
+
+    # 清理 HTML 標籤
+    clean_summary = _HTML_TAG.sub('', raw_summary).strip()
+
+    # [FIX] 如果真的都沒內容，使用標題作為摘要 (Fallback to Title)
+    if not clean_summary or len(clean_summary) < 5:
+        # 優先使用 Description (如果不同於 Summary)
+        desc = entry.get('description', '')
+        if desc and len(desc) > 5:
+            clean_summary = _HTML_TAG.sub('', desc).strip()
+        else:
+            clean_summary = entry.get('title', '')
+
+    # If still empty (no title?), skip
+    if not clean_summary:
+        return None
+
+    return {
+        'title': entry.get('title', ''),
+        'summary': clean_summary[:100] + "..." if len(clean_summary) > 100 else clean_summary,
+        'link': entry.get('link', ''),
+        'published': entry.get('published', '')
+    }
+
+
+class _FeedState:
+    __slots__ = ('url', 'etag', 'last_modified', 'links', 'fetched_at', 'status', 'errors', 'not_modified')
+
+    def __init__(self, url: str):
+        self.url = url
+        self.etag = None
+        self.last_modified = None
+        self.links: List[str] = []  # 此來源目前的新聞（依來源順序）
+        self.fetched_at = None
+        self.status = None
+        self.errors = 0
+        self.not_modified = 0
+
+
+class NewsService:
+    """RSS 新聞的增量索引與背景更新"""
+
+    def __init__(self, feeds: List[str] = NEWS_FEEDS, refresh_interval: int = NEWS_REFRESH_INTERVAL,
+                 http=http_client):
+        self.feeds = [_FeedState(url) for url in feeds]
+        self.refresh_interval = refresh_interval
+        self.http = http
+        self._items: Dict[str, Dict] = {}  # {link: 新聞}
+        self._snapshot: List[Dict] = []
+        self._version = ""
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._listeners: List[Callable[[str], None]] = []
+        self._stats = {'refreshes': 0, 'new_items': 0, 'parsed_items': 0}
+
+    # ---- 查詢 ----
+
+    def latest(self) -> List[Dict]:
+        """目前的新聞（依來源順序、已去除重複）；第一次呼叫時若還沒有資料會同步抓取一次"""
+        self._ensure_started()
+        if not self._snapshot and not self._stats['refreshes']:
+            self.refresh()
+        with self._lock:
+            return list(self._snapshot)
+
+    @property
+    def version(self) -> str:
+        """目前新聞內容的版本（新聞有變動時改變），可用來快取摘要等衍生資料"""
+        with self._lock:
+            return self._version
+
+    def add_listener(self, fn: Callable[[str], None]):
+        """新聞內容變動時呼叫 fn(version)（在更新的執行緒中執行）"""
+        self._listeners.append(fn)
+
+    # ---- 更新 ----
+
+    def refresh(self) -> int:
+        """同時抓取所有來源並更新索引，回傳新增的新聞數"""
+        with self._refresh_lock:
+            with ThreadPoolExecutor(max_workers=len(self.feeds), thread_name_prefix="news-fetch") as pool:
+                results = list(pool.map(self._fetch_feed, self.feeds))
+
+            new_items = 0
+            with self._lock:
+                previous_version = self._version
+                for feed, entries in zip(self.feeds, results):
+                    if entries is None:
+                        continue  # 304 或抓取失敗：沿用上次的結果
+                    links = []
+                    for entry in entries:
+                        link = entry.get('link')
+                        if not link:
+                            continue
+                        if link not in self._items:
+                            item = parse_entry(entry)
+                            self._stats['parsed_items'] += 1
+                            if item is None:
+                                continue
+                            self._items[link] = item
+                            new_items += 1
+                        links.append(link)
+                    feed.links = links
+
+                # 依來源順序組成結果，同一則新聞只出現一次；不再出現在任何來源的新聞移出索引
+                seen = set()
+                snapshot = []
+                for feed in self.feeds:
+                    for link in feed.links:
+                        if link in seen or link not in self._items:
+                            continue
+                        seen.add(link)
+                        snapshot.append(self._items[link])
+                self._items = {item['link']: item for item in snapshot}
+                self._snapshot = snapshot
+                self._version = hashlib.sha1("\n".join(item['link'] for item in snapshot).encode('utf-8')).hexdigest()[:16]
+                self._stats['refreshes'] += 1
+                self._stats['new_items'] += new_items
+
+            if new_items:
+                print(f"[NEWS] Refreshed feeds: {new_items} new item(s), {len(snapshot)} total")
+            version = self._version
+        if version != previous_version:
+            for listener in self._listeners:
+                try:
+                    listener(version)
+                except Exception as e:
+                    print(f"[NEWS] Listener error: {e}")
+        return new_items
+
+    def stats(self) -> Dict:
+        """各來源狀態（監控用）"""
+        with self._lock:
+            return {
+                **self._stats,
+                'items': len(self._snapshot),
+                'version': self._version,
+                'feeds': {
+                    feed.url: {
+                        'status': feed.status,
+                        'items': len(feed.links),
+                        'not_modified': feed.not_modified,
+                        'errors': feed.errors,
+                        'fetched_at': feed.fetched_at,
+                    } for feed in self.feeds
+                },
+            }
+
+    # ---- 內部 ----
+
+    def _fetch_feed(self, feed: _FeedState):
+        """抓取單一來源；有新內容時回傳 entries，沒變動或失敗時回傳 None"""
+        import feedparser
+
+        # [FIX] Rotate User-Agent and disable SSL verify for problematic feeds
+        headers = {'User-Agent': random.choice(USER_AGENTS)}
+        if feed.etag:
+            headers['If-None-Match'] = feed.etag
+        if feed.last_modified:
+            headers['If-Modified-Since'] = feed.last_modified
+
+        try:
+            response = self.http.get(feed.url, headers=headers, timeout=NEWS_FETCH_TIMEOUT, verify=False)
+        except Exception as e:
+            print(f"Feed parse error for {feed.url}: {e}")
+            feed.errors += 1
+            return None
+
+        feed.status = response.status_code
+        feed.fetched_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        if response.status_code == 304:
+            feed.not_modified += 1
+            return None
+        if response.status_code != 200:
+            print(f"Feed error {feed.url}: {response.status_code}")
+            feed.errors += 1
+            return None
+
+        feed.etag = response.headers.get('ETag')
+        feed.last_modified = response.headers.get('Last-Modified')
+        try:
+            parsed = feedparser.parse(response.content)
+        except Exception as e:
+            print(f"Feed parse error for {feed.url}: {e}")
+            feed.errors += 1
+            return None
+        return parsed.entries[:NEWS_ITEMS_PER_FEED]
+
+    def _ensure_started(self):
+        # 延遲到第一次使用才啟動（Gunicorn fork 之後才建立執行緒）
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="news-refresher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[NEWS] Background refresh failed: {e}")
+
+
+class NewsBriefing:
+    """
+    共用的新聞摘要與語音
+
+    - 每個新聞版本只產生一次摘要（summarize(items) -> 文字），所有用戶共用
+    - 語音（make_audio(summary) -> 網址）每個版本只合成、上傳一次；
+      最近有人聽過語音時，新聞更新後會在背景預先產生
+    - 為了控制費用，兩次重新摘要至少間隔 min_interval 秒，期間沿用上一版
+    - 有資料庫時把語音網址寫入 kv_store，其他 Worker 可直接使用
+    """
+
+    KEY_PREFIX = "news:audio:v2:"  # v2：v1 的網址可能是以 image/png 上傳或 imgbb 備援的音檔
+
+    def __init__(self, service: NewsService, summarize: Callable[[List[Dict]], str],
+                 make_audio: Callable[[str], Optional[str]], database=None,
+                 min_interval: int = NEWS_BRIEFING_MIN_INTERVAL, keep_versions: int = 3):
+        self.service = service
+        self.summarize = summarize
+        self.make_audio = make_audio
+        self.db = database
+        self.min_interval = min_interval
+        self.keep_versions = keep_versions
+        self._artifacts: "OrderedDict[str, Dict]" = OrderedDict()  # {version: {'version', 'summary', 'audio_url', 'created_at'}}
+        self._building: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._audio_demand_at = 0.0
+        self._stats = {'summaries': 0, 'audio': 0, 'served': 0, 'audio_served': 0, 'failures': 0, 'stale': 0}
+        service.add_listener(self._on_news_changed)
+
+    def current(self) -> Optional[Dict]:
+        """目前的新聞摘要（必要時產生）；失敗且沒有舊版時回傳 None"""
+        items = self.service.latest()
+        version = self.service.version
+        latest = self._latest()
+        if latest and (latest['version'] == version or time.time() - latest['created_at'] < self.min_interval):
+            self._count('served')
+            return latest
+        if not items:
+            return latest
+        artifact = self._build(version, items) or latest
+        if artifact:
+            self._count('served')
+        return artifact
+
+    def get(self, version: Optional[str]) -> Optional[Dict]:
+        with self._lock:
+            return self._artifacts.get(version)
+
+    def audio_url(self, version: Optional[str] = None) -> Optional[str]:
+        """
+        取得某版摘要的語音網址（該版本第一次請求時產生，之後共用）
+        version 為 None 時使用目前的摘要；該版本已被淘汰時只使用已保存的語音，
+        沒有時回傳 None（不改用其他版本，避免語音與用戶看到的摘要不一致）
+        """
+        self._audio_demand_at = time.time()
+        artifact = self.current() if version is None else self.get(version)
+        if not artifact:
+            url = self._stored_audio_url(version) if version else None
+            self._count('audio_served' if url else 'stale')
+            return url
+        url = self._ensure_audio(artifact)
+        if url:
+            self._count('audio_served')
+        return url
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latest = next(reversed(self._artifacts.values()), None)
+            return {
+                **self._stats,
+                'versions': list(self._artifacts.keys()),
+                'latest_age': round(time.time() - latest['created_at']) if latest else None,
+            }
+
+    # ---- 內部 ----
+
+    def _latest(self) -> Optional[Dict]:
+        with self._lock:
+            return next(reversed(self._artifacts.values()), None)
+
+    def _build(self, version: str, items: List[Dict]) -> Optional[Dict]:
+        """產生某版的摘要；同一版本同時只會產生一次，其他請求等待結果"""
+        with self._lock:
+            artifact = self._artifacts.get(version)
+            if artifact:
+                return artifact
+            event = self._building.get(version)
+            owner = event is None
+            if owner:
+                event = self._building[version] = threading.Event()
+        if not owner:
+            event.wait(120)
+            return self.get(version)
+
+        try:
+            summary = self.summarize(items)
+            artifact = {'version': version, 'summary': summary, 'audio_url': None, 'created_at': time.time()}
+            with self._lock:
+                self._artifacts[version] = artifact
+                while len(self._artifacts) > self.keep_versions:
+                    self._artifacts.popitem(last=False)
+                self._stats['summaries'] += 1
+            print(f"[NEWS] Built shared summary for version {version}")
+            return artifact
+        except Exception as e:
+            print(f"[NEWS] Summary failed for version {version}: {e}")
+            self._count('failures')
+            return None
+        finally:
+            with self._lock:
+                self._building.pop(version, None)
+            event.set()
+
+    def _ensure_audio(self, artifact: Dict) -> Optional[str]:
+        if artifact.get('audio_url'):
+            return artifact['audio_url']
+        version = artifact['version']
+        key = f"audio:{version}"
+        with self._lock:
+            event = self._building.get(key)
+            owner = event is None
+            if owner:
+                event = self._building[key] = threading.Event()
+        if not owner:
+            event.wait(180)
+            return artifact.get('audio_url')
+
+        try:
+            url = self._stored_audio_url(version)
+            if not url:
+                url = self.make_audio(artifact['summary'])
+                if url:
+                    self._count('audio')
+                    print(f"[NEWS] Built shared audio for version {version}")
+                    if self.db:
+                        try:
+                            self.db.set(self.KEY_PREFIX + version, url, ttl=NEWS_AUDIO_URL_TTL)
+                        except Exception as e:
+                            print(f"[NEWS] Failed to store audio url: {e}")
+                else:
+                    self._count('failures')
+            artifact['audio_url'] = url
+            return url
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+            event.set()
+
+    def _stored_audio_url(self, version: str) -> Optional[str]:
+        if not self.db:
+            return None
+        try:
+            return self.db.get(self.KEY_PREFIX + version)
+        except Exception as e:
+            print(f"[NEWS] Failed to read audio url: {e}")
+            return None
+
+    def _on_news_changed(self, version: str):
+        """新聞更新後（背景執行緒）預先產生摘要，最近有人聽語音時一併產生語音"""
+        latest = self._latest()
+        if latest and time.time() - latest['created_at'] < self.min_interval:
+            return
+        artifact = self._build(version, self.service.latest())
+        if artifact and time.time() - self._audio_demand_at < NEWS_AUDIO_WARM_WINDOW:
+            self._ensure_audio(artifact)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+
+# 全域新聞服務
+news_service = NewsService()
@@ -2,13 +2,14 @@
 使用 AI 動態判斷旅遊地區是否需要細化的輔助函數
 """
 
-def check_region_need_clarification(user_input, model):
+def check_region_need_clarification(user_input, model, cache=None):
     """
     使用 AI 判斷用戶輸入的地區是否過於廣泛，需要進一步細化
     
     Args:
         user_input: 用戶輸入的地區名稱
         model: Gemini AI 模型實例
+        cache: LLMCache 實例（選用），同一個地區只需判斷一次
         
     Returns:
         dict: {
@@ -51,8 +52,12 @@ def check_region_need_clarification(user_input, model):
         import json
         import re
         
-        response = model.generate_content(region_check_prompt)
-        match = re.search(r'\{.*\}', response.text, re.DOTALL)
+        if cache is not None:
+            response_text = cache.generate_text(model, "region_check:v1", region_check_prompt,
+                                                inputs={'region': user_input}, ttl=30 * 24 * 60 * 60)
+        else:
+            response_text = model.generate_content(region_check_prompt).text
+        match = re.search(r'\{.*\}', response_text, re.DOTALL)
         
         if match:
             data = json.loads(match.group())
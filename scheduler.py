@@ -3,7 +3,11 @@
 使用 APScheduler 實作
 """
 import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from linebot.v3.messaging import (
@@ -20,6 +24,13 @@ try:
 except ImportError:
     db = None
 
+# 多個 Worker / 多台機器同時啟動排程器時，只有取得租約者會發送提醒
+SCHEDULER_LEASE_TTL = int(os.environ.get("SCHEDULER_LEASE_TTL", "150"))  # 秒，需大於檢查間隔
+
+REMINDER_PUSH_WORKERS = int(os.environ.get("REMINDER_PUSH_WORKERS", "8"))  # 同時推播的執行緒數
+REMINDER_QUOTA_LIMIT = int(os.environ.get("REMINDER_QUOTA_LIMIT", "450"))  # 當月推播用量上限（免費額度 500，保留 50 緩衝）
+LINE_MAX_MESSAGES_PER_PUSH = 5  # LINE 單次推播最多 5 則訊息
+
 class ReminderScheduler:
     """提醒排程器"""
     
@@ -27,6 +38,17 @@ class ReminderScheduler:
         self.scheduler = BackgroundScheduler()
         self.configuration = Configuration(access_token=line_channel_access_token)
         self.is_running = False
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    
+    def is_leader(self) -> bool:
+        """取得或續約排程器租約；沒有資料庫時視為唯一執行者"""
+        if not db:
+            return True
+        try:
+            return db.acquire_lease('reminder_scheduler', self.owner_id, SCHEDULER_LEASE_TTL)
+        except Exception as e:
+            print(f"Scheduler lease check failed: {e}")
+            return False
     
     def start(self):
         """啟動排程器"""
@@ -39,6 +61,14 @@ class ReminderScheduler:
                 name='Check and send reminders',
                 replace_existing=True
             )
+            # 每小時清除過期的 kv_store 資料（例如前幾天的配額計數）
+            self.scheduler.add_job(
+                func=self.purge_expired_keys,
+                trigger=IntervalTrigger(hours=1),
+                id='kv_store_purger',
+                name='Purge expired kv_store keys',
+                replace_existing=True
+            )
             
             self.scheduler.start()
             self.is_running = True
@@ -52,72 +82,131 @@ class ReminderScheduler:
             print("Reminder scheduler stopped")
     
     def check_and_send_reminders(self):
-        """檢查並發送提醒"""
+        """檢查並發送提醒：每次只查詢一次提醒與額度，依用戶合併後平行推播，最後批次更新狀態（已發送與失敗各自一個交易）"""
         if not db:
             print("Database not available")
             return
         
+        if not self.is_leader():
+            return
+        
         try:
             # 取得待發送的提醒
             pending_reminders = db.get_pending_reminders()
+            if not pending_reminders:
+                return
             
-            for reminder in pending_reminders:
-                result_status = self.send_reminder(
-                    reminder['user_id'],
-                    reminder['reminder_text']
-                )
+            batches = group_reminders(pending_reminders)
+            sent_ids, failed_ids = [], []
+            # 額度不足時改存為待讀取通知的 (user_id, 文字)：passive 隨 sent_ids、failed_passive 隨 failed_ids 寫入
+            passive, failed_passive = [], []
+            
+            with ApiClient(self.configuration) as api_client:
+                line_bot_api = MessagingApi(api_client)
+                
+                # 每次檢查只查詢一次額度，並依剩餘額度決定可推播的批次數
+                budget = self.get_push_budget(line_bot_api)
+                if budget is not None and budget < len(batches):
+                    print(f"Quota nearly exhausted, {len(batches) - max(budget, 0)} reminder batch(es) switched to passive mode")
+                    for user_id, reminders in batches[max(budget, 0):]:
+                        passive.extend((user_id, f"⏰ {r['reminder_text']}") for r in reminders)
+                        sent_ids.extend(r['id'] for r in reminders)  # 視為已處理（被動通知）
+                    batches = batches[:max(budget, 0)]
                 
-                if result_status == 1:
-                    # 標記為已發送 (Success)
-                    db.mark_reminder_sent(reminder['id'])
-                    print(f"Sent reminder {reminder['id']} to user {reminder['user_id']}")
-                elif result_status == 2:
-                    # 標記為因額度失敗 (不再重試)
-                    db.mark_reminder_failed(reminder['id'])
-                    print(f"Reminder {reminder['id']} failed due to quota limit")
+                if batches:
+                    # 不同用戶平行推播；同一用戶的多個批次在同一執行緒依序送出，保持順序
+                    by_user: Dict[str, List[List[Dict]]] = {}
+                    for user_id, reminders in batches:
+                        by_user.setdefault(user_id, []).append(reminders)
+                    
+                    def push_user(user_id):
+                        return [self.push_batch(line_bot_api, user_id, reminders) for reminders in by_user[user_id]]
+                    
+                    workers = min(REMINDER_PUSH_WORKERS, len(by_user))
+                    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reminder-push") as pool:
+                        statuses = dict(zip(by_user, pool.map(push_user, by_user)))
+                    
+                    results = [(user_id, reminders, status)
+                               for user_id in by_user
+                               for reminders, status in zip(by_user[user_id], statuses[user_id])]
+                    for user_id, reminders, status in results:
+                        ids = [r['id'] for r in reminders]
+                        if status == 1:
+                            sent_ids.extend(ids)
+                            print(f"Sent {len(ids)} reminder(s) {ids} to user {user_id}")
+                        elif status == 2:
+                            # 因額度失敗 (不再重試)，改存為待讀取通知
+                            failed_ids.extend(ids)
+                            failed_passive.extend((user_id, f"⏰ {r['reminder_text']} (補)") for r in reminders)
+                            print(f"Reminder(s) {ids} failed due to quota limit")
+                        # status == 0：一般錯誤，保持未發送，下次檢查重試
+            
+            # 已推播的提醒先以獨立交易標記，之後的步驟失敗也不會重複推播
+            db.mark_reminders_sent(sent_ids)
+            db.add_pending_notifications(passive)
+            # 失敗標記確定寫入後才新增 (補) 通知，避免每分鐘重複新增
+            db.mark_reminders_failed(failed_ids)
+            db.add_pending_notifications(failed_passive)
         
         except Exception as e:
             print(f"Error checking reminders: {e}")
     
-    def send_reminder(self, user_id: str, reminder_text: str) -> bool:
-        """發送提醒訊息 (Returns: 1=Success, 0=Fail, 2=Quota Limit)"""
+    def purge_expired_keys(self):
+        """清除過期的 kv_store 資料"""
+        if not db or not self.is_leader():
+            return
         try:
-            with ApiClient(self.configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                
-                # Check Quota First
-                try:
-                    quota = line_bot_api.get_message_quota_consumption()
-                    # 假設免費額度 500，保留 50 緩衝
-                    if quota.total_usage > 450:
-                        print(f"Quota exceeded ({quota.total_usage}), switching to passive mode for {user_id}")
-                        if db:
-                            db.add_pending_notification(user_id, f"⏰ {reminder_text}")
-                        return 1 # Treat as success (handled passively)
-                except Exception as qe:
-                    print(f"Quota check failed, proceeding with caution: {qe}")
-                
-                message_text = f"⏰ **提醒通知** ⏰\n\n{reminder_text}\n\n時間到囉！"
-                
-                line_bot_api.push_message(
-                    PushMessageRequest(
-                        to=user_id,
-                        messages=[TextMessage(text=message_text)]
-                    )
+            deleted = db.purge_expired_keys()
+            if deleted:
+                print(f"Purged {deleted} expired kv_store keys")
+        except Exception as e:
+            print(f"Error purging expired keys: {e}")
+    
+    def get_push_budget(self, line_bot_api) -> Optional[int]:
+        """本次最多可推播的次數（LINE 以收件人計算訊息數，一次推播最多 5 則只算 1 則）；查詢失敗時回傳 None"""
+        try:
+            quota = line_bot_api.get_message_quota_consumption()
+            # 假設免費額度 500，保留 50 緩衝
+            return REMINDER_QUOTA_LIMIT - quota.total_usage
+        except Exception as qe:
+            print(f"Quota check failed, proceeding with caution: {qe}")
+            return None
+    
+    def push_batch(self, line_bot_api, user_id: str, reminders: List[Dict]) -> int:
+        """將同一用戶的提醒（最多 5 則）一次推播 (Returns: 1=Success, 0=Fail, 2=Quota Limit)"""
+        try:
+            line_bot_api.push_message(
+                PushMessageRequest(
+                    to=user_id,
+                    messages=[
+                        TextMessage(text=f"⏰ **提醒通知** ⏰\n\n{r['reminder_text']}\n\n時間到囉！")
+                        for r in reminders
+                    ]
                 )
+            )
             return 1 # Success
         except Exception as e:
             error_str = str(e)
             print(f"Error sending reminder: {e}")
             
-            # If failed due to quota, save as pending
             if "429" in error_str or "monthly limit" in error_str or "quota" in error_str.lower():
-                print(f"Push failed due to quota, saving as pending for {user_id}")
-                if db:
-                     db.add_pending_notification(user_id, f"⏰ {reminder_text} (補)")
+                print(f"Push failed due to quota for {user_id}")
                 return 2 # Quota Limit
             return 0 # Generic Fail
 
+
+def group_reminders(reminders: List[Dict]) -> List[Tuple[str, List[Dict]]]:
+    """依用戶分組（保持時間順序），每組最多 LINE_MAX_MESSAGES_PER_PUSH 則"""
+    by_user: Dict[str, List[Dict]] = {}
+    for reminder in reminders:
+        by_user.setdefault(reminder['user_id'], []).append(reminder)
+    
+    batches = []
+    for user_id, items in by_user.items():
+        for i in range(0, len(items), LINE_MAX_MESSAGES_PER_PUSH):
+            batches.append((user_id, items[i:i + LINE_MAX_MESSAGES_PER_PUSH]))
+    return batches
+
 # 全域排程器實例（需要在 main.py 中初始化）
 scheduler = None
 
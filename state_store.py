@@ -0,0 +1,282 @@
+"""
+狀態存儲模組 - 用戶對話狀態 (State) 的可插拔存儲層
+支援記憶體（單一 Worker）、資料庫（SQLite / PostgreSQL，沿用 DATABASE_URL）與 Redis
+
+透過環境變數 STATE_BACKEND 選擇：
+- memory：預設，等同原本的模組層級 dict，只能跑單一 Worker
+- db：存進 kv_store 表格，多個 Worker / 多台機器可共用
+- redis：存進 Redis（REDIS_URL），任何相容 Redis 協定的服務皆可
+
+注意：狀態中的圖片路徑仍指向本機檔案，多台機器部署時 UPLOAD_FOLDER 需為共用磁碟。
+"""
+import os
+import re
+import json
+import threading
+from collections.abc import MutableMapping
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from bounded_cache import BoundedCache
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory").lower()
+STATE_TTL_SECONDS = int(os.environ.get("STATE_TTL_SECONDS", str(7 * 24 * 60 * 60)))  # 與對話過期時間一致
+STATE_MAX_USERS = int(os.environ.get("STATE_MAX_USERS", "10000"))  # memory 後端每個 namespace 最多保留的用戶數
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.environ.get("STATE_KEY_PREFIX", "state")
+
+
+# ==================
+# 序列化
+# ==================
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, os.PathLike):
+        return os.fspath(value)
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+def encode(value) -> str:
+    """將狀態值轉為 JSON 字串"""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=_json_default)
+
+
+def decode(raw: str):
+    """將 JSON 字串還原為狀態值"""
+    return json.loads(raw, object_hook=_json_object_hook)
+
+
+# ==================
+# 後端
+# ==================
+
+class MemoryBackend:
+    """記憶體後端（僅限單一程序）"""
+
+    name = "memory"
+    shared = False
+
+
+class DatabaseBackend:
+    """資料庫後端：狀態存進 kv_store，key 格式為 state:<namespace>:<key>"""
+
+    name = "db"
+    shared = True
+
+    def __init__(self, database=None, prefix: str = STATE_KEY_PREFIX):
+        if database is None:
+            from database import db as database
+        self.db = database
+        self.prefix = prefix
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def load(self, namespace: str, key: str) -> Optional[str]:
+        return self.db.get(self._key(namespace, key))
+
+    def save(self, namespace: str, key: str, raw: str, ttl: Optional[int] = None):
+        self.db.set(self._key(namespace, key), raw, ttl=ttl)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        return self.db.delete(self._key(namespace, key))
+
+    def keys(self, namespace: str) -> List[str]:
+        head = self._key(namespace, "")
+        return [k[len(head):] for k in self.db.keys_with_prefix(head)]
+
+
+class RedisBackend:
+    """Redis 後端（需安裝 redis 套件；測試時可傳入 fakeredis 等相容的 client）"""
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, client=None, url: str = REDIS_URL, prefix: str = STATE_KEY_PREFIX):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("STATE_BACKEND=redis requires the 'redis' package (pip install redis)")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def load(self, namespace: str, key: str) -> Optional[str]:
+        raw = self.client.get(self._key(namespace, key))
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        return raw
+
+    def save(self, namespace: str, key: str, raw: str, ttl: Optional[int] = None):
+        self.client.set(self._key(namespace, key), raw, ex=ttl or None)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        return self.client.delete(self._key(namespace, key)) > 0
+
+    def keys(self, namespace: str) -> List[str]:
+        head = self._key(namespace, "")
+        result = []
+        # SCAN 的 match 是 glob，key 裡的 * ? [ ] \ 要跳脫，否則會比對到其他 namespace
+        for k in self.client.scan_iter(match=re.sub(r'([*?\[\]\\])', r'\\\1', head) + "*"):
+            if isinstance(k, bytes):
+                k = k.decode('utf-8')
+            result.append(k[len(head):])
+        return result
+
+
+# ==================
+# Namespace
+# ==================
+
+class LocalNamespace(BoundedCache):
+    """記憶體後端的 namespace：有用戶數與閒置時間上限的 dict"""
+
+    def __init__(self, name: str, max_items: Optional[int] = STATE_MAX_USERS, ttl: Optional[int] = None):
+        super().__init__(max_items=max_items, ttl=ttl, name=name)
+
+    def flush(self):
+        pass
+
+
+class SharedNamespace(MutableMapping):
+    """
+    共用後端的 namespace，介面與 dict 相同
+
+    每個執行緒在處理事件期間會快取讀到的值，因此
+    `state = user_meme_state[user_id]; state['stage'] = ...` 這類就地修改也能生效；
+    事件結束時呼叫 flush()，只會把內容有變動的值寫回後端。
+    """
+
+    def __init__(self, name: str, backend, ttl: Optional[int] = None):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _cache(self) -> Dict:
+        cache = getattr(self._local, 'cache', None)
+        if cache is None:
+            cache = self._local.cache = {}  # {key: (value, 已寫入後端的 JSON)}
+        return cache
+
+    def __getitem__(self, key):
+        cache = self._cache()
+        if key in cache:
+            return cache[key][0]
+        raw = self.backend.load(self.name, key)
+        if raw is None:
+            raise KeyError(key)
+        value = decode(raw)
+        cache[key] = (value, raw)
+        return value
+
+    def __setitem__(self, key, value):
+        raw = encode(value)
+        self.backend.save(self.name, key, raw, ttl=self.ttl)
+        self._cache()[key] = (value, raw)
+
+    def __delitem__(self, key):
+        cached = self._cache().pop(key, None)
+        if not self.backend.delete(self.name, key) and cached is None:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self) -> Iterator:
+        return iter(self.backend.keys(self.name))
+
+    def __len__(self) -> int:
+        return len(self.backend.keys(self.name))
+
+    def flush(self):
+        """寫回本執行緒修改過的值，並清除快取"""
+        cache = self._cache()
+        self._local.cache = {}
+        for key, (value, raw) in cache.items():
+            try:
+                new_raw = encode(value)
+                if new_raw != raw:
+                    self.backend.save(self.name, key, new_raw, ttl=self.ttl)
+            except Exception as e:
+                print(f"[STATE] Failed to flush {self.name}:{key}: {e}")
+
+
+# ==================
+# StateStore
+# ==================
+
+class StateStore:
+    """管理所有 namespace，事件處理完畢後呼叫 flush() 寫回狀態"""
+
+    def __init__(self, backend=None, ttl: Optional[int] = STATE_TTL_SECONDS):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self._namespaces: Dict[str, MutableMapping] = {}
+
+    @property
+    def shared(self) -> bool:
+        """是否可被多個 Worker 共用"""
+        return self.backend.shared
+
+    def namespace(self, name: str):
+        """取得（或建立）指定名稱的 namespace"""
+        if name not in self._namespaces:
+            if self.backend.shared:
+                self._namespaces[name] = SharedNamespace(name, self.backend, ttl=self.ttl)
+            else:
+                self._namespaces[name] = LocalNamespace(name, ttl=self.ttl)
+        return self._namespaces[name]
+
+    def flush(self):
+        """將本執行緒的修改寫回後端"""
+        for ns in self._namespaces.values():
+            ns.flush()
+
+    def stats(self) -> Dict:
+        """各 namespace 的容量統計（僅 memory 後端）"""
+        result = {'backend': self.backend.name}
+        for name, ns in self._namespaces.items():
+            if isinstance(ns, BoundedCache):
+                result[name] = ns.stats()
+        return result
+
+
+def create_backend(name: str = STATE_BACKEND):
+    """依名稱建立後端"""
+    if name == "memory":
+        return MemoryBackend()
+    if name in ("db", "database", "sqlite", "postgres"):
+        return DatabaseBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown STATE_BACKEND: {name}")
+
+
+def create_state_store() -> StateStore:
+    """依環境變數建立 StateStore"""
+    backend = create_backend()
+    print(f"[STATE] Using {backend.name} state backend")
+    return StateStore(backend)
+
+
+# 全域狀態存儲實例
+state_store = create_state_store()
@@ -0,0 +1,248 @@
+"""
+語音合成快取模組 - 相同的文字與聲音只合成、上傳一次
+快取 key 為 (文字、聲音設定、音訊設定) 的 SHA-256：
+- 合成結果存成磁碟上的音檔（依最近使用時間淘汰，總大小有上限）
+- 上傳後的公開網址記在記憶體與 kv_store，重複的語句直接回傳網址，不必合成也不必上傳
+- 長文字交給 tts_chunking 切段平行合成
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Callable, Dict, Optional
+
+from bounded_cache import BoundedCache
+from tts_chunking import synthesize_to_file
+
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "")  # 空白時由呼叫端決定（main.py 使用 UPLOAD_FOLDER/tts_cache）
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+TTS_URL_TTL = int(os.environ.get("TTS_URL_TTL", str(7 * 24 * 60 * 60)))  # 公開網址保留時間（需短於儲存空間的清除週期）
+
+KEY_PREFIX = "tts:url:v2:"  # v2：v1 的網址可能是以 image/png 上傳或 imgbb 備援的音檔
+
+_EXTENSIONS = {'MP3': '.mp3', 'OGG_OPUS': '.ogg', 'LINEAR16': '.wav'}
+
+# synthesize(text, voice, audio_config) -> 音訊 bytes
+SynthesizeFn = Callable[[str, Dict, Dict], bytes]
+
+
+def make_tts_key(text: str, voice: Dict, audio_config: Dict) -> str:
+    """計算快取 key（文字只去除前後空白，其餘內容都會影響發音）"""
+    payload = {'text': text.strip(), 'voice': voice, 'audio': audio_config}
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """
+    語音合成快取（執行緒安全）
+
+    - synthesize() 回傳快取中的音檔路徑，未命中才呼叫合成函式
+    - audio_url() 回傳已上傳的公開網址，未命中才合成並上傳
+    - 相同 key 同時有多個請求時只合成一次，其他請求等待結果
+    - 音檔由快取管理，呼叫端不可刪除
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = TTS_CACHE_MAX_BYTES, database=None,
+                 url_ttl: int = TTS_URL_TTL):
+        self.cache_dir = TTS_CACHE_DIR or cache_dir
+        self.max_bytes = max_bytes
+        self.db = database
+        self.url_ttl = url_ttl
+        self.urls = BoundedCache(max_items=5000, name="tts_urls")  # {key: (到期時間, 網址)}
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # {檔名: 大小}，依最近使用排序
+        self._bytes = 0
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'url_hits': 0, 'uploads': 0, 'evictions': 0}
+        self._load_index()
+
+    def synthesize(self, text: str, voice: Dict, audio_config: Dict, synthesize: SynthesizeFn) -> Optional[str]:
+        """取得（必要時合成）音檔路徑；合成失敗時回傳 None"""
+        key = make_tts_key(text, voice, audio_config)
+        filename = key + _EXTENSIONS.get(audio_config.get('audio_encoding'), '.bin')
+        path = os.path.join(self.cache_dir, filename)
+
+        while True:
+            if self._touch(filename, path):
+                self._count('hits')
+                return path
+            with self._lock:
+                event = self._inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = self._inflight[key] = threading.Event()
+            if owner:
+                break
+            event.wait(120)
+
+        try:
+            self._count('misses')
+            try:
+                # 長文字會切段平行合成，並依序直接寫入檔案
+                size = self._write(filename, path, lambda out: synthesize_to_file(
+                    text, voice, audio_config, synthesize, out))
+            except Exception as e:
+                print(f"[TTS CACHE] Synthesis failed: {e}")
+                return None
+            return path if size else None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def audio_url(self, text: str, voice: Dict, audio_config: Dict, synthesize: SynthesizeFn,
+                  upload: Callable[[str], Optional[str]]) -> Optional[str]:
+        """取得音檔的公開網址；已上傳過的語句直接回傳，否則合成後以 upload(路徑) 上傳"""
+        key = make_tts_key(text, voice, audio_config)
+        url = self._lookup_url(key)
+        if url:
+            self._count('url_hits')
+            return url
+
+        path = self.synthesize(text, voice, audio_config, synthesize)
+        if not path:
+            return None
+        try:
+            url = upload(path)
+        except Exception as e:
+            print(f"[TTS CACHE] Upload failed: {e}")
+            return None
+        if url:
+            self._count('uploads')
+            self._store_url(key, url)
+        return url
+
+    def stats(self) -> Dict:
+        """命中率與磁碟用量（監控用）"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['files'] = len(self._files)
+            stats['bytes'] = self._bytes
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 3) if total else 0.0
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+    # ---- 內部 ----
+
+    def _load_index(self):
+        """啟動時讀取既有的音檔（重新部署前合成的檔案仍可使用），依修改時間排序"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.tmp'):
+                    continue
+                full = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name, st.st_size))
+        except OSError as e:
+            print(f"[TTS CACHE] Cannot use cache dir {self.cache_dir}: {e}")
+            return
+        with self._lock:
+            for _, name, size in sorted(entries):
+                self._files[name] = size
+                self._bytes += size
+        self._evict()
+
+    def _touch(self, filename: str, path: str) -> bool:
+        with self._lock:
+            known = filename in self._files
+            if known:
+                self._files.move_to_end(filename)
+        try:
+            if not known:
+                # 其他 Worker 合成的音檔（共用同一個目錄）也直接使用
+                size = os.path.getsize(path)
+                with self._lock:
+                    if filename not in self._files:
+                        self._files[filename] = size
+                        self._bytes += size
+            os.utime(path)  # 更新修改時間，重新啟動後仍保留使用順序
+            return True
+        except OSError:
+            # 檔案不存在或已被刪除（例如其他 Worker 淘汰），視為未命中
+            with self._lock:
+                size = self._files.pop(filename, None)
+                if size is not None:
+                    self._bytes -= size
+            return False
+
+    def _write(self, filename: str, path: str, produce: Callable[[BinaryIO], int]) -> int:
+        """以 produce(檔案) 寫入音檔，回傳大小；寫到暫存檔後再改名，其他執行緒不會讀到寫一半的檔案"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                size = produce(f)
+            if not size:
+                os.remove(tmp_path)
+                return 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._bytes += size - self._files.pop(filename, 0)
+            self._files[filename] = size
+        self._evict(keep=filename)
+        return size
+
+    def _evict(self, keep: Optional[str] = None):
+        """超過大小上限時，刪除最久沒用的音檔"""
+        removed = []
+        with self._lock:
+            while self._bytes > self.max_bytes and self._files:
+                name, size = next(iter(self._files.items()))
+                if name == keep:
+                    break
+                del self._files[name]
+                self._bytes -= size
+                self._stats['evictions'] += 1
+                removed.append(name)
+        for name in removed:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def _lookup_url(self, key: str) -> Optional[str]:
+        entry = self.urls.get(key)
+        if entry is not None:
+            expires_at, url = entry
+            if expires_at > time.time():
+                return url
+            self.urls.pop(key, None)
+        if not self.db:
+            return None
+        try:
+            url = self.db.get(KEY_PREFIX + key)
+        except Exception as e:
+            print(f"[TTS CACHE] Read error: {e}")
+            return None
+        if url:
+            # kv_store 的 TTL 已保證未過期；記憶體中保守地只保留一小時
+            self.urls[key] = (time.time() + min(self.url_ttl, 3600), url)
+        return url
+
+    def _store_url(self, key: str, url: str):
+        self.urls[key] = (time.time() + self.url_ttl, url)
+        if not self.db:
+            return
+        try:
+            self.db.set(KEY_PREFIX + key, url, ttl=self.url_ttl)
+        except Exception as e:
+            print(f"[TTS CACHE] Write error: {e}")
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
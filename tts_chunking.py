@@ -0,0 +1,147 @@
+"""
+長文字語音合成模組 - 依句子切段、平行合成、直接串接 MP3
+- Google Cloud TTS 每個請求的輸入上限為 5000 bytes（中文約 1600 字），長篇新聞或行程會失敗或很慢
+- 依中文標點在句子邊界切段，各段同時合成
+- MP3 以音框（frame）為單位串接，不重新編碼；每段開頭的 ID3 / Xing 標頭會移除
+- 依順序一段段寫入輸出檔，不必等全部合成完成、也不必把整個音檔放在記憶體
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional
+
+TTS_MAX_REQUEST_BYTES = 4800  # API 上限 5000 bytes，保留緩衝
+TTS_CHUNK_BYTES = int(os.environ.get("TTS_CHUNK_BYTES", "1500"))  # 每段目標大小（越小越能平行，但請求數越多）
+TTS_CHUNK_WORKERS = int(os.environ.get("TTS_CHUNK_WORKERS", "6"))  # 同時合成的段數
+
+# 句子結尾（保留標點在句子內）；逗號等只在句子過長時才用來切分
+_SENTENCE_END = re.compile(r'(?<=[。！？；!?;…\n])')
+_CLAUSE_END = re.compile(r'(?<=[，、：,:）)」』])')
+
+# MP3 音框標頭表（Layer III）
+_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],  # MPEG-1
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],  # MPEG-2 / 2.5
+}
+_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _utf8_len(text: str) -> int:
+    return len(text.encode('utf-8'))
+
+
+def _pieces(text: str, pattern, max_bytes: int) -> Iterator[str]:
+    """依 pattern 切分；仍然過長的片段改用更細的規則，最後才直接依長度切"""
+    for piece in pattern.split(text):
+        if not piece:
+            continue
+        if _utf8_len(piece) <= max_bytes:
+            yield piece
+        elif pattern is _SENTENCE_END:
+            yield from _pieces(piece, _CLAUSE_END, max_bytes)
+        else:
+            current, current_bytes = "", 0
+            for char in piece:
+                size = _utf8_len(char)
+                if current_bytes + size > max_bytes:
+                    yield current
+                    current, current_bytes = "", 0
+                current += char
+                current_bytes += size
+            if current:
+                yield current
+
+
+def split_text(text: str, chunk_bytes: int = TTS_CHUNK_BYTES, max_bytes: int = TTS_MAX_REQUEST_BYTES) -> List[str]:
+    """
+    把長文字切成適合 TTS 的段落
+    盡量在句子結尾切分，並把相鄰的短句合併到約 chunk_bytes；每段保證不超過 max_bytes
+    """
+    chunk_bytes = min(chunk_bytes, max_bytes)
+    chunks = []
+    current, current_bytes = "", 0
+    for piece in _pieces(text.strip(), _SENTENCE_END, max_bytes):
+        size = _utf8_len(piece)
+        if current and current_bytes + size > chunk_bytes:
+            chunks.append(current)
+            current, current_bytes = "", 0
+        current += piece
+        current_bytes += size
+    if current.strip():
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def _frame_length(header: bytes) -> Optional[int]:
+    """解析 MP3 音框標頭，回傳整個音框的長度；不是 Layer III 音框時回傳 None"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03  # 3=MPEG-1, 2=MPEG-2, 0=MPEG-2.5
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = (header[2] >> 4) & 0x0F
+    rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+
+def mp3_frames(data: bytes) -> Iterator[bytes]:
+    """
+    取出 MP3 中的音訊音框（略過 ID3v2 / ID3v1 標籤與 Xing / Info 資訊音框）
+    同參數的 CBR 音框可以直接串接成一個合法的 MP3
+    """
+    pos = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size
+    end = len(data) - 128 if data[-128:-125] == b'TAG' else len(data)
+
+    first = True
+    while pos + 4 <= end:
+        length = _frame_length(data[pos:pos + 4])
+        if length is None:
+            pos += 1  # 找下一個同步字
+            continue
+        if pos + length > end:
+            break  # 最後一個音框被截斷，串接後會在結尾產生雜音
+        frame = data[pos:pos + length]
+        pos += length
+        if first:
+            first = False
+            # 第一個音框可能是 Xing / Info 標頭（記錄單段的長度，串接後會錯誤），不屬於音訊
+            if b'Xing' in frame[:64] or b'Info' in frame[:64]:
+                continue
+        yield frame
+
+
+def synthesize_to_file(text: str, voice: Dict, audio_config: Dict,
+                       synthesize: Callable[[str, Dict, Dict], bytes], out: BinaryIO,
+                       chunk_bytes: int = TTS_CHUNK_BYTES, workers: int = TTS_CHUNK_WORKERS) -> int:
+    """
+    合成（可能很長的）文字並寫入 out，回傳寫入的 bytes 數
+    只有 MP3 可以串接；其他格式不切段，以單一請求合成
+    """
+    if audio_config.get('audio_encoding') != 'MP3' or _utf8_len(text) <= chunk_bytes:
+        audio = synthesize(text, voice, audio_config)
+        if not audio:
+            return 0
+        out.write(audio)
+        return len(audio)
+
+    chunks = split_text(text, chunk_bytes)
+    if len(chunks) == 1:
+        return synthesize_to_file(chunks[0], voice, audio_config, synthesize, out, chunk_bytes=TTS_MAX_REQUEST_BYTES)
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks)), thread_name_prefix="tts-chunk") as pool:
+        # map 依原本順序回傳：前面的段落完成就先寫入，不必等所有段落
+        for audio in pool.map(lambda chunk: synthesize(chunk, voice, audio_config), chunks):
+            if not audio:
+                raise ValueError("TTS returned empty audio for a chunk")
+            for frame in mp3_frames(audio):
+                out.write(frame)
+                written += len(frame)
+    return written